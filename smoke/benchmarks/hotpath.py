@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the code run for each line of output of the jobs.
+
+Replays spark-shell output through `BaseRemoteCommand._process_incoming_line`
+(the parsers) and a real `MessageService` (messages, log sink), with Redis
+replaced by an in-process fake. The output is generated from the lines of
+`smoke.tests.sample_lines`: the startup of spark-shell, followed by stages
+of tasks (the lines logged by TaskSetManager and BlockManager) mixed with
+output of the script and messages from shell.
+
+Reports the lines per second, the p50 and p99 latency per line and the net
+allocations per line (objects tracked by the garbage collector), and
+exits with status 1 if any result is worse than the thresholds
+in `hotpath_thresholds.json`.
+
+Usage:
+
+    $ env DJANGO_SETTINGS_MODULE=smoke.settings \\
+        python -m smoke.benchmarks.hotpath --lines 2000000
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import array
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import timeit
+
+from smoke.benchmarks.parsers import SAMPLE_COOKIE, get_sample_sublines
+from smoke.services import remote
+from smoke.services.messages import MessageService
+
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__),
+                               "hotpath_thresholds.json")
+
+CHUNK_SIZE = 100000
+"""Lines generated (and kept in memory) at a time"""
+
+TASK_LINES = (
+    "14/09/13 12:28:47 INFO scheduler.TaskSetManager: Starting task "
+    "{stage}.0:{index} as TID {tid} on executor {executor}: {host} "
+    "(NODE_LOCAL)",
+    "14/09/13 12:28:47 INFO scheduler.TaskSetManager: Serialized task "
+    "{stage}.0:{index} as 1970 bytes in 1 ms",
+    "14/09/13 12:28:53 INFO storage.BlockManagerInfo: Added rdd_2_{index} "
+    "in memory on {host}:39813 (size: 1834.0 KB, free: 508.6 MB)",
+    "14/09/13 12:28:53 INFO scheduler.TaskSetManager: Finished TID {tid} "
+    "in {ms} ms on {host} (progress: {done}/{total})",
+    "14/09/13 12:28:53 INFO scheduler.DAGScheduler: Completed "
+    "ResultTask({stage}, {index})",
+)
+"""Lines logged for each task"""
+
+OUTPUT_LINE = "res{0}: Array[String] = Array(line {0}, of the output)"
+
+MESSAGE_FROM_SHELL_LINE = \
+    '@@<msgFromShell cookie="{0}"><outputFileName>/tmp/output-{1}' \
+    '</outputFileName></msgFromShell>@@'
+
+
+def generate_lines(count, seed=0):
+    """Yields `count` lines: the startup of spark-shell (from the sample
+    lines), followed by stages of tasks, with output of the script
+    (~5% of the lines) and messages from shell (~0.1%)
+    """
+    rng = random.Random(seed)
+    sample = get_sample_sublines()
+    startup = sample[:[i for i, line in enumerate(sample)
+                       if "TaskSetManager" in line][0]]
+    hosts = ["hadoop-worker{0:02d}.hadoop.dev.docker.data-tsunami.com".format(
+        i) for i in range(12)]
+
+    generated = 0
+    for line in startup:
+        if generated == count:
+            return
+        yield line
+        generated += 1
+
+    tid = 0
+    stage = 0
+    while True:
+        stage += 1
+        total = rng.choice((10, 70, 200, 1000))
+        for index in range(total):
+            values = {'stage': stage, 'index': index, 'tid': tid,
+                      'executor': rng.randint(1, len(hosts)),
+                      'host': rng.choice(hosts),
+                      'ms': int(rng.lognormvariate(8, 0.5)),
+                      'done': index + 1, 'total': total}
+            tid += 1
+            for template in TASK_LINES:
+                if rng.random() < 0.05:
+                    line = OUTPUT_LINE.format(generated)
+                elif rng.random() < 0.001:
+                    line = MESSAGE_FROM_SHELL_LINE.format(SAMPLE_COOKIE,
+                                                          generated)
+                else:
+                    line = template.format(**values)
+                if generated == count:
+                    return
+                yield line
+                generated += 1
+
+
+def iter_chunks(lines):
+    """Groups the lines in lists of CHUNK_SIZE lines"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class FakeRedisConnection(object):
+    """In-process fake of the Redis connection of the publisher: counts
+    the commands of the executed pipelines
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.pipelines = 0
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+
+class FakeRedisPipeline(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = 0
+
+    def _command(self, *args):
+        self.commands += 1
+
+    publish = setex = rpush = ltrim = expire = _command
+
+    def execute(self):
+        self.connection.commands += self.commands
+        self.connection.pipelines += 1
+
+
+def create_command():
+    """Returns a remote command whose MessageService uses a fake Redis"""
+    message_service = MessageService(SAMPLE_COOKIE)
+    connection = FakeRedisConnection()
+    message_service._redis_publisher._connection = connection
+    return remote.Echo(message_service, SAMPLE_COOKIE), connection
+
+
+def measure_latencies(count):
+    """Passes `count` lines to `_process_incoming_line()`
+
+    :returns: (seconds, latencies of each line as an array, the fake
+        Redis connection)
+    """
+    command, connection = create_command()
+    process = command._process_incoming_line
+    timer = timeit.default_timer
+    latencies = array.array(str('d'))
+    for chunk in iter_chunks(generate_lines(count)):
+        for line in chunk:
+            start = timer()
+            process(SAMPLE_COOKIE, line)
+            latencies.append(timer() - start)
+    command.parser_dispatcher.flush()
+    command.message_service.flush()
+    command.message_service.close()
+    return sum(latencies), latencies, connection
+
+
+def measure_allocations(count):
+    """Returns the net allocations per line (objects tracked by the
+    garbage collector, the collector is disabled meanwhile)
+    """
+    lines = list(generate_lines(count))
+    command, _ = create_command()
+    process = command._process_incoming_line
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for line in lines:
+            process(SAMPLE_COOKIE, line)
+        allocations = gc.get_count()[0] - before
+    finally:
+        gc.enable()
+        command.message_service.flush()
+        command.message_service.close()
+    return float(allocations) / count
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)),
+                             len(sorted_values) - 1)]
+
+
+def run(count, allocation_lines):
+    """Runs the benchmark, returns the results (dict)"""
+    seconds, latencies, connection = measure_latencies(count)
+    latencies = sorted(latencies)
+    return {
+        'lines': count,
+        'lines_per_sec': count / seconds,
+        'p50_latency_us': percentile(latencies, 0.5) * 1e6,
+        'p99_latency_us': percentile(latencies, 0.99) * 1e6,
+        'allocations_per_line': measure_allocations(
+            min(count, allocation_lines)),
+        'redis_commands': connection.commands,
+        'redis_pipelines': connection.pipelines,
+    }
+
+
+def check_thresholds(results, thresholds):
+    """Returns the descriptions of the results worse than the thresholds"""
+    failures = []
+    for name, minimum in thresholds.get('min', {}).items():
+        if results[name] < minimum:
+            failures.append("{0}: {1:.2f} < {2}".format(name, results[name],
+                                                         minimum))
+    for name, maximum in thresholds.get('max', {}).items():
+        if results[name] > maximum:
+            failures.append("{0}: {1:.2f} > {2}".format(name, results[name],
+                                                         maximum))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=1000000,
+                        help="number of lines to process")
+    parser.add_argument('--allocation-lines', type=int, default=100000,
+                        help="number of lines to measure the allocations")
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH,
+                        help="JSON file with the thresholds")
+    args = parser.parse_args()
+
+    # The lines handled by the parsers are logged (see log_and_publish())
+    logging.disable(logging.INFO)
+    results = run(args.lines, args.allocation_lines)
+
+    print("Lines:                {0}".format(results['lines']))
+    print("Lines/sec:            {0:.0f}".format(results['lines_per_sec']))
+    print("p50 latency:          {0:.2f} us".format(
+        results['p50_latency_us']))
+    print("p99 latency:          {0:.2f} us".format(
+        results['p99_latency_us']))
+    print("Allocations per line: {0:.2f}".format(
+        results['allocations_per_line']))
+    print("Redis commands:       {0} in {1} pipelines".format(
+        results['redis_commands'], results['redis_pipelines']))
+
+    with open(args.thresholds) as thresholds_file:
+        failures = check_thresholds(results, json.load(thresholds_file))
+    for failure in failures:
+        print("FAILED: {0}".format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
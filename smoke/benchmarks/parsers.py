@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parsing of the spark-shell output.
+
+Replays the lines of `smoke.tests.sample_lines`, repeated up to the
+requested number of lines, through the registered parsers: first trying
+every parser with every line (as done before ParserDispatcher existed),
+and then using ParserDispatcher.
+
+Usage:
+
+    $ env DJANGO_SETTINGS_MODULE=smoke.settings \\
+        python -m smoke.benchmarks.parsers --lines 2000000
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import itertools
+import time
+
+from smoke.services.parsers import ParserDispatcher
+from smoke.tests import sample_lines
+
+
+SAMPLE_COOKIE = "00b623f78474403490e352cd02e1c423"
+"""Cookie of the message from shell in `sample_lines`"""
+
+
+class NullMessageService(object):
+    """MessageService that only counts the messages"""
+
+    def __init__(self):
+        self.count = 0
+
+    def publish_message(self, line, **kwargs):
+        self.count += 1
+
+    def log_and_publish(self, message, *args, **kwargs):
+        self.count += 1
+
+    def log_and_publish_error(self, message, *args, **kwargs):
+        self.count += 1
+
+
+def get_sample_sublines():
+    """Returns the sample lines, splitted as done by `_read_stdout()`"""
+    return [subline.rstrip()
+            for line in sample_lines.LINES
+            for subline in line.splitlines() if subline.strip()]
+
+
+def generate_lines(count):
+    """Returns `count` lines, repeating the sample lines"""
+    return list(itertools.islice(itertools.cycle(get_sample_sublines()),
+                                 count))
+
+
+def run_every_parser(lines):
+    """Tries each parser on each line, without prefilters"""
+    dispatcher = ParserDispatcher(NullMessageService(), SAMPLE_COOKIE)
+    parsers = dispatcher.parsers
+    for line in lines:
+        for parser in parsers:
+            if parser.parse(line):
+                break
+
+
+def run_dispatcher(lines):
+    """Passes each line to ParserDispatcher"""
+    dispatcher = ParserDispatcher(NullMessageService(), SAMPLE_COOKIE)
+    dispatch = dispatcher.dispatch
+    for line in lines:
+        dispatch(line)
+    dispatcher.flush()
+
+
+def measure(function, lines):
+    """Runs `function(lines)`
+
+    :returns: lines per second
+    """
+    start = time.time()
+    function(lines)
+    return len(lines) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=1000000,
+                        help="number of lines to parse")
+    args = parser.parse_args()
+
+    lines = generate_lines(args.lines)
+
+    print("Lines: {0}".format(len(lines)))
+    every_parser = measure(run_every_parser, lines)
+    print("Every parser:     {0:12.0f} lines/sec".format(every_parser))
+    dispatcher = measure(run_dispatcher, lines)
+    print("ParserDispatcher: {0:12.0f} lines/sec ({1:.1f}x)".format(
+        dispatcher, dispatcher / every_parser))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the decoding of the messages from shell.
+
+Decodes the same messages (an output file name, and a message with
+metrics, a table and a progress) with the DOM of `xml.dom.minidom` (as
+done before `smoke.services.shellmessages` existed), the expat decoder
+and the JSON decoder, and reports the cost per message.
+
+Usage:
+
+    $ env DJANGO_SETTINGS_MODULE=smoke.settings \\
+        python -m smoke.benchmarks.shellmessages --messages 100000
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import timeit
+from xml.dom.minidom import parseString
+
+from smoke.benchmarks.parsers import SAMPLE_COOKIE
+from smoke.services import shellmessages
+
+
+OUTPUT_FILE_XML = (
+    '<msgFromShell cookie="{0}"><outputFileName>/movies/output-1410622127179'
+    '</outputFileName></msgFromShell>'.format(SAMPLE_COOKIE))
+
+TYPED_XML = (
+    '<msgFromShell cookie="{0}">'
+    '<metric name="rows">1500</metric><metric name="ratio">0.25</metric>'
+    '<table><columns><cell>word</cell><cell>count</cell></columns>'
+    '<row><cell>spark</cell><cell>10</cell></row>'
+    '<row><cell>smoke</cell><cell>7</cell></row></table>'
+    '<progress done="3" total="10"/>'
+    '</msgFromShell>'.format(SAMPLE_COOKIE))
+
+OUTPUT_FILE_JSON = shellmessages.encode_json(
+    SAMPLE_COOKIE, outputFileName="/movies/output-1410622127179")[2:-2]
+
+TYPED_JSON = shellmessages.encode_json(
+    SAMPLE_COOKIE, metrics={'rows': 1500, 'ratio': 0.25},
+    table={'columns': ["word", "count"],
+           'rows': [["spark", "10"], ["smoke", "7"]]},
+    progress={'done': 3, 'total': 10})[2:-2]
+
+
+def decode_with_minidom(text):
+    """Decodes the output file name of a message the old way: building
+    the DOM and looking for the elements (typed payloads are unsupported)
+    """
+    root = parseString(text)
+    cookie = root.getElementsByTagName(
+        'msgFromShell')[0].attributes['cookie'].value
+    errors = root.getElementsByTagName('errorLine')
+    output_filenames = root.getElementsByTagName('outputFileName')
+    output_filename = output_filenames[0].firstChild.data.strip() \
+        if output_filenames else None
+    return cookie, errors, output_filename
+
+
+def measure(function, text, count):
+    """Returns the microseconds per call of `function(text)`"""
+    seconds = min(timeit.repeat(lambda: function(text), number=count,
+                                repeat=3))
+    return seconds / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=100000,
+                        help="number of messages to decode")
+    args = parser.parse_args()
+
+    cases = (
+        ("minidom, output file", decode_with_minidom, OUTPUT_FILE_XML),
+        ("expat, output file", shellmessages.decode, OUTPUT_FILE_XML),
+        ("JSON, output file", shellmessages.decode, OUTPUT_FILE_JSON),
+        ("minidom, typed", decode_with_minidom, TYPED_XML),
+        ("expat, typed", shellmessages.decode, TYPED_XML),
+        ("JSON, typed", shellmessages.decode, TYPED_JSON),
+    )
+
+    print("Messages: {0}".format(args.messages))
+    baseline = {}
+    for name, function, text in cases:
+        microseconds = measure(function, text, args.messages)
+        kind = name.split(", ")[1]
+        baseline.setdefault(kind, microseconds)
+        print("{0:<22} {1:8.2f} us/message ({2:.1f}x)".format(
+            name, microseconds, baseline[kind] / microseconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Load test: launches concurrent jobs through a running Smoke (web server,
+Celery workers, Redis, websocket) and reports the latencies.
+
+Each job is posted like the browser does (`post_job`), and followed on
+its websocket channel (and the backlog, for the messages published before
+subscribing) until the job is saved.
+
+With the fake remote (`smoke/dev/fake_remote/ssh` in `SSH_BASE_ARGS`),
+the whole stack can be tested on one box, without a cluster:
+
+    $ python smoke/dev/load_test.py --url http://localhost:8000 --jobs 20
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import base64
+import cookielib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+
+DEFAULT_SCRIPT = """\
+println("load test")
+sc.parallelize(1 to 1000).count()
+sc.parallelize(1 to 1000).saveAsTextFile("/tmp/load-test")
+exit
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", ".."))
+from smoke.services.wire import decode_frame
+
+FACILITY_LABEL = "liveLogsAndEvents"
+"""Default of the setting `REDIS_PUBLISHER_FACILITY_LABEL`"""
+
+FINISH_FLAGS = ('jobFinishedOk', 'jobFinishedWithError', 'jobCancelled')
+
+
+#==============================================================================
+# Minimal websocket client (RFC 6455, only text frames from the server)
+#==============================================================================
+
+class WebSocket(object):
+
+    def __init__(self, url, timeout):
+        parsed = urlparse.urlparse(url)
+        self._socket = socket.create_connection(
+            (parsed.hostname, parsed.port or 80), timeout)
+        key = base64.b64encode(os.urandom(16))
+        request = ("GET {0} HTTP/1.1\r\n"
+                   "Host: {1}\r\n"
+                   "Upgrade: websocket\r\n"
+                   "Connection: Upgrade\r\n"
+                   "Sec-WebSocket-Key: {2}\r\n"
+                   "Sec-WebSocket-Version: 13\r\n\r\n").format(
+            parsed.path + ("?" + parsed.query if parsed.query else ""),
+            parsed.netloc, key)
+        self._socket.sendall(request.encode('ascii'))
+        self._buffer = b""
+        headers = self._read_until(b"\r\n\r\n")
+        if b" 101 " not in headers.split(b"\r\n")[0]:
+            raise IOError("Websocket handshake failed: {0!r}".format(headers))
+
+    def _read_until(self, delimiter):
+        while delimiter not in self._buffer:
+            self._fill()
+        data, self._buffer = self._buffer.split(delimiter, 1)
+        return data
+
+    def _read(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _fill(self):
+        data = self._socket.recv(65536)
+        if not data:
+            raise IOError("Websocket closed")
+        self._buffer += data
+
+    def receive(self):
+        """Returns the next text message"""
+        message = b""
+        while True:
+            first, second = struct.unpack(b"!BB", self._read(2))
+            length = second & 0x7f
+            if length == 126:
+                length = struct.unpack(b"!H", self._read(2))[0]
+            elif length == 127:
+                length = struct.unpack(b"!Q", self._read(8))[0]
+            payload = self._read(length)
+            opcode = first & 0x0f
+            if opcode == 0x8:
+                raise IOError("Websocket closed")
+            if opcode in (0x0, 0x1):
+                message += payload
+                if first & 0x80:
+                    return message.decode('utf-8')
+
+    def close(self):
+        self._socket.close()
+
+
+#==============================================================================
+# Jobs
+#==============================================================================
+
+class Client(object):
+    """HTTP client of Smoke (keeps the cookies, like a browser)"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.cookies = cookielib.CookieJar()
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(self.cookies))
+        self.opener.open(self.base_url + "/").read()
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == "csrftoken":
+                return cookie.value
+        raise IOError("The server didn't set the CSRF cookie")
+
+    def post_job(self, script, action):
+        """Posts a job, returns its cookie"""
+        data = urllib.urlencode({'script': script.encode('utf-8'),
+                                 'action': action,
+                                 'csrfmiddlewaretoken': self._csrf_token()})
+        request = urllib2.Request(self.base_url + "/post_job", data,
+                                  {'Referer': self.base_url + "/"})
+        return json.load(self.opener.open(request))['cookie']
+
+    def job_backlog(self, cookie):
+        return decode_frame(self.opener.open(
+            "{0}/job_backlog/{1}?after=-1".format(self.base_url,
+                                                  cookie)).read())
+
+
+class JobRun(object):
+    """A job launched by the load test: its times (seconds since it was
+    posted) and result
+    """
+
+    def __init__(self):
+        self.first_message = None
+        self.finished = None
+        self.saved = None
+        self.status = None
+        self.messages = 0
+        self.error = None
+
+    def handle(self, message, elapsed):
+        """Handles a message of the job, returns True once it's saved"""
+        self.messages += 1
+        if self.first_message is None:
+            self.first_message = elapsed
+        for flag in FINISH_FLAGS:
+            if message.get(flag) and self.finished is None:
+                self.finished = elapsed
+                self.status = flag
+        if message.get('savedJobId'):
+            self.saved = elapsed
+            return True
+        return False
+
+
+def run_job(client, ws_url, script, action, timeout):
+    run = JobRun()
+    start = time.time()
+    try:
+        cookie = client.post_job(script, action)
+        ws = WebSocket("{0}{1}-{2}?subscribe-broadcast".format(
+            ws_url, FACILITY_LABEL, cookie), timeout)
+        try:
+            seen = set()
+            for message in client.job_backlog(cookie):
+                seen.add(message.get('seq'))
+                if run.handle(message, time.time() - start):
+                    return run
+            while time.time() - start < timeout:
+                try:
+                    messages = decode_frame(ws.receive())
+                except ValueError:
+                    continue  # heartbeat
+                for message in messages:
+                    if message.get('seq') is not None and \
+                            message['seq'] in seen:
+                        continue
+                    if run.handle(message, time.time() - start):
+                        return run
+            run.error = "timeout"
+        finally:
+            ws.close()
+    except Exception as e:
+        run.error = "{0}: {1}".format(e.__class__.__name__, e)
+    return run
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)),
+                             len(sorted_values) - 1)]
+
+
+def summarize(name, values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return "{0:<16} -".format(name)
+    return "{0:<16} min {1:7.2f}s  p50 {2:7.2f}s  p90 {3:7.2f}s  " \
+        "max {4:7.2f}s".format(name, values[0], percentile(values, 0.5),
+                               percentile(values, 0.9), values[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default="http://localhost:8000",
+                        help="URL of Smoke")
+    parser.add_argument('--ws-url', default=None,
+                        help="URL of the websockets (default: the /ws/ of "
+                        "--url)")
+    parser.add_argument('--jobs', type=int, default=10,
+                        help="number of concurrent jobs")
+    parser.add_argument('--action', default="spark-shell",
+                        help="action of the jobs")
+    parser.add_argument('--script', default=None,
+                        help="file with the script (default: a short "
+                        "script that runs 2 stages)")
+    parser.add_argument('--timeout', type=float, default=600,
+                        help="max. seconds to wait for each job")
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as script_file:
+            script = script_file.read().decode('utf-8')
+    ws_url = args.ws_url or \
+        "ws://" + urlparse.urlparse(args.url).netloc + "/ws/"
+
+    client = Client(args.url)
+    runs = [None] * args.jobs
+
+    def launch(index):
+        runs[index] = run_job(client, ws_url, script, args.action,
+                              args.timeout)
+
+    start = time.time()
+    threads = [threading.Thread(target=launch, args=(i,))
+               for i in range(args.jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    statuses = {}
+    for run in runs:
+        status = run.error or run.status or "unknown"
+        statuses[status] = statuses.get(status, 0) + 1
+    print("Jobs:            {0} in {1:.2f}s".format(args.jobs, elapsed))
+    for status, count in sorted(statuses.items()):
+        print("  {0}: {1}".format(status, count))
+    print("Messages:        {0}".format(sum(run.messages for run in runs)))
+    print(summarize("First message", [run.first_message for run in runs]))
+    print(summarize("Finished", [run.finished for run in runs]))
+    print(summarize("Saved", [run.saved for run in runs]))
+
+
+if __name__ == '__main__':
+    main()
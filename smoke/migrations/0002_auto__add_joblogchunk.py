@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'JobLogChunk'
+        db.create_table(u'smoke_joblogchunk', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('job', self.gf('django.db.models.fields.related.ForeignKey')(related_name=u'log_chunks', to=orm['smoke.Job'])),
+            ('index', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('first_line', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('line_count', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('raw_size', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('data', self.gf('django.db.models.fields.BinaryField')()),
+        ))
+        db.send_create_signal(u'smoke', ['JobLogChunk'])
+
+        # Adding unique constraint on 'JobLogChunk', fields ['job', 'index']
+        db.create_unique(u'smoke_joblogchunk', ['job_id', 'index'])
+
+        # Adding index on 'JobLogChunk', fields ['job', 'first_line']
+        db.create_index(u'smoke_joblogchunk', ['job_id', 'first_line'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'JobLogChunk', fields ['job', 'first_line']
+        db.delete_index(u'smoke_joblogchunk', ['job_id', 'first_line'])
+
+        # Removing unique constraint on 'JobLogChunk', fields ['job', 'index']
+        db.delete_unique(u'smoke_joblogchunk', ['job_id', 'index'])
+
+        # Deleting model 'JobLogChunk'
+        db.delete_table(u'smoke_joblogchunk')
+
+
+    models = {
+        u'smoke.job': {
+            'Meta': {'object_name': 'Job'},
+            'end': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'log': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'script': ('django.db.models.fields.TextField', [], {}),
+            'start': ('django.db.models.fields.DateTimeField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        },
+        u'smoke.joblogchunk': {
+            'Meta': {'unique_together': "((u'job', u'index'),)", 'object_name': 'JobLogChunk', 'index_together': "((u'job', u'first_line'),)"},
+            'data': ('django.db.models.fields.BinaryField', [], {}),
+            'first_line': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'index': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'log_chunks'", 'to': u"orm['smoke.Job']"}),
+            'line_count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'raw_size': ('django.db.models.fields.PositiveIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['smoke']
\ No newline at end of file
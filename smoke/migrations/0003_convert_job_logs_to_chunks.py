@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import zlib
+
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.conf import settings
+from django.db import models
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Moves the contents of Job.log to JobLogChunk"
+        chunk_size = getattr(settings, 'JOB_LOG_CHUNK_LINES', 1000)
+        job_ids = orm.Job.objects.exclude(log='').values_list('id', flat=True)
+        for job_id in list(job_ids):
+            job = orm.Job.objects.get(id=job_id)
+            lines = job.log.split("\n")
+            chunks = []
+            for index, first_line in enumerate(range(0, len(lines),
+                                                     chunk_size)):
+                chunk_lines = lines[first_line:first_line + chunk_size]
+                raw_data = "\n".join(chunk_lines).encode('utf-8')
+                chunks.append(orm.JobLogChunk(job=job, index=index,
+                                              first_line=first_line,
+                                              line_count=len(chunk_lines),
+                                              raw_size=len(raw_data),
+                                              data=zlib.compress(raw_data)))
+            orm.JobLogChunk.objects.bulk_create(chunks)
+            orm.Job.objects.filter(id=job_id).update(log='')
+
+    def backwards(self, orm):
+        "Moves the contents of JobLogChunk to Job.log"
+        job_ids = orm.JobLogChunk.objects.values_list('job_id', flat=True)
+        for job_id in list(set(job_ids)):
+            chunks = orm.JobLogChunk.objects.filter(
+                job_id=job_id).order_by('index')
+            log = "\n".join(
+                zlib.decompress(bytes(chunk.data)).decode('utf-8')
+                for chunk in chunks)
+            orm.Job.objects.filter(id=job_id).update(log=log)
+            chunks.delete()
+
+    models = {
+        u'smoke.job': {
+            'Meta': {'object_name': 'Job'},
+            'end': ('django.db.models.fields.DateTimeField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'log': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'script': ('django.db.models.fields.TextField', [], {}),
+            'start': ('django.db.models.fields.DateTimeField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        },
+        u'smoke.joblogchunk': {
+            'Meta': {'unique_together': "((u'job', u'index'),)", 'object_name': 'JobLogChunk', 'index_together': "((u'job', u'first_line'),)"},
+            'data': ('django.db.models.fields.BinaryField', [], {}),
+            'first_line': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'index': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'log_chunks'", 'to': u"orm['smoke.Job']"}),
+            'line_count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'raw_size': ('django.db.models.fields.PositiveIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['smoke']
+    symmetrical = True
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Job.duration'
+        db.add_column(u'smoke_job', 'duration',
+                      self.gf('django.db.models.fields.FloatField')(null=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Job.exit_status'
+        db.add_column(u'smoke_job', 'exit_status',
+                      self.gf('django.db.models.fields.IntegerField')(null=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Job.line_count'
+        db.add_column(u'smoke_job', 'line_count',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'Job.error_count'
+        db.add_column(u'smoke_job', 'error_count',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding index on 'Job', fields ['end']
+        db.create_index(u'smoke_job', ['end'])
+
+        # Adding index on 'Job', fields ['start']
+        db.create_index(u'smoke_job', ['start'])
+
+        # Adding index on 'Job', fields ['start', u'id']
+        db.create_index(u'smoke_job', ['start', u'id'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Job', fields ['start', u'id']
+        db.delete_index(u'smoke_job', ['start', u'id'])
+
+        # Removing index on 'Job', fields ['start']
+        db.delete_index(u'smoke_job', ['start'])
+
+        # Removing index on 'Job', fields ['end']
+        db.delete_index(u'smoke_job', ['end'])
+
+        # Deleting field 'Job.duration'
+        db.delete_column(u'smoke_job', 'duration')
+
+        # Deleting field 'Job.exit_status'
+        db.delete_column(u'smoke_job', 'exit_status')
+
+        # Deleting field 'Job.line_count'
+        db.delete_column(u'smoke_job', 'line_count')
+
+        # Deleting field 'Job.error_count'
+        db.delete_column(u'smoke_job', 'error_count')
+
+
+    models = {
+        u'smoke.job': {
+            'Meta': {'object_name': 'Job', 'index_together': "((u'start', u'id'),)"},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'end': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'error_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'exit_status': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'line_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'log': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'script': ('django.db.models.fields.TextField', [], {}),
+            'start': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        },
+        u'smoke.joblogchunk': {
+            'Meta': {'unique_together': "((u'job', u'index'),)", 'object_name': 'JobLogChunk', 'index_together': "((u'job', u'first_line'),)"},
+            'data': ('django.db.models.fields.BinaryField', [], {}),
+            'first_line': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'index': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'log_chunks'", 'to': u"orm['smoke.Job']"}),
+            'line_count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'raw_size': ('django.db.models.fields.PositiveIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['smoke']
\ No newline at end of file
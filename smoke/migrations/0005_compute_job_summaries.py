@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Calculates the duration and line count of the existing jobs"
+        jobs = orm.Job.objects.values_list('id', 'start', 'end')
+        for job_id, start, end in list(jobs):
+            line_count = orm.JobLogChunk.objects.filter(
+                job_id=job_id).aggregate(
+                    line_count=models.Sum('line_count'))['line_count']
+            orm.Job.objects.filter(id=job_id).update(
+                duration=(end - start).total_seconds(),
+                line_count=line_count or 0)
+
+    def backwards(self, orm):
+        "Nothing to do: the fields are removed by 0004"
+
+    models = {
+        u'smoke.job': {
+            'Meta': {'object_name': 'Job', 'index_together': "((u'start', u'id'),)"},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'end': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'error_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'exit_status': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'line_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'log': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'script': ('django.db.models.fields.TextField', [], {}),
+            'start': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '80'})
+        },
+        u'smoke.joblogchunk': {
+            'Meta': {'unique_together': "((u'job', u'index'),)", 'object_name': 'JobLogChunk', 'index_together': "((u'job', u'first_line'),)"},
+            'data': ('django.db.models.fields.BinaryField', [], {}),
+            'first_line': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'index': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'job': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'log_chunks'", 'to': u"orm['smoke.Job']"}),
+            'line_count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'raw_size': ('django.db.models.fields.PositiveIntegerField', [], {})
+        }
+    }
+
+    complete_apps = ['smoke']
+    symmetrical = True
@@ -2,26 +2,76 @@
 
 from __future__ import unicode_literals
 
+import json
+import zlib
+
+from django.conf import settings
 from django.db import models
+from django.db.models import F, Q, Sum
 
 
 class JobManager(models.Manager):
 
-    def latests_in_reverse_chronological(self):
-        """Returns latests jobs"""
-        return self.all().order_by("-id")[0:40]
+    SUMMARY_FIELDS = ('id', 'title', 'start', 'end', 'duration',
+                      'exit_status', 'status', 'line_count', 'error_count')
+    """Fields needed to list the jobs (excludes the script and log)"""
+
+    def latests_in_reverse_chronological(self, before=None, count=40):
+        """Returns latests jobs, loading only the summary fields.
+
+        :param before: a Job, to return the jobs started before it
+            (keyset pagination by start and id)
+        """
+        jobs = self.only(*self.SUMMARY_FIELDS).order_by("-start", "-id")
+        if before is not None:
+            jobs = jobs.filter(Q(start__lt=before.start) |
+                               Q(start=before.start, id__lt=before.id))
+        return jobs[0:count]
 
 
 class Job(models.Model):
     """Saves the information of a finished Job"""
+
+    STATUS_FINISHED = 'finished'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = (
+        (STATUS_FINISHED, 'Finished'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    )
+
     title = models.CharField(max_length=80)
     script = models.TextField()
-    log = models.TextField()
-    start = models.DateTimeField()
-    end = models.DateTimeField()
+    log = models.TextField(blank=True)
+    """Log of jobs saved before JobLogChunk existed. New jobs
+    save the log in JobLogChunk
+    """
+    start = models.DateTimeField(db_index=True)
+    end = models.DateTimeField(db_index=True)
+
+    # Summary fields, calculated when the job is saved
+    duration = models.FloatField(null=True, blank=True)
+    """Seconds between start and end"""
+    exit_status = models.IntegerField(null=True, blank=True)
+    """Exit status of the remote command (None if it wasn't executed)"""
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=STATUS_FINISHED)
+    line_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    """Count of error lines reported while the job was executed"""
+    task_metrics = models.TextField(blank=True)
+    """Metrics of the finished tasks (JSON, see `TaskMetricsAggregator`)"""
 
     objects = JobManager()
 
+    class Meta:
+        index_together = (('start', 'id'),)
+
+    def __init__(self, *args, **kwargs):
+        super(Job, self).__init__(*args, **kwargs)
+        self._log_lines_to_save = None
+
     def save(self, *args, **kwargs):
         if self.script and not self.title:
             lines = [line.strip()
@@ -30,7 +80,203 @@ class Job(models.Model):
             self.title = lines[0]
         if len(self.title) > 80:
             self.title = self.title[0:80]
+        if self.start and self.end:
+            self.duration = (self.end - self.start).total_seconds()
+        if self.log:
+            self.line_count = len(self.log.split("\n"))
         super(Job, self).save(*args, **kwargs)
 
+        if self._log_lines_to_save is not None:
+            lines, self._log_lines_to_save = self._log_lines_to_save, None
+            line_count = JobLogChunk.objects.save_lines(self, lines)
+            if line_count != self.line_count:
+                self.line_count = line_count
+                Job.objects.filter(pk=self.pk).update(line_count=line_count)
+
+    def set_log_lines(self, lines):
+        """Sets the log from an iterable of lines. The lines are
+        consumed (and saved as JobLogChunk) by `save()`.
+        """
+        self._log_lines_to_save = lines
+
+    def set_task_metrics(self, task_metrics):
+        """Saves the metrics of the tasks (a dict)"""
+        self.task_metrics = json.dumps(task_metrics)
+
+    def get_task_metrics(self):
+        """Returns the metrics of the tasks, or None if there aren't"""
+        if not self.task_metrics:
+            return None
+        return json.loads(self.task_metrics)
+
+    def _has_inline_log(self):
+        """Returns True if the log is in `log` (jobs saved before
+        JobLogChunk existed). If `log` was deferred, it's loaded only if
+        the job has no chunks.
+        """
+        if 'log' not in self.__dict__ and self.log_chunks.exists():
+            return False
+        return bool(self.log)
+
+    def get_log_line_count(self):
+        """Returns the count of lines of the log"""
+        return self.line_count
+
+    def get_log_lines(self, start, end):
+        """Returns the lines of the log in the range [start, end)
+        (0-based), reading only the chunks with those lines
+        """
+        if self._has_inline_log():
+            return self.log.split("\n")[start:end]
+
+        chunks = self.log_chunks.filter(
+            first_line__lt=end,
+            first_line__gt=start - F('line_count')).order_by('index')
+
+        lines = []
+        for chunk in chunks:
+            chunk_lines = chunk.get_lines()
+            lines.extend(chunk_lines[max(start - chunk.first_line, 0):
+                                     end - chunk.first_line])
+        return lines
+
+    def iter_log_lines(self):
+        """Yields all the lines of the log, one chunk at a time"""
+        if self._has_inline_log():
+            for line in self.log.split("\n"):
+                yield line
+            return
+
+        last_index = -1
+        while True:
+            chunks = list(self.log_chunks.filter(
+                index__gt=last_index).order_by('index')[0:10])
+            if not chunks:
+                return
+            for chunk in chunks:
+                for line in chunk.get_lines():
+                    yield line
+            last_index = chunks[-1].index
+
+    def get_log_size(self):
+        """Returns the size in bytes of the log (encoded as UTF-8)"""
+        if self._has_inline_log():
+            return len(self.log.encode('utf-8'))
+        sizes = self.log_chunks.aggregate(raw_size=Sum('raw_size'),
+                                          count=models.Count('id'))
+        if not sizes['count']:
+            return 0
+        # The chunks are separated by a new line
+        return sizes['raw_size'] + sizes['count'] - 1
+
+    def iter_log_data(self, start=0, end=None):
+        """Yields the bytes [start, end) of the log (encoded as UTF-8),
+        decompressing only the chunks with those bytes
+        """
+        if self._has_inline_log():
+            yield self.log.encode('utf-8')[start:end]
+            return
+
+        chunk_sizes = list(self.log_chunks.order_by('index').values_list(
+            'index', 'raw_size'))
+        if end is None:
+            end = sum(raw_size for _, raw_size in chunk_sizes) + \
+                len(chunk_sizes) - 1
+
+        # Offset of the first byte of each of the needed chunks
+        offsets = {}
+        offset = 0
+        for index, raw_size in chunk_sizes:
+            if offset < end and offset + raw_size + 1 > start:
+                offsets[index] = offset
+            offset += raw_size + 1
+
+        indexes = sorted(offsets)
+        for batch_start in range(0, len(indexes), 10):
+            chunks = self.log_chunks.filter(
+                index__in=indexes[batch_start:batch_start + 10]).order_by(
+                    'index')
+            for chunk in chunks:
+                data = zlib.decompress(bytes(chunk.data))
+                if chunk.index != chunk_sizes[-1][0]:
+                    data += b"\n"
+                offset = offsets[chunk.index]
+                yield data[max(start - offset, 0):end - offset]
+
     def __unicode__(self):
         return "Job {0}: {1}".format(self.id, self.title)
+
+
+class JobLogChunkManager(models.Manager):
+
+    BULK_CREATE_SIZE = 50
+
+    def save_lines(self, job, lines):
+        """Saves the lines (an iterable) as chunks of the log of `job`
+
+        :returns: the count of saved lines
+        """
+        chunk_size = settings.JOB_LOG_CHUNK_LINES
+        chunks = []
+        chunk_lines = []
+        index = 0
+        first_line = 0
+
+        for line in lines:
+            chunk_lines.append(line)
+            if len(chunk_lines) < chunk_size:
+                continue
+
+            chunks.append(JobLogChunk.from_lines(job, index, first_line,
+                                                 chunk_lines))
+            index += 1
+            first_line += len(chunk_lines)
+            chunk_lines = []
+
+            if len(chunks) == self.BULK_CREATE_SIZE:
+                self.bulk_create(chunks)
+                chunks = []
+
+        if chunk_lines:
+            chunks.append(JobLogChunk.from_lines(job, index, first_line,
+                                                 chunk_lines))
+        if chunks:
+            self.bulk_create(chunks)
+
+        return first_line + len(chunk_lines)
+
+
+class JobLogChunk(models.Model):
+    """Lines of the log of a Job, zlib-compressed.
+
+    All the chunks of a job have `JOB_LOG_CHUNK_LINES` lines, except the
+    last one. `first_line` is the (0-based) number of the first line.
+    """
+    job = models.ForeignKey(Job, related_name='log_chunks')
+    index = models.PositiveIntegerField()
+    first_line = models.PositiveIntegerField()
+    line_count = models.PositiveIntegerField()
+    raw_size = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    objects = JobLogChunkManager()
+
+    class Meta:
+        unique_together = (('job', 'index'),)
+        index_together = (('job', 'first_line'),)
+
+    @classmethod
+    def from_lines(cls, job, index, first_line, lines):
+        """Creates (without saving) a chunk with `lines`"""
+        raw_data = "\n".join(lines).encode('utf-8')
+        return cls(job=job, index=index, first_line=first_line,
+                   line_count=len(lines), raw_size=len(raw_data),
+                   data=zlib.compress(raw_data))
+
+    def get_lines(self):
+        """Returns the lines of the chunk"""
+        lines = zlib.decompress(bytes(self.data)).decode('utf-8').split("\n")
+        return lines[0:self.line_count]
+
+    def __unicode__(self):
+        return "Log chunk {0} of job {1}".format(self.index, self.job_id)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Cancellation requests of the jobs, saved in Redis: the web tier saves
+them and the worker of the job polls them (see `CancelWatcher`).
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+from django.conf import settings
+from redis import StrictRedis
+from ws4redis.publisher import redis_connection_pool
+from ws4redis.redis_store import RedisStore
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_connection():
+    return StrictRedis(connection_pool=redis_connection_pool)
+
+
+def _cancel_key(cookie):
+    return "{0}cancel:{1}".format(RedisStore.get_prefix(), cookie)
+
+
+def request_cancel(cookie):
+    """Saves a request to cancel the job"""
+    _get_connection().setex(_cancel_key(cookie),
+                            settings.JOB_CANCEL_REQUEST_EXPIRE, "1")
+
+
+def is_cancel_requested(cookie):
+    """Returns True if the cancellation of the job was requested"""
+    return bool(_get_connection().exists(_cancel_key(cookie)))
+
+
+class CancelWatcher(threading.Thread):
+    """Thread that polls the cancellation request of a job, and calls
+    `on_cancel()` (once) when it's found
+    """
+
+    def __init__(self, cookie, on_cancel, interval, is_requested=None):
+        super(CancelWatcher, self).__init__(
+            name="CancelWatcher-{0}".format(cookie))
+        self.daemon = True
+        self.cookie = cookie
+        self.on_cancel = on_cancel
+        self.interval = interval
+        self.is_requested = is_requested or is_cancel_requested
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                requested = self.is_requested(self.cookie)
+            except:
+                logger.exception("Couldn't check the cancellation of %s",
+                                 self.cookie)
+                continue
+            if requested:
+                logger.info("Cancellation of job %s requested", self.cookie)
+                self.on_cancel()
+                return
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Event loop engine: runs many jobs in a single Celery worker process
+(see `JOB_ENGINE`).
+
+With the default engine ('prefork'), each job takes a Celery worker
+process until it ends, blocked reading the output of spark-shell. With
+the 'eventloop' engine, the task hands the job to the JobEngine of the
+worker process and returns, and:
+
+- The output of the processes of all the jobs is read by a single thread,
+  the OutputLoop (`select.poll()`), which splits the lines and hands them
+  to the thread of each job, without waiting for it: the output of a job
+  isn't read while the job has `OUTPUT_PIPELINE_BLOCKS_QUEUE_SIZE` blocks
+  pending, so a slow job doesn't stop the output of the others.
+- The rest of each job (parsing and publishing the lines, sending the
+  script, waiting for the exit status, saving the job) runs in a thread of
+  the job. These threads are blocked most of the time, waiting for the
+  OutputLoop.
+
+The cancellation of the jobs is unchanged: killing the processes of a
+job ends its output.
+"""
+
+from __future__ import unicode_literals
+
+import Queue
+import errno
+import logging
+import os
+import select
+import threading
+
+from django.conf import settings
+from smoke.services.linesplitter import LineSplitter
+from smoke.services.perprocess import PerProcess
+from smoke.services.pipeline import END_OF_QUEUE
+
+
+logger = logging.getLogger(__name__)
+
+WAKEUP_BYTE = b"w"
+
+
+class _StreamReader(object):
+    """A stream read by the OutputLoop. The lines are handed to the reading
+    thread in `batches` (ended by END_OF_QUEUE)
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.splitter = LineSplitter()
+        self.batches = Queue.Queue()
+        self.error = None
+        self.paused = False
+        """True while the stream isn't read: too many batches pending"""
+        self.lock = threading.Lock()
+        self.registered = False
+        """If the stream is polled (used only by the OutputLoop thread)"""
+
+
+class OutputLoop(threading.Thread):
+    """Thread that reads the streams of many processes with `poll()`,
+    handing the lines of each block read to the thread reading the stream
+    (see `read()`).
+
+    The poller is only used by this thread: the other threads send their
+    requests (new streams, resumed streams...) through a pipe.
+    """
+
+    def __init__(self, block_size, queue_size, poll_timeout=1.0):
+        super(OutputLoop, self).__init__(name="OutputLoop")
+        self.daemon = True
+        self.block_size = block_size
+        self.queue_size = queue_size
+        self.poll_timeout_ms = int(poll_timeout * 1000)
+        self._poller = select.poll()
+        self._readers = {}
+        self._lock = threading.Lock()
+        self._requests = []
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._poller.register(self._wakeup_read, select.POLLIN)
+
+    def read(self, stream, on_batch):
+        """Reads the stream until EOF: `on_batch(lines)` is called (in the
+        calling thread) with the lines of each block. Blocks the caller
+        until EOF.
+
+        The stream isn't read while `queue_size` batches are pending: the
+        OutputLoop never waits for the caller.
+        """
+        reader = _StreamReader(stream)
+        self._request('add', reader)
+        try:
+            while True:
+                batch = reader.batches.get()
+                if batch is END_OF_QUEUE:
+                    break
+                self._resume_if_drained(reader)
+                on_batch(batch)
+        except:
+            self._request('remove', reader)
+            raise
+        if reader.error is not None:
+            raise reader.error
+
+    def stream_count(self):
+        return len(self._readers)
+
+    def _request(self, action, reader):
+        with self._lock:
+            self._requests.append((action, reader))
+        os.write(self._wakeup_write, WAKEUP_BYTE)
+
+    def _resume_if_drained(self, reader):
+        with reader.lock:
+            if not reader.paused or \
+                    reader.batches.qsize() >= self.queue_size:
+                return
+            reader.paused = False
+        self._request('resume', reader)
+
+    def _pause_if_full(self, reader):
+        with reader.lock:
+            if reader.batches.qsize() < self.queue_size:
+                return
+            reader.paused = True
+        self._unregister(reader)
+
+    def _register(self, reader):
+        if not reader.registered:
+            self._poller.register(reader.fd, select.POLLIN)
+            reader.registered = True
+
+    def _unregister(self, reader):
+        if reader.registered:
+            self._poller.unregister(reader.fd)
+            reader.registered = False
+
+    def _handle_requests(self):
+        os.read(self._wakeup_read, 4096)
+        with self._lock:
+            requests, self._requests = self._requests, []
+        for action, reader in requests:
+            if action == 'add':
+                self._readers[reader.fd] = reader
+                self._register(reader)
+            elif self._readers.get(reader.fd) is not reader:
+                # Already finished
+                continue
+            elif action == 'resume':
+                self._register(reader)
+            elif action == 'remove':
+                self._finish(reader)
+
+    def _finish(self, reader, error=None):
+        self._unregister(reader)
+        del self._readers[reader.fd]
+        reader.error = error
+        reader.batches.put(END_OF_QUEUE)
+
+    def _handle_event(self, fd):
+        reader = self._readers.get(fd)
+        if reader is None:
+            return
+        try:
+            data = os.read(fd, self.block_size)
+            if data:
+                batch = reader.splitter.feed(data)
+                if batch:
+                    reader.batches.put(batch)
+                    self._pause_if_full(reader)
+                return
+            batch = reader.splitter.close()
+            if batch:
+                reader.batches.put(batch)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            logger.exception("Exception detected when reading output")
+            self._finish(reader, e)
+        except Exception as e:
+            logger.exception("Exception detected when handling output")
+            self._finish(reader, e)
+        else:
+            self._finish(reader)
+
+    def run(self):
+        while True:
+            try:
+                events = self._poller.poll(self.poll_timeout_ms)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, _ in events:
+                if fd == self._wakeup_read:
+                    self._handle_requests()
+                else:
+                    self._handle_event(fd)
+
+
+class JobEngine(object):
+    """Runs the jobs of a worker process, each one in a thread, with
+    the output of all of them read by an OutputLoop
+    """
+
+    def __init__(self, max_jobs, block_size, queue_size):
+        self.max_jobs = max_jobs
+        self._slots = threading.Semaphore(max_jobs)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.output_loop = OutputLoop(block_size, queue_size)
+        self.output_loop.start()
+
+    def submit(self, name, run):
+        """Runs `run()` in a new thread. Blocks while `max_jobs` jobs are
+        running.
+        """
+        self._slots.acquire()
+        thread = threading.Thread(target=self._run, args=(name, run),
+                                  name="Job-{0}".format(name))
+        thread.daemon = True
+        with self._lock:
+            self._jobs[thread.name] = thread
+        thread.start()
+        return thread
+
+    def _run(self, name, run):
+        try:
+            run()
+        except:
+            logger.exception("Exception detected in job %s", name)
+        finally:
+            with self._lock:
+                self._jobs.pop(threading.current_thread().name, None)
+            self._slots.release()
+
+    def running_jobs(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def join(self, timeout=None):
+        """Waits for the running jobs to end"""
+        with self._lock:
+            threads = list(self._jobs.values())
+        for thread in threads:
+            thread.join(timeout)
+
+
+_job_engine = PerProcess(lambda: JobEngine(
+    settings.JOB_ENGINE_MAX_JOBS, settings.OUTPUT_READ_BLOCK_SIZE,
+    settings.OUTPUT_PIPELINE_BLOCKS_QUEUE_SIZE))
+
+
+def get_job_engine():
+    """Returns the JobEngine of this process"""
+    return _job_engine.get()
+
+
+def is_eventloop_engine():
+    return settings.JOB_ENGINE == 'eventloop'
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Routing of the jobs to the gateways (`SSH_GATEWAYS`): the hosts, with
+Spark installed, where spark-shell is launched through ssh.
+
+Each job is assigned the live gateway with the fewest running jobs, and
+then the lowest ssh round-trip time. The remote commands of a job use
+its gateway (see `gateway_ssh_base_args()`). If sending the script fails
+on a gateway (or, with `SINGLE_ROUND_TRIP_UPLOAD`, ssh couldn't connect to
+launch spark-shell), the job fails over to another one.
+
+The liveness and round-trip time of the gateways are measured by a
+prober thread in each worker process (`echo pong` through a standalone
+ssh, see `probe_gateway()`), at most once every `SSH_GATEWAY_PROBE_INTERVAL`
+secs across all the workers. The results and the running jobs are saved
+in Redis (shared by the workers).
+
+If `SSH_GATEWAYS` isn't set, every command uses `SSH_BASE_ARGS`.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from redis import StrictRedis
+from ws4redis.publisher import redis_connection_pool
+from ws4redis.redis_store import RedisStore
+from smoke.services.perprocess import PerProcess
+
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayState(object):
+    """Probe results and running jobs of the gateways. Saved in Redis as
+    JSON, and modified only while holding the lock of the router.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.probes = data.get('probes', {})
+        """gateway -> {'alive': bool, 'rtt': secs or None, 'at': timestamp}"""
+        self.running = data.get('running', {})
+        """cookie -> {'gateway': gateway, 'start': timestamp}"""
+
+    def to_json(self):
+        return json.dumps({'probes': self.probes, 'running': self.running})
+
+    def is_alive(self, gateway):
+        """Gateways never probed are considered alive"""
+        return self.probes.get(gateway, {}).get('alive', True)
+
+    def running_count(self, gateway):
+        return sum(1 for job in self.running.values()
+                   if job['gateway'] == gateway)
+
+    def choose(self, gateways, exclude=()):
+        """Returns the live gateway with the fewest running jobs and the
+        lowest round-trip time (unknown times go last), or None. If no
+        gateway is alive, the probes may be stale: any gateway is used.
+        """
+        candidates = [gateway for gateway in sorted(gateways)
+                      if gateway not in exclude]
+        alive = [gateway for gateway in candidates if self.is_alive(gateway)]
+
+        def key(gateway):
+            rtt = self.probes.get(gateway, {}).get('rtt')
+            return (self.running_count(gateway),
+                    rtt if rtt is not None else float('inf'))
+
+        candidates = alive or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=key)
+
+    def record_probe(self, gateway, alive, rtt, now):
+        self.probes[gateway] = {'alive': alive, 'rtt': rtt, 'at': now}
+
+    def mark_failed(self, gateway, now):
+        """Marks the gateway as dead (until the next probe)"""
+        self.record_probe(gateway, False, None, now)
+
+    def expire_running(self, max_seconds, now):
+        """Forgets the jobs started more than `max_seconds` ago (their
+        worker died without reporting the end of the job)
+        """
+        for cookie, job in list(self.running.items()):
+            if now - job['start'] > max_seconds:
+                del self.running[cookie]
+
+
+class GatewayRouter(object):
+    """Assigns the jobs to the gateways. The gateways of the jobs of this
+    process are also kept in memory.
+    """
+
+    def __init__(self, connection, gateways, running_timeout):
+        self._connection = connection
+        self.gateways = gateways
+        """name -> ssh base args"""
+        self.running_timeout = running_timeout
+        self._key = "{0}gateways".format(RedisStore.get_prefix())
+        self._lock = threading.Lock()
+        self._job_gateways = {}
+        """cookie -> gateway, of the jobs of this process"""
+
+    @contextmanager
+    def _state(self):
+        """Yields the state, saving it afterwards (holding the lock)"""
+        with self._connection.lock(self._key + ":lock", timeout=30,
+                                   sleep=0.05):
+            state = GatewayState(json.loads(
+                self._connection.get(self._key) or "{}"))
+            yield state
+            self._connection.set(self._key, state.to_json())
+
+    def get_state(self):
+        return GatewayState(json.loads(
+            self._connection.get(self._key) or "{}"))
+
+    def _assign(self, state, cookie, exclude):
+        state.expire_running(self.running_timeout, time.time())
+        gateway = state.choose(self.gateways, exclude)
+        if gateway is None:
+            state.running.pop(cookie, None)
+        else:
+            state.running[cookie] = {'gateway': gateway,
+                                     'start': time.time()}
+        with self._lock:
+            if gateway is None:
+                self._job_gateways.pop(cookie, None)
+            else:
+                self._job_gateways[cookie] = gateway
+        return gateway
+
+    def assign(self, cookie):
+        """Assigns a gateway to the job
+
+        :returns: name of the gateway
+        """
+        with self._state() as state:
+            return self._assign(state, cookie, ())
+
+    def fail_over(self, cookie, tried):
+        """Marks the gateway of the job as dead, and assigns it another
+        gateway (not in `tried`)
+
+        :returns: name of the new gateway, or None if there's none left
+        """
+        failed = self.gateway_of(cookie)
+        with self._state() as state:
+            if failed is not None:
+                state.mark_failed(failed, time.time())
+            return self._assign(state, cookie, set(tried) | {failed})
+
+    def finish(self, cookie):
+        """Reports the end of a job"""
+        with self._lock:
+            gateway = self._job_gateways.pop(cookie, None)
+        if gateway is None:
+            return
+        with self._state() as state:
+            state.running.pop(cookie, None)
+
+    def gateway_of(self, cookie):
+        with self._lock:
+            return self._job_gateways.get(cookie)
+
+    def ssh_base_args(self, cookie):
+        """Returns the ssh base args of the gateway of the job (or of the
+        default gateway)
+        """
+        gateway = self.gateway_of(cookie)
+        if gateway is not None:
+            return self.gateways[gateway]
+        if settings.SSH_BASE_ARGS is not None:
+            return settings.SSH_BASE_ARGS
+        return self.gateways[sorted(self.gateways)[0]]
+
+    def record_probe(self, gateway, alive, rtt):
+        with self._state() as state:
+            state.record_probe(gateway, alive, rtt, time.time())
+
+    def claim_probe(self, interval):
+        """Returns True if this process should probe the gateways now
+        (once every `interval` secs, across all the processes)
+        """
+        return bool(self._connection.set(self._key + ":probe", "1",
+                                         ex=max(int(interval), 1), nx=True))
+
+
+def probe_command(ssh_base_args, timeout):
+    """Returns the command of the probe: `echo pong` through a standalone
+    ssh connection (not the multiplexed one of the jobs, see
+    `SshConnectionManager`)
+    """
+    # Options must go before the destination host
+    return list(ssh_base_args[:1]) + \
+        ["-o", "ControlMaster=no", "-o", "ControlPath=none",
+         "-o", "ConnectTimeout={0}".format(max(int(timeout), 1))] + \
+        list(ssh_base_args[1:]) + ["echo", "pong"]
+
+
+def probe_gateway(ssh_base_args, timeout):
+    """Runs the probe command on the gateway, killing it (and its children,
+    like a `ProxyCommand`) if it doesn't end in `timeout` secs
+
+    :returns: (alive, round-trip time in secs or None)
+    """
+    start = time.time()
+    try:
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(probe_command(ssh_base_args, timeout),
+                                       stdin=devnull, stdout=subprocess.PIPE,
+                                       stderr=devnull, preexec_fn=os.setsid)
+    except OSError:
+        logger.info("Probe with %s failed", ssh_base_args, exc_info=True)
+        return False, None
+
+    def kill():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output = process.communicate()[0]
+    finally:
+        timer.cancel()
+    rtt = time.time() - start
+
+    alive = process.returncode == 0 and output.strip() == b"pong"
+    return alive, rtt if alive else None
+
+
+class GatewayProber(threading.Thread):
+    """Probes the gateways periodically"""
+
+    def __init__(self, router, interval, timeout):
+        super(GatewayProber, self).__init__(name="GatewayProber")
+        self.daemon = True
+        self.router = router
+        self.interval = interval
+        self.timeout = timeout
+        self._stopped = threading.Event()
+
+    def probe_all(self):
+        for gateway in sorted(self.router.gateways):
+            alive, rtt = probe_gateway(self.router.gateways[gateway],
+                                       self.timeout)
+            logger.info("Gateway %s: alive: %s, rtt: %s", gateway, alive, rtt)
+            self.router.record_probe(gateway, alive, rtt)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.router.claim_probe(self.interval):
+                    self.probe_all()
+            except:
+                logger.exception("Exception detected when probing gateways")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _create_router():
+    router = GatewayRouter(StrictRedis(connection_pool=redis_connection_pool),
+                           dict(settings.SSH_GATEWAYS),
+                           running_timeout=settings.SCHEDULER_RUNNING_TIMEOUT)
+    if settings.SSH_GATEWAY_PROBE_INTERVAL:
+        GatewayProber(router, settings.SSH_GATEWAY_PROBE_INTERVAL,
+                      settings.SSH_GATEWAY_PROBE_TIMEOUT).start()
+    return router
+
+
+_router = PerProcess(_create_router)
+
+
+def get_gateway_router():
+    """Returns the GatewayRouter of this process (its prober is started
+    with it)
+    """
+    return _router.get()
+
+
+def gateways_enabled():
+    return bool(settings.SSH_GATEWAYS)
+
+
+def gateway_ssh_base_args(cookie):
+    """Returns the ssh base args to run the commands of the job"""
+    if not gateways_enabled():
+        return settings.SSH_BASE_ARGS
+    return get_gateway_router().ssh_base_args(cookie)
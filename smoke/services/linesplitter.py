@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Splitting of the output of the remote commands in lines.
+
+The output is read in blocks (`os.read()`, not a line at a time) and
+split incrementally. Carriage returns not followed by a newline are
+redraws of the same line of the console (like the progress bar of Spark,
+which never ends in a newline): the text before them is returned as a
+`ConsoleRedraw`, as soon as it's received, instead of being part of a
+(late and huge) log line.
+
+Lines are returned right stripped and decoded (UTF-8, invalid bytes are
+replaced), blank lines are skipped.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+
+
+class ConsoleRedraw(unicode):
+    """Text of the console overwritten by a carriage return: it's not
+    a line of the log
+    """
+
+
+def _decode(data):
+    return data.decode('utf-8', 'replace')
+
+
+class LineSplitter(object):
+    """Splits blocks of bytes in lines (and console redraws)"""
+
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, data):
+        """Adds a block of output.
+
+        :returns: list of the lines (and ConsoleRedraw) completed
+        """
+        if self._pending:
+            data = self._pending + data
+
+        items = []
+        end = data.rfind(b"\n")
+        if end != -1:
+            # The complete lines are decoded at once (a newline is never
+            # part of a multibyte character)
+            self._pending = data[end + 1:]
+            text = _decode(data[:end])
+            if "\r" not in text:
+                # Fast path, most of the output
+                for line in text.split("\n"):
+                    line = line.rstrip()
+                    if line:
+                        items.append(line)
+            else:
+                for line in text.split("\n"):
+                    self._split_line(line, items)
+        else:
+            self._pending = data
+
+        # Redraws of the incomplete line are returned now (except the
+        # last one, and a trailing \r that could be part of \r\n)
+        pending = self._pending
+        cut = pending.rfind(b"\r", 0, len(pending) - 1)
+        if cut != -1:
+            for segment in pending[:cut].split(b"\r"):
+                segment = segment.rstrip()
+                if segment:
+                    items.append(ConsoleRedraw(_decode(segment)))
+            self._pending = pending[cut + 1:]
+        return items
+
+    def _split_line(self, line, items):
+        """Adds the line (text) to `items`. If it has carriage returns, the
+        last non-blank text is the line and the previous ones are redraws.
+        """
+        if "\r" not in line:
+            line = line.rstrip()
+            if line:
+                items.append(line)
+            return
+        segments = [segment.rstrip() for segment in line.split("\r")]
+        segments = [segment for segment in segments if segment]
+        for segment in segments[:-1]:
+            items.append(ConsoleRedraw(segment))
+        if segments:
+            items.append(segments[-1])
+
+    def close(self):
+        """Returns the items of the last line (without newline)"""
+        items = []
+        if self._pending:
+            self._split_line(_decode(self._pending), items)
+            self._pending = b""
+        return items
+
+
+def read_blocks(stream, block_size):
+    """Yields the blocks of data read from the stream, until EOF.
+
+    Uses `os.read()`, which returns the data available (up to
+    `block_size`) instead of waiting for a full block.
+    """
+    try:
+        fd = stream.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        read = stream.read
+    else:
+        read = lambda size: os.read(fd, size)
+    while True:
+        data = read(block_size)
+        if not data:
+            return
+        yield data
+
+
+def split_lines(blocks):
+    """Yields the lists of lines (and ConsoleRedraw) of each block"""
+    splitter = LineSplitter()
+    for data in blocks:
+        items = splitter.feed(data)
+        if items:
+            yield items
+    items = splitter.close()
+    if items:
+        yield items
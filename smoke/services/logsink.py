@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+import tempfile
+import threading
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobLogSink(object):
+    """Stores the lines of the log of a job, using bounded memory.
+
+    The lines are kept in memory until they use `memory_limit` bytes.
+    Then they're compressed (zlib) and appended to a spool file, which
+    is removed by `close()`.
+
+    The lines are appended by the thread of the job, the OutputLoop and the
+    CancelWatcher, so the sink is locked (while iterating too).
+    """
+
+    READ_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, memory_limit, spool_dir=None):
+        self.memory_limit = memory_limit
+        self.spool_dir = spool_dir
+        self.line_count = 0
+        self.byte_count = 0
+        self._lines = []
+        self._lines_size = 0
+        self._spool = None
+        self._compressor = None
+        self._lock = threading.Lock()
+
+    def append(self, line):
+        """Adds a line to the log"""
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        with self._lock:
+            self._lines.append(line)
+            self._lines_size += len(line) + 1
+            self.line_count += 1
+            self.byte_count += len(line) + 1
+            if self._lines_size >= self.memory_limit:
+                self._spill()
+
+    def _spill(self):
+        """Compress the lines in memory to the spool file (holding the
+        lock)
+        """
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile(prefix="smoke-job-log-",
+                                                 dir=self.spool_dir)
+            self._compressor = zlib.compressobj()
+            logger.info("Job log exceeded %s bytes, using spool file",
+                        self.memory_limit)
+
+        data = b"\n".join(self._lines) + b"\n"
+        self._spool.write(self._compressor.compress(data))
+        self._lines = []
+        self._lines_size = 0
+
+    def iter_chunks(self):
+        """Yields the contents of the log (utf-8 encoded) in chunks
+        of up to `READ_BLOCK_SIZE` bytes (plus the lines in memory).
+        Each line ends with a new line.
+        """
+        with self._lock:
+            if self._spool is not None:
+                self._spool.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+                self._spool.flush()
+                self._spool.seek(0)
+                decompressor = zlib.decompressobj()
+                while True:
+                    block = self._spool.read(self.READ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    data = decompressor.decompress(block)
+                    if data:
+                        yield data
+                self._spool.seek(0, 2)
+
+            if self._lines:
+                yield b"\n".join(self._lines) + b"\n"
+
+    def iter_lines(self):
+        """Yields the lines of the log (unicode, without the new line)"""
+        pending = b""
+        for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8', 'replace')
+        if pending:
+            yield pending.decode('utf-8', 'replace')
+
+    def close(self):
+        """Removes the spool file"""
+        with self._lock:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+                self._compressor = None
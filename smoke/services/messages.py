@@ -5,25 +5,221 @@ from __future__ import unicode_literals
 import json
 from logging import LogRecord
 import logging
+import threading
+import time
 
 from django.conf import settings
-from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
+from smoke.services.logsink import JobLogSink
+from smoke.services.pipeline import PublisherThread
+from smoke.services import wire
+from redis import StrictRedis
+from ws4redis.publisher import RedisPublisher, redis_connection_pool
+from ws4redis.redis_store import RedisMessage, RedisStore
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_job_facility(cookie):
+    """Returns the facility (websocket channel) of the messages of a job"""
+    return "{0}-{1}".format(settings.REDIS_PUBLISHER_FACILITY_LABEL, cookie)
+
+
+def get_backlog_key(cookie):
+    """Returns the key of the Redis list with the latest messages of a job"""
+    return "{0}backlog:{1}".format(RedisStore.get_prefix(),
+                                   get_job_facility(cookie))
+
+
+def is_compact_wire_format():
+    return settings.MESSAGES_WIRE_FORMAT == 'compact'
+
+
+def get_job_backlog(cookie, after_seq=None):
+    """Returns the latest messages (encoded, see `MESSAGES_WIRE_FORMAT`)
+    published for a job.
+
+    :param after_seq: to return only the messages with a greater `seq`
+    """
+    connection = StrictRedis(connection_pool=redis_connection_pool)
+    messages = connection.lrange(get_backlog_key(cookie), 0, -1)
+    if after_seq is not None:
+        messages = [message for message in messages
+                    if wire.message_seq(message) > after_seq]
+    return messages
+
+
+class BufferedRedisPublisher(RedisPublisher):
+    """RedisPublisher that buffers the messages and publish them in
+    batches, using a Redis pipeline (a single round trip per batch).
+
+    The buffer is flushed when it has `max_batch_size` messages, or
+    `max_delay` seconds after the first buffered message was received
+    (a timer thread ensures this even if no more messages are published).
+    The messages are published in order.
+
+    If `backlog_key` is set, the messages are also appended to that
+    Redis list, which keeps the latest `backlog_size` messages (and
+    expires `backlog_expire` seconds after the last message).
+
+    If `pack_frames` is True, each batch is published as a single message
+    (a frame of the compact wire format, see `wire.pack_frame()`). The
+    backlog keeps the messages one by one.
+    """
+
+    def __init__(self, max_batch_size, max_delay, backlog_key=None,
+                 backlog_size=0, backlog_expire=None, pack_frames=False,
+                 **kwargs):
+        super(BufferedRedisPublisher, self).__init__(**kwargs)
+        self.pack_frames = pack_frames
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.backlog_key = backlog_key
+        self.backlog_size = backlog_size
+        self.backlog_expire = backlog_expire
+        self._buffer = []
+        self._lock = threading.RLock()
+        self._timer = None
+        self.stats = {
+            'messages': 0,
+            'batches': 0,
+            'max_batch_size': 0,
+            'publish_seconds': 0.0,
+            'max_publish_seconds': 0.0,
+        }
+
+    def publish_message(self, message, expire=None, flush=False):
+        """Adds the message to the buffer. If `flush` is True, the buffer
+        is published immediately.
+        """
+        if not isinstance(message, RedisMessage):
+            raise ValueError('message object is not of type RedisMessage')
+
+        with self._lock:
+            self._buffer.append((message, expire))
+            if flush or len(self._buffer) >= self.max_batch_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Publish the buffered messages"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._buffer:
+                return
+
+            batch = self._buffer
+            self._buffer = []
+
+            start = time.time()
+            pipeline = self._connection.pipeline(transaction=False)
+            if self.pack_frames:
+                frame = wire.pack_frame([message for message, _ in batch])
+                self._publish(pipeline, frame, batch[-1][1])
+            else:
+                for message, expire in batch:
+                    self._publish(pipeline, message, expire)
+            if self.backlog_key:
+                for message, _ in batch:
+                    pipeline.rpush(self.backlog_key, message)
+            if self.backlog_key:
+                pipeline.ltrim(self.backlog_key, -self.backlog_size, -1)
+                if self.backlog_expire:
+                    pipeline.expire(self.backlog_key, self.backlog_expire)
+            pipeline.execute()
+            publish_time = time.time() - start
+
+            self.stats['messages'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'],
+                                               len(batch))
+            self.stats['publish_seconds'] += publish_time
+            self.stats['max_publish_seconds'] = max(
+                self.stats['max_publish_seconds'], publish_time)
+
+    def _publish(self, pipeline, message, expire):
+        expire = expire is None and self._expire or expire
+        for channel in self._publishers:
+            pipeline.publish(channel, message)
+            if expire > 0:
+                pipeline.setex(channel, expire, message)
+
+    def get_stats(self):
+        """Returns the counters of published messages and batches"""
+        with self._lock:
+            stats = dict(self.stats)
+        if stats['batches']:
+            stats['avg_batch_size'] = \
+                float(stats['messages']) / stats['batches']
+            stats['avg_publish_seconds'] = \
+                stats['publish_seconds'] / stats['batches']
+        return stats
+
+
 class MessageService(object):
     """Service to handle messages, including local
     logging and publishing using Redis.
+
+    The messages are published in the facility of the job (see
+    `get_job_facility()`), and numbered (`seq`) starting at `first_seq`,
+    so clients can replay the backlog and skip duplicated messages.
+    If `first_seq` is None the messages aren't numbered (used for status
+    updates published outside of the worker of the job, like the
+    position in the queue).
     """
 
-    def __init__(self):
-        self._redis_publisher = RedisPublisher(
-            facility=settings.REDIS_PUBLISHER_FACILITY_LABEL,
-            broadcast=True)
-        self._log_lines = []
+    FLUSH_FLAGS = ('jobFinishedOk', 'jobFinishedWithError', 'jobCancelled',
+                   'savedJobId')
+    """Messages with any of these flags are published immediately"""
+
+    def __init__(self, cookie, first_seq=0):
+        self._redis_publisher = BufferedRedisPublisher(
+            max_batch_size=settings.MESSAGES_BATCH_SIZE,
+            max_delay=settings.MESSAGES_BATCH_MAX_DELAY,
+            backlog_key=get_backlog_key(cookie),
+            backlog_size=settings.MESSAGES_BACKLOG_SIZE,
+            backlog_expire=settings.MESSAGES_BACKLOG_EXPIRE,
+            facility=get_job_facility(cookie),
+            broadcast=True,
+            pack_frames=is_compact_wire_format())
+        self._encode = wire.encode_message if is_compact_wire_format() \
+            else json.dumps
+        self.next_seq = first_seq
+        """`seq` of the next published message"""
+        self._seq_lock = threading.Lock()
+        self._publisher_thread = None
+        self._publisher_queue_stats = {}
+        self._log_sink = JobLogSink(settings.JOB_LOG_MEMORY_LIMIT,
+                                    settings.JOB_LOG_SPOOL_DIR)
+        self.error_count = 0
+        """Count of published error lines"""
+        self._recorded = None
+        self._recorded_size = 0
+        self._recording_max_size = 0
+
+    def start_publisher_thread(self, queue_size):
+        """Starts a thread to publish the messages, so callers of
+        `publish_message()` don't wait for Redis (unless `queue_size`
+        messages are waiting to be published).
+        """
+        assert self._publisher_thread is None
+        self._publisher_thread = PublisherThread(self._redis_publisher,
+                                                 queue_size)
+        self._publisher_thread.start()
+
+    def stop_publisher_thread(self):
+        """Publishes the pending messages and stops the thread"""
+        if self._publisher_thread is None:
+            return
+        self._publisher_thread.stop()
+        self._publisher_queue_stats = self._publisher_thread.queue.get_stats()
+        self._publisher_thread = None
 
     def publish_message(self, line, **kwargs):
         """Publishes a messages using Redis. This line is sent to
@@ -35,13 +231,65 @@ class MessageService(object):
         # some situation to the web tier, we send a dict with flags,
         # but we don't want to send a log line.
         if line:
-            self._log_lines.append(line)
+            self._log_sink.append(line)
+            if kwargs.get('errorLine'):
+                self.error_count += 1
 
         message_dict = {'line': line}
         message_dict.update(kwargs)
+        if self._recorded is not None:
+            self._record(message_dict)
+
+        flush = any(kwargs.get(flag) for flag in self.FLUSH_FLAGS)
 
-        self._redis_publisher.publish_message(
-            RedisMessage(json.dumps(message_dict)))
+        # The seq and the order of the messages in the queue must match
+        with self._seq_lock:
+            if self.next_seq is not None:
+                message_dict['seq'] = self.next_seq
+                self.next_seq += 1
+            publisher = self._publisher_thread or self._redis_publisher
+            publisher.publish_message(RedisMessage(self._encode(message_dict)),
+                                      flush=flush)
+
+    def start_recording(self, max_size):
+        """Starts keeping a copy of the published messages (see
+        `stop_recording()`), up to `max_size` bytes of lines
+        """
+        self._recorded = []
+        self._recorded_size = 0
+        self._recording_max_size = max_size
+
+    def _record(self, message_dict):
+        self._recorded_size += len(message_dict['line']) + 1
+        if self._recorded_size > self._recording_max_size:
+            logger.info("Too many messages to record, recording stopped")
+            self._recorded = None
+        else:
+            self._recorded.append(dict(message_dict))
+
+    def stop_recording(self):
+        """Returns the messages published since `start_recording()`,
+        or None if there were too many
+        """
+        recorded, self._recorded = self._recorded, None
+        return recorded
+
+    def flush(self):
+        """Publish the buffered messages"""
+        (self._publisher_thread or self._redis_publisher).flush()
+
+    def get_publish_stats(self):
+        """Returns the counters of published messages and batches,
+        and of the queue of the publisher thread
+        """
+        stats = self._redis_publisher.get_stats()
+        if self._publisher_thread is None:
+            queue_stats = self._publisher_queue_stats
+        else:
+            queue_stats = self._publisher_thread.queue.get_stats()
+        for key, value in queue_stats.items():
+            stats['queue_' + key] = value
+        return stats
 
     def log_and_publish(self, message, *args, **kwargs):
         """Log a line using and publish it to the web tier.
@@ -54,7 +302,6 @@ class MessageService(object):
                            message, args, exc_info=None, func=None)
         full_message = record.getMessage()
         self.publish_message(line=full_message, **kwargs)
-        # self._log_lines.append(message)
 
     def log_and_publish_error(self, message, *args, **kwargs):
         """Log a line using and send it to the web tier.
@@ -68,8 +315,15 @@ class MessageService(object):
         updated_kwargs = dict(kwargs)
         updated_kwargs['errorLine'] = True
         self.publish_message(line=full_message, **updated_kwargs)
-        # self._log_lines.append(message)
 
     def get_log(self):
         """Returns the saved log lines as a single string"""
-        return "\n".join(self._log_lines)
+        return "\n".join(self._log_sink.iter_lines())
+
+    def iter_log_lines(self):
+        """Yields the saved log lines, without loading them in memory"""
+        return self._log_sink.iter_lines()
+
+    def close(self):
+        """Releases the resources used to save the log"""
+        self._log_sink.close()
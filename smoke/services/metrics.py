@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of the jobs: the time spent in each phase of a job (queued,
+connecting, sending the script, running...) and counters of the jobs,
+lines and messages.
+
+The workers add the metrics of each job to a Redis hash, exported in
+the Prometheus text format by the `metrics` view, and optionally send
+them to statsd (see `STATSD_ADDRESS`).
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import logging
+import re
+import socket
+import threading
+import time
+
+from django.conf import settings
+from redis import StrictRedis
+from ws4redis.publisher import redis_connection_pool
+from ws4redis.redis_store import RedisStore
+
+
+logger = logging.getLogger(__name__)
+
+PHASE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+                 1800, 3600)
+"""Upper bounds (seconds) of the buckets of the histograms of phases"""
+
+PHASE_HISTOGRAM = "smoke_job_phase_seconds"
+
+_HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+_RE_LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+class PhaseTimer(object):
+    """Times the phases of a job.
+
+    Phases are either durations (`phase()` and `add()`, added if the
+    phase happens more than once) or marks: the seconds between the start
+    of the job and an event (`mark()`, only the first time).
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.start = clock()
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, self.clock() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def mark(self, name):
+        with self._lock:
+            self.timings.setdefault(name, self.clock() - self.start)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+class NullPhaseTimer(PhaseTimer):
+    """Timer of the commands run outside a job (like the commands run
+    after the end of a cancelled job): the timings are discarded
+    """
+
+    def add(self, name, seconds):
+        pass
+
+    def mark(self, name):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+
+class JobPhaseTimers(object):
+    """The PhaseTimer of each running job, by cookie"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}
+
+    def create(self, cookie):
+        """Creates (and returns) the timer of a job that starts"""
+        timer = PhaseTimer()
+        with self._lock:
+            self._timers[cookie] = timer
+        return timer
+
+    def get(self, cookie):
+        """Returns the timer of the job, or a NullPhaseTimer if the job
+        isn't running
+        """
+        with self._lock:
+            timer = self._timers.get(cookie)
+        return timer if timer is not None else NullPhaseTimer()
+
+    def pop(self, cookie):
+        """Returns (and forgets) the timer of a finished job, or None
+        if it wasn't created
+        """
+        with self._lock:
+            return self._timers.pop(cookie, None)
+
+
+job_phase_timers = JobPhaseTimers()
+
+
+#==============================================================================
+# Prometheus (metrics saved in Redis)
+#==============================================================================
+
+def _series(name, **labels):
+    """Returns the name of a series (in the Prometheus format)"""
+    return "{0}{{{1}}}".format(name, ",".join(
+        '{0}="{1}"'.format(label, value)
+        for label, value in sorted(labels.items())))
+
+
+def _series_order(name):
+    """Returns the sort key of a series: the series of a histogram are
+    grouped by labels, with the buckets first (in increasing `le`, "+Inf"
+    last), then `_sum` and `_count`
+    """
+    metric = name.split("{")[0]
+    labels = dict(_RE_LABEL.findall(name))
+    le = float(labels.pop('le', 0))
+    if metric.startswith(PHASE_HISTOGRAM):
+        suffix = metric[len(PHASE_HISTOGRAM):]
+        return (PHASE_HISTOGRAM, sorted(labels.items()),
+                _HISTOGRAM_SUFFIXES.index(suffix), le)
+    return (metric, sorted(labels.items()), 0, le)
+
+
+class RedisMetrics(object):
+    """Metrics saved in a Redis hash: the fields are the series and
+    the values are the counters
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._key = "{0}metrics".format(RedisStore.get_prefix())
+
+    def record_job(self, action, status, timings, counters):
+        """Adds the metrics of a job (a single round trip)"""
+        pipeline = self._connection.pipeline(transaction=False)
+        pipeline.hincrby(self._key, _series("smoke_jobs_total",
+                                            action=action, status=status), 1)
+        for phase, seconds in timings.items():
+            labels = {'action': action, 'phase': phase}
+            for bound in PHASE_BUCKETS:
+                # Incremented by 0 too: all the buckets must be exported
+                pipeline.hincrby(self._key, _series(
+                    PHASE_HISTOGRAM + "_bucket", le=bound, **labels),
+                    1 if seconds <= bound else 0)
+            pipeline.hincrby(self._key, _series(
+                PHASE_HISTOGRAM + "_bucket", le="+Inf", **labels), 1)
+            pipeline.hincrbyfloat(self._key, _series(
+                PHASE_HISTOGRAM + "_sum", **labels), seconds)
+            pipeline.hincrby(self._key, _series(
+                PHASE_HISTOGRAM + "_count", **labels), 1)
+        for name, value in counters.items():
+            pipeline.hincrby(self._key, _series(
+                "smoke_{0}_total".format(name), action=action), value)
+        pipeline.execute()
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format"""
+        series = self._connection.hgetall(self._key)
+        lines = []
+        last_metric = None
+        for name in sorted(series, key=_series_order):
+            metric = name.split("{")[0]
+            if metric.startswith(PHASE_HISTOGRAM):
+                metric, metric_type = PHASE_HISTOGRAM, "histogram"
+            else:
+                metric_type = "counter"
+            if metric != last_metric:
+                lines.append("# TYPE {0} {1}".format(metric, metric_type))
+                last_metric = metric
+            lines.append("{0} {1}".format(name, series[name]))
+        return "".join(line + "\n" for line in lines)
+
+
+def get_redis_metrics():
+    return RedisMetrics(StrictRedis(connection_pool=redis_connection_pool))
+
+
+#==============================================================================
+# statsd
+#==============================================================================
+
+class StatsdEmitter(object):
+    """Sends the metrics of the jobs to statsd (UDP, fire and forget)"""
+
+    def __init__(self, address, prefix):
+        self.address = address
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record_job(self, action, status, timings, counters):
+        action = action.replace("-", "_")
+        packets = ["{0}.jobs.{1}.{2}:1|c".format(self.prefix, action, status)]
+        for phase, seconds in timings.items():
+            packets.append("{0}.phase.{1}.{2}:{3}|ms".format(
+                self.prefix, action, phase, int(round(seconds * 1000))))
+        for name, value in counters.items():
+            packets.append("{0}.{1}.{2}:{3}|c".format(
+                self.prefix, action, name, value))
+        try:
+            self._socket.sendto("\n".join(packets).encode('utf-8'),
+                                self.address)
+        except socket.error:
+            logger.exception("Couldn't send the metrics to statsd")
+
+
+_statsd_emitter = None
+
+
+def record_job_metrics(action, status, timings, counters):
+    """Saves the metrics of a job (and sends them to statsd). The errors
+    are logged: the metrics never make the job fail.
+    """
+    global _statsd_emitter
+    if not settings.METRICS_ENABLED:
+        return
+    try:
+        get_redis_metrics().record_job(action, status, timings, counters)
+    except:
+        logger.exception("Couldn't save the metrics of the job")
+
+    if settings.STATSD_ADDRESS:
+        if _statsd_emitter is None:
+            _statsd_emitter = StatsdEmitter(tuple(settings.STATSD_ADDRESS),
+                                            settings.STATSD_PREFIX)
+        _statsd_emitter.record_job(action, status, timings, counters)
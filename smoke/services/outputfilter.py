@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Filter of the output of spark-shell, run on the server (an `awk` after
+spark-shell in the remote `sh -c` command), so the filtered lines don't
+cross ssh, and aren't parsed nor saved.
+
+Only the lines of the log of Spark with the levels `OUTPUT_FILTER_LEVELS`
+(`14/09/13 12:28:47 INFO spark.SecurityManager: ...`) are filtered,
+depending on `OUTPUT_FILTER_POLICY`:
+
+- `None`: no filter.
+- `'drop'`: the lines are dropped.
+- `'sample'`: one of each `OUTPUT_FILTER_SAMPLE_EVERY` lines is kept.
+
+The lines with any `PREFILTER` of the parsers (see
+`parsers.get_parser_classes()`) or any substring of `OUTPUT_FILTER_KEEP`
+are always kept, as are the output of the script, warnings and errors.
+
+awk reads whole lines: with a filter, the redraws of the progress bar of
+the console are received when the line ends (see `linesplitter`).
+"""
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.conf import settings
+from smoke.services.parsers import get_parser_classes
+
+
+logger = logging.getLogger(__name__)
+
+POLICIES = (None, 'drop', 'sample')
+
+LOG_LINE_REGEX = r"^[0-9][0-9]\/[0-9][0-9]\/[0-9][0-9] [0-9:]+ ({levels}) "
+"""Lines of the log of Spark (log4j), as `14/09/13 12:28:47 INFO `"""
+
+ERE_SPECIAL_CHARS = "\\^$.[]|()*+?{}/"
+"""Characters escaped in the regexes of awk (`/` ends the regex)"""
+
+
+def _ere_escape(text):
+    # The remote command is single-quoted: `'` is matched by `.`
+    return "".join("\\" + char if char in ERE_SPECIAL_CHARS else
+                   "." if char == "'" else char
+                   for char in text)
+
+
+def _double_quote_escape(text):
+    """Escapes the text to be put in double quotes (shell)"""
+    for char in ("\\", '"', "$", "`"):
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+def get_keep_substrings():
+    """Returns the substrings of the lines that are never filtered, or
+    None if a parser needs every line (so the output can't be filtered)
+    """
+    substrings = list(settings.OUTPUT_FILTER_KEEP)
+    for parser_class in get_parser_classes():
+        prefilter = parser_class.PREFILTER
+        if prefilter is None:
+            return None
+        if isinstance(prefilter, basestring):
+            prefilter = (prefilter,)
+        substrings.extend(prefilter)
+    return substrings
+
+
+def awk_program(policy, levels, keep_substrings, sample_every=1):
+    """Returns the awk program that filters the output. The lines are
+    flushed as they're written (spark-shell output is interactive).
+    """
+    assert policy in ('drop', 'sample')
+    log_line = LOG_LINE_REGEX.format(levels="|".join(levels))
+    keep = "|".join(_ere_escape(substring)
+                    for substring in keep_substrings)
+    if policy == 'drop':
+        action = "{ d++; next }"
+    else:
+        action = "{{ if (n++ % {0}) {{ d++; next }} }}".format(sample_every)
+    return (
+        "/" + log_line + "/ " + ("&& !/" + keep + "/ " if keep else "") +
+        action + " "
+        "{ print; fflush() } "
+        'END { if (d) print "[smoke] " d " lines of the log filtered out" }'
+    )
+
+
+def filter_command(command):
+    """Returns the shell command that runs `command` (with stderr
+    redirected to stdout) with its output filtered, or None if the output
+    isn't filtered. The exit status is the one of `command`.
+    """
+    policy = settings.OUTPUT_FILTER_POLICY
+    assert policy in POLICIES, \
+        "Invalid OUTPUT_FILTER_POLICY: {0!r}".format(policy)
+    if policy is None:
+        return None
+
+    keep_substrings = get_keep_substrings()
+    if keep_substrings is None:
+        logger.warn("The output isn't filtered: a parser (without "
+                    "PREFILTER) needs every line")
+        return None
+
+    program = awk_program(policy, settings.OUTPUT_FILTER_LEVELS,
+                          keep_substrings,
+                          settings.OUTPUT_FILTER_SAMPLE_EVERY)
+
+    # The exit status of the command is written to fd 3 (captured by
+    # `$( )`), while the output goes through awk to the original stdout
+    return (
+        "exec 4>&1 ; "
+        "s=$( {{ {{ {command} 2>&1 3>&- 4>&- ; echo $? >&3 ; }} | "
+        "awk \"{program}\" >&4 ; }} 3>&1 ) ; "
+        "exit $s".format(command=command,
+                         program=_double_quote_escape(program)))
@@ -4,18 +4,126 @@ from __future__ import unicode_literals
 
 import logging
 import re
-from xml.dom.minidom import parseString
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_by_path
+from smoke.services import shellmessages
+from smoke.services.metrics import job_phase_timers
+from smoke.services.taskmetrics import job_task_metrics
 
 
 logger = logging.getLogger(__name__)
 
 
+#------------------------------------------------------------
+# Registry of parsers
+#------------------------------------------------------------
+
+PARSERS = []
+"""Registered parser classes, in the order they are tried"""
+
+
+def register_parser(parser_class):
+    """Class decorator to register a parser.
+
+    The class is instantiated with `(message_service, cookie)` for each
+    remote command, and must have:
+
+    - `PREFILTER`: a substring (or tuple of substrings) that any line
+      handled by the parser contains, or None to try the parser with
+      every line. Lines without it are not passed to the parser.
+    - `parse(subline)`: returns True if the line was handled.
+
+    Optionally, parsers can have `tick()` (called for every line, before
+    the parsers are tried) and `flush()` (called when the output ends).
+    """
+    PARSERS.append(parser_class)
+    return parser_class
+
+
+def get_parser_classes():
+    """Returns the registered parsers plus the ones in the
+    `EXTRA_LINE_PARSERS` setting (dotted paths)
+    """
+    return PARSERS + [import_by_path(path)
+                      for path in settings.EXTRA_LINE_PARSERS]
+
+
+class ParserDispatcher(object):
+    """Passes each line to the parsers, until one handles it.
+
+    Most of the lines are not handled by any parser, so a parser is tried
+    only if the line contains its `PREFILTER` (substring checks are much
+    cheaper than running the regexes, or a single regex with all the
+    prefilters).
+    """
+
+    def __init__(self, message_service, cookie, parser_classes=None):
+        self.message_service = message_service
+
+        if parser_classes is None:
+            parser_classes = get_parser_classes()
+
+        self.parsers = [parser_class(message_service, cookie)
+                        for parser_class in parser_classes]
+
+        self._tickers = [parser.tick for parser in self.parsers
+                         if hasattr(parser, 'tick')]
+
+        self._candidates = []
+        for parser in self.parsers:
+            prefilter = parser.PREFILTER
+            if isinstance(prefilter, basestring):
+                prefilter = (prefilter,)
+            self._candidates.append((prefilter, parser))
+
+    def dispatch(self, subline):
+        """Passes the line to the parsers.
+
+        :returns: True if the line was handled by some parser
+        """
+        for tick in self._tickers:
+            tick()
+
+        for prefilter, parser in self._candidates:
+            if prefilter is not None:
+                for substring in prefilter:
+                    if substring in subline:
+                        break
+                else:
+                    continue
+
+            try:
+                if parser.parse(subline):
+                    return True
+
+            except Exception as e:
+                logger.exception("Exception detected when handling")
+
+                self.message_service.log_and_publish_error(
+                    "Exception detected when handling line: %s",
+                    e, errorLine=True)
+
+        return False
+
+    def flush(self):
+        """Informs the parsers that the output ended"""
+        for parser in self.parsers:
+            flush = getattr(parser, 'flush', None)
+            if flush is not None:
+                flush()
+
+
 #------------------------------------------------------------
 # ApplicationMasterLaunchedParser
 #------------------------------------------------------------
 
+@register_parser
 class ApplicationMasterLaunchedParser(object):
 
+    PREFILTER = "ApplicationMaster"
+
     RE_APPLICATION_MASTER_LAUNCHED = re.compile(
         r"^\S+\s\S+\sINFO\s"
         "yarn\.Client:\sCommand\sfor\s"
@@ -40,6 +148,7 @@ class ApplicationMasterLaunchedParser(object):
         if not patt.search(subline):
             return False
 
+        job_phase_timers.get(self.cookie).mark('am_launched')
         self.message_service.log_and_publish(subline,
                                              lineIsFromRemoteOutput=True,
                                              appMasterLaunched=True)
@@ -50,10 +159,42 @@ class ApplicationMasterLaunchedParser(object):
 # TaskFinishedWithProgressParser
 #------------------------------------------------------------
 
-class TaskFinishedWithProgressParser(object):
+class ProgressParser(object):
+    """Base class of the parsers of progress: publishes the progress
+    updates, throttled (see ProgressThrottle)
+    """
+
+    def __init__(self, message_service, cookie):
+        self.message_service = message_service
+        self.cookie = cookie
+        self.throttle = ProgressThrottle(
+            settings.PROGRESS_UPDATES_PER_SECOND)
+
+    def _publish_progress(self, stage, progress_done, progress_total):
+        self.message_service.publish_message(line="",
+                                             progressUpdate=True,
+                                             progressStage=stage,
+                                             progressDone=progress_done,
+                                             progressTotal=progress_total)
+
+    def flush(self, only_due=False):
+        """Publishes the progress updates retained by the throttle"""
+        for stage, done, total in self.throttle.pop_pending(only_due):
+            self._publish_progress(stage, done, total)
+
+    def tick(self):
+        """Publishes the retained updates that are due"""
+        due_at = self.throttle.due_at
+        if due_at is not None and self.throttle.clock() >= due_at:
+            self.flush(only_due=True)
+
+
+@register_parser
+class TaskFinishedWithProgressParser(ProgressParser):
+
+    PREFILTER = "Finished TID"
 
     RE_TASK_FINISHED_WITH_PROGRESS = re.compile(r""
-                                                "^.*"
                                                 "INFO\s+"
                                                 "scheduler\.TaskSetManager:\s+"
                                                 "Finished\s+TID\s+"
@@ -73,8 +214,24 @@ class TaskFinishedWithProgressParser(object):
     """
 
     def __init__(self, message_service, cookie):
-        self.message_service = message_service
-        self.cookie = cookie
+        super(TaskFinishedWithProgressParser, self).__init__(message_service,
+                                                             cookie)
+        self.task_metrics = job_task_metrics.get(cookie)
+        self._stages = {}
+        self._last_stage = 0
+
+    def _get_stage(self, progress_done, progress_total):
+        """Returns the id of the stage of the progress update.
+
+        Spark doesn't log the stage, so tasks with the same total are
+        considered of the same stage, until the progress goes back.
+        """
+        stage, last_done = self._stages.get(progress_total, (None, None))
+        if stage is None or progress_done < last_done:
+            self._last_stage += 1
+            stage = self._last_stage
+        self._stages[progress_total] = (stage, progress_done)
+        return stage
 
     def parse(self, subline):
         """Parses the line.
@@ -87,27 +244,106 @@ class TaskFinishedWithProgressParser(object):
         if not progress_match:
             return False
 
-        # tid_id = progress_match.group(1)
-        # took = progress_match.group(2)
-        # host = progress_match.group(3)
-        progress_done = progress_match.group(4)
-        progress_total = progress_match.group(5)
+        progress_done = int(progress_match.group(4))
+        progress_total = int(progress_match.group(5))
+        stage = self._get_stage(progress_done, progress_total)
+        if self.task_metrics is not None:
+            self.task_metrics.add_task(stage, int(progress_match.group(1)),
+                                       int(progress_match.group(2)),
+                                       progress_match.group(3).strip())
+
+        if not self.throttle.offer(stage, progress_done, progress_total):
+            self.message_service.log_and_publish(subline,
+                                                 lineIsFromRemoteOutput=True)
+            return True
+
         self.message_service.log_and_publish(subline,
                                              lineIsFromRemoteOutput=True,
                                              progressUpdate=True,
-                                             progressDone=int(progress_done),
-                                             progressTotal=int(progress_total))
+                                             progressStage=stage,
+                                             progressDone=progress_done,
+                                             progressTotal=progress_total)
 
         return True
 
 
+class ProgressThrottle(object):
+    """Limits the progress updates of each stage to `max_per_second`.
+
+    The last update of a stage (done == total) is always accepted. The
+    latest rejected update of each stage is kept as pending, and returned
+    by `pop_pending()`.
+    """
+
+    def __init__(self, max_per_second, clock=time.time):
+        self.min_interval = 1.0 / max_per_second if max_per_second else 0.0
+        self.clock = clock
+        self.due_at = None
+        """When the first pending update can be sent (None if there
+        are no pending updates)
+        """
+        self._last_sent = {}
+        self._pending = {}
+
+    def offer(self, stage, done, total):
+        """Checks if the update of `stage` must be sent now.
+
+        :returns: True if the update must be sent, False if was retained
+        """
+        now = self.clock()
+        last_sent = self._last_sent.get(stage)
+        if done >= total or last_sent is None or \
+                now - last_sent >= self.min_interval:
+            self._last_sent[stage] = now
+            if self._pending.pop(stage, None) is not None:
+                self._update_due_at()
+            return True
+
+        self._pending[stage] = (done, total)
+        stage_due_at = last_sent + self.min_interval
+        if self.due_at is None or stage_due_at < self.due_at:
+            self.due_at = stage_due_at
+        return False
+
+    def _update_due_at(self):
+        if self._pending:
+            self.due_at = min(self._last_sent[stage]
+                              for stage in self._pending) + self.min_interval
+        else:
+            self.due_at = None
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    def pop_pending(self, only_due=False):
+        """Returns (and forgets) the retained updates, as a list of
+        (stage, done, total) tuples.
+
+        :param only_due: return only the updates whose stage can be
+            updated now
+        """
+        now = self.clock()
+        popped = []
+        for stage, (done, total) in sorted(self._pending.items()):
+            if only_due and \
+                    now - self._last_sent[stage] < self.min_interval:
+                continue
+            del self._pending[stage]
+            self._last_sent[stage] = now
+            popped.append((stage, done, total))
+        self._update_due_at()
+        return popped
+
+
 #------------------------------------------------------------
 # MessageFromShellParser
 #------------------------------------------------------------
 
+@register_parser
 class MessageFromShellParser(object):
+    """Handles the messages from shell (see `smoke.services.shellmessages`)"""
 
-    RE_MESSAGE_FROM_SHELL = re.compile(r"^@@(.+)@@$")
+    PREFILTER = "@@"
 
     def __init__(self, message_service, cookie):
         self.message_service = message_service
@@ -119,23 +355,16 @@ class MessageFromShellParser(object):
         :returns: True if the line was parsed and handled
         """
 
-        patt = MessageFromShellParser.RE_MESSAGE_FROM_SHELL
-        msg_from_shell = patt.search(subline)
-        if not msg_from_shell:
+        stripped = subline.strip()
+        if len(stripped) <= 4 or not stripped.startswith("@@") or \
+                not stripped.endswith("@@"):
             return False
 
-        maybe_xml = msg_from_shell.group(1)
-
-        #======================================================================
-        # Parse XML
-        #======================================================================
-
         try:
-            # FIXME: parseString() is insecure
-            root = parseString(maybe_xml)
+            message = shellmessages.decode(stripped[2:-2])
 
-        except Exception as e:
-            logger.exception("Parsing XML failed")
+        except shellmessages.ShellMessageError as e:
+            logger.warn("Invalid message from shell: %s", e)
 
             self.message_service.log_and_publish_error(
                 "Exception detected when tryed to parse line from shell: %s",
@@ -143,66 +372,112 @@ class MessageFromShellParser(object):
 
             return False
 
-        #======================================================================
-        # Handle XML
-        #======================================================================
-
         try:
-            return self._process_xml(subline, root)
+            return self._handle_message(subline, message)
 
         except Exception as e:
-            logger.exception("Handling XML failed")
+            logger.exception("Handling message from shell failed")
 
             self.message_service.log_and_publish_error(
-                "Exception detected when trying to handle XML from "
-                "line from shell: %s", e, errorLine=True)
+                "Exception detected when trying to handle message from "
+                "shell: %s", e, errorLine=True)
 
             return False
 
-    def _process_xml(self, subline, root):
-
-        cookie_from_xml = root.getElementsByTagName(
-            'msgFromShell')[0].attributes['cookie'].value
+    def _handle_message(self, subline, message):
 
         # Check cookie
-        if cookie_from_xml != self.cookie:
+        if message.cookie != self.cookie:
             # BAD COOKIE!
             self.message_service.log_and_publish_error(
-                "ERROR: cookies doesn't matches. Cookie: %s - From XML: %s",
-                self.cookie, cookie_from_xml, lineIsFromRemoteOutput=True,
+                "ERROR: cookies doesn't matches. Cookie: %s - From message: "
+                "%s", self.cookie, message.cookie,
+                lineIsFromRemoteOutput=True, errorLine=True)
+            return False
+
+        if message.is_empty():
+            # UNKNOW <msgFromShell> TYPE
+            self.message_service.log_and_publish_error(
+                "ERROR: unknown type of line from shell: %s", subline,
                 errorLine=True)
             return False
 
-        # Check <errorLine>
-        try:
-            errors = root.getElementsByTagName('errorLine')
-            assert errors
-        except:
-            pass
-        else:
-            for elem in errors:
-                error_line = elem.firstChild.data.rstrip()
-                self.message_service.log_and_publish(
-                    error_line,
-                    lineIsFromRemoteOutput=True,
-                    errorLine=True)
-            return True
+        for error_line in message.error_lines:
+            self.message_service.log_and_publish(
+                error_line,
+                lineIsFromRemoteOutput=True,
+                errorLine=True)
 
-        # Check <outputFileName>
-        try:
-            output_filename = root.getElementsByTagName(
-                'outputFileName')[0].firstChild.data.strip()
-        except:
-            pass
-        else:
+        if message.output_filename:
             self.message_service.log_and_publish(
                 subline,
                 lineIsFromRemoteOutput=True,
-                outputFilenameReported=output_filename)
-            return True
+                outputFilenameReported=message.output_filename)
 
-        # UNKNOW <msgFromShell> TYPE
-        self.message_service.log_and_publish_error(
-            "ERROR: unknown type of line from shell: %s", subline,
-            errorLine=True)
-        return False
+        if message.metrics:
+            self.message_service.log_and_publish(
+                "Metrics: " + ", ".join(
+                    "{0}={1}".format(name, value)
+                    for name, value in sorted(message.metrics.items())),
+                lineIsFromRemoteOutput=True,
+                shellMetrics=message.metrics)
+
+        if message.table is not None:
+            max_rows = settings.SHELL_MESSAGE_MAX_TABLE_ROWS
+            table = message.table
+            self.message_service.log_and_publish(
+                shellmessages.format_table(table, max_rows),
+                lineIsFromRemoteOutput=True,
+                shellTable={'columns': table['columns'],
+                            'rows': table['rows'][:max_rows],
+                            'truncated': len(table['rows']) > max_rows})
+
+        if message.progress is not None:
+            progress = message.progress
+            self.message_service.publish_message(
+                line="",
+                progressUpdate=True,
+                progressStage=progress.get('stage', "script"),
+                progressDone=progress['done'],
+                progressTotal=progress['total'])
+
+        # <scriptFinished> (see `RunInSparkSession`) needs nothing else
+        return True
+
+
+#------------------------------------------------------------
+# ConsoleProgressParser
+#------------------------------------------------------------
+
+@register_parser
+class ConsoleProgressParser(ProgressParser):
+    """Parses the progress bar of the console of Spark. It's redrawn with
+    carriage returns, so it's received as ConsoleRedraw (see
+    `smoke.services.linesplitter`), and it isn't logged.
+    """
+
+    PREFILTER = "[Stage "
+
+    RE_STAGE_PROGRESS = re.compile(r"\[Stage\s(\d+):[^(\]]*"
+                                   r"\((\d+)\s\+\s(\d+)\)\s/\s(\d+)\]")
+    """[Stage 3:====>           (120 + 8) / 400][Stage 4:>    (0 + 0) / 100]
+
+    (the stage, the finished tasks, the running tasks and the total)
+    """
+
+    def parse(self, subline):
+        """Parses the line.
+
+        :returns: True if the line was parsed and handled
+        """
+        stages = ConsoleProgressParser.RE_STAGE_PROGRESS.findall(subline)
+        if not stages:
+            return False
+
+        for stage, progress_done, _, progress_total in stages:
+            stage, progress_done, progress_total = \
+                int(stage), int(progress_done), int(progress_total)
+            if self.throttle.offer(stage, progress_done, progress_total):
+                self._publish_progress(stage, progress_done, progress_total)
+
+        return True
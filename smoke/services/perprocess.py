@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy instances owned by a single process.
+
+Celery workers fork: an instance created by the parent process (threads,
+sockets, subprocesses...) can't be used by the children, so each process
+creates its own.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import threading
+
+
+class PerProcess(object):
+    """Instance created by `factory` when first used in each process"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the instance of the current process (created if the pid
+        changed)
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._instance = self._factory()
+                    self._pid = pid
+        return self._instance
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Threads and bounded queues to decouple the reading of the output of
+the remote commands from the parsing and publishing of the lines.
+"""
+
+from __future__ import unicode_literals
+
+import Queue
+import logging
+import threading
+import time
+
+from smoke.services.linesplitter import read_blocks, split_lines
+
+
+logger = logging.getLogger(__name__)
+
+
+END_OF_QUEUE = object()
+"""Marker put in the queues after the last item"""
+
+STOP_CHECK_INTERVAL = 0.1
+"""Seconds between checks of the stop event of a blocked producer"""
+
+
+class MeteredQueue(Queue.Queue):
+    """Bounded queue that keeps metrics of its depth and of the
+    time the producers had to wait because the queue was full.
+    """
+
+    def __init__(self, maxsize):
+        Queue.Queue.__init__(self, maxsize)
+        self.items = 0
+        self.max_depth = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+
+    def put_until(self, item, stopped=None):
+        """Puts the item, blocking while the queue is full, until
+        `stopped` (an Event) is set
+
+        :returns: False if stopped before the item was put
+        """
+        if stopped is None:
+            self.put(item)
+            return True
+        while not stopped.is_set():
+            try:
+                self.put(item, timeout=STOP_CHECK_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def put_metered(self, item, stopped=None):
+        """Puts the item, blocking while the queue is full (see
+        `put_until()`)
+
+        :returns: False if stopped before the item was put
+        """
+        try:
+            self.put_nowait(item)
+        except Queue.Full:
+            start = time.time()
+            put = self.put_until(item, stopped)
+            self.blocked_puts += 1
+            self.blocked_seconds += time.time() - start
+            if not put:
+                return False
+
+        self.items += 1
+        depth = self.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def get_stats(self):
+        return {
+            'items': self.items,
+            'max_depth': self.max_depth,
+            'size': self.maxsize,
+            'blocked_puts': self.blocked_puts,
+            'blocked_seconds': self.blocked_seconds,
+        }
+
+
+class StdoutReader(threading.Thread):
+    """Thread that reads a stream (the stdout of a process) in blocks and
+    puts the lines of each block (see `linesplitter.split_lines()`) in a
+    bounded queue, so the process can write its output while the lines
+    are parsed and published.
+
+    If the consumer is slower than the process, the reader blocks when
+    the queue is full (and the process will block when the pipe is full).
+    If the consumer stops (see `stop()`), the reader ends without waiting
+    for the queue.
+    """
+
+    def __init__(self, stream, queue_size, block_size):
+        super(StdoutReader, self).__init__(name="StdoutReader")
+        self.daemon = True
+        self.stream = stream
+        self.block_size = block_size
+        self.queue = MeteredQueue(queue_size)
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            for batch in split_lines(read_blocks(self.stream,
+                                                 self.block_size)):
+                if not self.queue.put_metered(batch, self._stopped):
+                    break
+        except:
+            logger.exception("Exception detected when reading stdout")
+        finally:
+            self.queue.put_until(END_OF_QUEUE, self._stopped)
+
+    def stop(self):
+        """Tells the reader that no more batches will be read. The reader
+        ends after its current read (the caller should end the stream,
+        e.g. killing the process)
+        """
+        self._stopped.set()
+
+    def iter_batches(self):
+        """Yields the lists of lines read, until EOF"""
+        while True:
+            batch = self.queue.get()
+            if batch is END_OF_QUEUE:
+                return
+            yield batch
+
+
+class PublisherThread(threading.Thread):
+    """Thread that publishes the messages put in a bounded queue, so the
+    parsing of lines doesn't wait for Redis.
+    """
+
+    def __init__(self, publisher, queue_size):
+        super(PublisherThread, self).__init__(name="PublisherThread")
+        self.daemon = True
+        self.publisher = publisher
+        self.queue = MeteredQueue(queue_size)
+
+    def publish_message(self, message, flush=False):
+        """Enqueues the message to be published"""
+        self.queue.put_metered((message, flush))
+
+    def flush(self):
+        """Enqueues a request to flush the buffer of the publisher"""
+        self.queue.put_metered((None, True))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is END_OF_QUEUE:
+                break
+            message, flush = item
+            try:
+                if message is None:
+                    self.publisher.flush()
+                else:
+                    self.publisher.publish_message(message, flush=flush)
+            except:
+                logger.exception("Exception detected when publishing")
+        self.publisher.flush()
+
+    def stop(self):
+        """Publishes the enqueued messages and stops the thread"""
+        self.queue.put(END_OF_QUEUE)
+        self.join()
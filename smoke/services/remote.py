@@ -2,16 +2,301 @@
 
 from __future__ import unicode_literals
 
+import atexit
+import hashlib
 import logging
+import os
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+import weakref
 
 from django.conf import settings
-from smoke.services.parsers import ApplicationMasterLaunchedParser, \
-    TaskFinishedWithProgressParser, MessageFromShellParser
+from smoke.services import outputfilter
+from smoke.services.engine import get_job_engine, is_eventloop_engine
+from smoke.services.gateways import gateway_ssh_base_args, gateways_enabled
+from smoke.services.linesplitter import ConsoleRedraw, read_blocks, \
+    split_lines
+from smoke.services.metrics import job_phase_timers
+from smoke.services.parsers import ParserDispatcher
+from smoke.services.perprocess import PerProcess
+from smoke.services.pipeline import StdoutReader
+from smoke.services.sessions import SparkShellSession, get_session_pool
 
 
 logger = logging.getLogger(__name__)
 
+SSH_ERROR_EXIT_STATUS = 255
+"""Exit status of `ssh` when the connection failed"""
+
+
+#==============================================================================
+# Multiplexed ssh connections
+#==============================================================================
+
+class SshConnectionManager(object):
+    """Keeps warm, multiplexed ssh sessions to the gateways.
+
+    Uses the OpenSSH `ControlMaster` feature: a master connection is
+    established once (TCP + key exchange + auth) and every remote command
+    is executed as a new channel of that connection. The master is
+    health-checked (`ssh -O check`) and re-established when it fails, and
+    the number of concurrent channels per gateway is capped, to not exceed
+    the `MaxSessions` of the remote sshd.
+
+    There is one instance per process (see `get_connection_manager()`).
+    """
+
+    def __init__(self, max_channels, control_dir, control_persist,
+                 check_interval):
+        self.max_channels = max_channels
+        self.control_dir = control_dir
+        self.control_persist = control_persist
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._channels_available = threading.Condition(self._lock)
+        self._channels_in_use = {}
+        self._last_check = {}
+        self._connected = set()
+        self.stats = {
+            'connects': 0,
+            'failed_connects': 0,
+            'checks': 0,
+            'failed_checks': 0,
+        }
+
+    def _key(self, ssh_base_args):
+        return tuple(ssh_base_args)
+
+    def control_path(self, ssh_base_args):
+        """Returns the path of the control socket for `ssh_base_args`"""
+        digest = hashlib.sha1("\0".join(ssh_base_args)).hexdigest()[0:16]
+        return os.path.join(self.control_dir, "smoke-ssh-{0}-{1}".format(
+            os.getpid(), digest))
+
+    def _control_options(self, ssh_base_args):
+        return ["-o", "ControlMaster=auto",
+                "-o", "ControlPath=" + self.control_path(ssh_base_args),
+                "-o", "ControlPersist={0}".format(self.control_persist)]
+
+    def _with_options(self, ssh_base_args, extra_options):
+        # Options must go before the destination host
+        return list(ssh_base_args[:1]) + \
+            self._control_options(ssh_base_args) + \
+            list(extra_options) + list(ssh_base_args[1:])
+
+    def ssh_args(self, ssh_base_args):
+        """Returns `ssh_base_args` plus the options to execute the command
+        through the multiplexed connection.
+        """
+        return self._with_options(ssh_base_args, [])
+
+    def _call(self, args):
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(args, stdin=devnull, stdout=devnull,
+                                   stderr=devnull)
+
+    def is_healthy(self, ssh_base_args):
+        """Checks (`ssh -O check`) if the master connection is alive"""
+        self.stats['checks'] += 1
+        healthy = self._call(
+            self._with_options(ssh_base_args, ["-O", "check"])) == 0
+        if not healthy:
+            self.stats['failed_checks'] += 1
+        return healthy
+
+    def ensure_connection(self, ssh_base_args):
+        """Makes sure the master connection is established, (re)connecting
+        if needed. The health check is done at most once each
+        `check_interval` seconds.
+
+        :returns: seconds spent setting up the connection
+        """
+        key = self._key(ssh_base_args)
+        start = time.time()
+
+        last_check = self._last_check.get(key)
+        if key in self._connected and last_check is not None and \
+                start - last_check < self.check_interval:
+            return 0.0
+
+        if self.is_healthy(ssh_base_args):
+            self._connected.add(key)
+            self._last_check[key] = time.time()
+            return time.time() - start
+
+        self._connected.discard(key)
+        logger.info("Establishing master ssh connection to %s",
+                    " ".join(ssh_base_args))
+        exit_status = self._call(self._with_options(
+            ssh_base_args, ["-o", "ControlMaster=yes", "-M", "-N", "-f"]))
+        if exit_status == 0:
+            self.stats['connects'] += 1
+            self._connected.add(key)
+            self._last_check[key] = time.time()
+        else:
+            # Commands still works (`ControlMaster=auto`), but each one
+            # will pay the whole handshake.
+            self.stats['failed_connects'] += 1
+            logger.warn("Couldn't establish master ssh connection. "
+                        "Exit status: %s", exit_status)
+        return time.time() - start
+
+    def invalidate(self, ssh_base_args):
+        """Forces a health check before the next command. Used when
+        ssh itself failed (exit status 255).
+        """
+        key = self._key(ssh_base_args)
+        self._connected.discard(key)
+        self._last_check.pop(key, None)
+
+    def acquire_channel(self, ssh_base_args, timeout=None):
+        """Reserves one of the channels of the connection. Blocks
+        if `max_channels` are in use.
+        """
+        key = self._key(ssh_base_args)
+        deadline = time.time() + timeout if timeout else None
+        with self._channels_available:
+            while self._channels_in_use.get(key, 0) >= self.max_channels:
+                if deadline is None:
+                    self._channels_available.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise(Exception("Timeout waiting for a free ssh channel"))
+                self._channels_available.wait(remaining)
+            self._channels_in_use[key] = self._channels_in_use.get(key, 0) + 1
+
+    def release_channel(self, ssh_base_args):
+        """Releases a channel reserved with `acquire_channel()`"""
+        key = self._key(ssh_base_args)
+        with self._channels_available:
+            self._channels_in_use[key] = max(
+                self._channels_in_use.get(key, 0) - 1, 0)
+            self._channels_available.notify()
+
+    def close_all(self):
+        """Closes (`ssh -O exit`) the master connections"""
+        for key in list(self._connected):
+            self._call(self._with_options(list(key), ["-O", "exit"]))
+            self._connected.discard(key)
+
+
+def _create_connection_manager():
+    manager = SshConnectionManager(
+        max_channels=settings.SSH_MAX_CHANNELS,
+        control_dir=settings.SSH_CONTROL_PATH_DIR or tempfile.gettempdir(),
+        control_persist=settings.SSH_CONTROL_PERSIST,
+        check_interval=settings.SSH_HEALTH_CHECK_INTERVAL)
+    atexit.register(manager.close_all)
+    return manager
+
+
+_connection_manager = PerProcess(_create_connection_manager)
+
+
+def get_connection_manager():
+    """Returns the SshConnectionManager of this process"""
+    return _connection_manager.get()
+
+
+#==============================================================================
+# Cancellation of jobs
+#==============================================================================
+
+class JobCancelledException(Exception):
+    """The job was cancelled: no more remote commands are executed"""
+
+
+class SshConnectionFailedException(Exception):
+    """ssh couldn't connect to the gateway: the remote command wasn't
+    started, so it can be run on another gateway
+    """
+
+
+class JobProcesses(object):
+    """Local processes (ssh) of the running jobs, by cookie, so they
+    can be killed when a job is cancelled.
+
+    The processes are started in their own process group (see
+    `BaseRemoteCommand._popen()`), the whole group is killed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = {}
+        self._cancelled = set()
+        self._remotes = {}
+
+    def add(self, cookie, process):
+        """Registers a process of the job (killing it if the job was
+        cancelled while the process was being started)
+        """
+        with self._lock:
+            self._processes.setdefault(cookie, weakref.WeakSet()).add(
+                process)
+            cancelled = cookie in self._cancelled
+        if cancelled:
+            self.cancel(cookie)
+
+    def remove(self, cookie, process):
+        with self._lock:
+            if cookie in self._processes:
+                self._processes[cookie].discard(process)
+
+    def is_cancelled(self, cookie):
+        return cookie in self._cancelled
+
+    def set_remote(self, cookie, remote_cookie, ssh_gateway_args):
+        """Registers where the remote processes of the job run, when it's
+        not the default: the processes of a spark-shell session have the
+        cookie of the job that started the session in their environment
+        """
+        with self._lock:
+            self._remotes[cookie] = (remote_cookie, ssh_gateway_args)
+
+    def remote_of(self, cookie):
+        """Returns the cookie in the environment of the remote processes
+        of the job, and the ssh base args of their gateway (None for the
+        gateway of the job)
+        """
+        with self._lock:
+            return self._remotes.get(cookie, (cookie, None))
+
+    def cancel(self, cookie):
+        """Marks the job as cancelled and kills its processes
+
+        :returns: count of killed processes
+        """
+        with self._lock:
+            self._cancelled.add(cookie)
+            processes = list(self._processes.get(cookie, []))
+
+        killed = 0
+        for process in processes:
+            if process.poll() is not None:
+                continue
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                killed += 1
+            except OSError:
+                logger.exception("Couldn't kill process group %s",
+                                 process.pid)
+        return killed
+
+    def forget(self, cookie):
+        """Removes the information of a finished job"""
+        with self._lock:
+            self._processes.pop(cookie, None)
+            self._cancelled.discard(cookie)
+            self._remotes.pop(cookie, None)
+
+
+job_processes = JobProcesses()
+
 
 #==============================================================================
 # Base class for executing commands through ssh
@@ -20,37 +305,29 @@ logger = logging.getLogger(__name__)
 class BaseRemoteCommand(object):
     """Base class for remote commands"""
 
+    RUNS_WHEN_CANCELLED = False
+    """If False, the command isn't executed if the job was cancelled"""
+
     def __init__(self, message_service, cookie):
         self.message_service = message_service
         self.cookie = cookie
 
-        self.line_parsers = (
-            ApplicationMasterLaunchedParser(self.message_service, self.cookie),
-            TaskFinishedWithProgressParser(self.message_service, self.cookie),
-            MessageFromShellParser(self.message_service, self.cookie),
-        )
+        self.parser_dispatcher = ParserDispatcher(self.message_service,
+                                                  self.cookie)
+        self._received_lines = 0
+        self.ssh_gateway_args = gateway_ssh_base_args(cookie)
+        """ssh base args of the gateway of the job (see `gateways`)"""
 
     def _process_incoming_line(self, cookie, subline):
         """Process a line of the spark-shell output.
-        Pass the line to each of the existing parsers
+        Pass the line to the parsers.
         """
 
         # At this point, 'subline' was logged (ie: will appear
         #  on celery worker console or log file
 
-        for parser in self.line_parsers:
-
-            try:
-                handled = parser.parse(subline)
-                if handled:
-                    return
-
-            except Exception as e:
-                logger.exception("Exception detected when handling")
-
-                self.message_service.log_and_publish_error(
-                    "Exception detected when handling line: %s",
-                    e, errorLine=True)
+        if self.parser_dispatcher.dispatch(subline):
+            return
 
         #------------------------------------------------------------
         # It's a normal, plain line. Any parser handled the line
@@ -59,27 +336,95 @@ class BaseRemoteCommand(object):
                                              lineIsFromRemoteOutput=True)
         return
 
+    def _remote_sh_command(self, remote_command, with_cookie=True):
+        """Generates the arguments to run `remote_command` with `sh -c`
+        on the server, with the cookie in the environment (if
+        `with_cookie`: the processes of the job are found by the cookie)
+
+        `remote_command` is single-quoted, so it can't contain `'`.
+        """
+        assert "'" not in remote_command
+
+        ARGS = self._ssh_base_args()
+        if with_cookie:
+            ARGS += ["env", "DATATSUNAMI_COOKIE=" + self.cookie]
+        ARGS += ["sh", "-c", "'" + remote_command + "'"]
+
+        return ARGS
+
+    def _ssh_base_args(self):
+        """Returns the arguments to execute a command through ssh"""
+        if not settings.SSH_MULTIPLEXING:
+            return list(self.ssh_gateway_args)
+        return get_connection_manager().ssh_args(self.ssh_gateway_args)
+
+    def _setup_connection(self):
+        """Prepares the multiplexed ssh connection and reserves a channel.
+        The connection-setup latency is reported to the web tier.
+        """
+        if not settings.SSH_MULTIPLEXING:
+            return
+
+        manager = get_connection_manager()
+        setup_time = manager.ensure_connection(self.ssh_gateway_args)
+        manager.acquire_channel(self.ssh_gateway_args,
+                                timeout=settings.SSH_CHANNEL_WAIT_TIMEOUT)
+        job_phase_timers.get(self.cookie).add('ssh_connect', setup_time)
+        self.message_service.log_and_publish(
+            "{0}: ssh connection ready in %.3f secs".format(
+                self.__class__.__name__),
+            setup_time, sshSetupSeconds=setup_time)
+
+    def _release_connection(self, process=None):
+        """Releases the channel reserved by `_setup_connection()`"""
+        if process is not None:
+            job_processes.remove(self.cookie, process)
+        if not settings.SSH_MULTIPLEXING:
+            return
+        manager = get_connection_manager()
+        manager.release_channel(self.ssh_gateway_args)
+        if process is not None and process.returncode == SSH_ERROR_EXIT_STATUS:
+            manager.invalidate(self.ssh_gateway_args)
+
     def _popen(self, *args, **kwargs):
         """Executes subprocess.Popen
 
+        The caller must call `_release_connection()` when the
+        process finishes.
+
+        The process is started in a new session (and process group),
+        to kill it and its children if the job is cancelled.
+
         :returns: process
         """
 
+        if job_processes.is_cancelled(self.cookie) and \
+                not self.RUNS_WHEN_CANCELLED:
+            raise JobCancelledException("{0}: job was cancelled".format(
+                self.__class__.__name__))
+
         self.message_service.log_and_publish(
             "{0}: subprocess.Popen(%s)".format(self.__class__.__name__),
             args
         )
 
+        self._setup_connection()
+
+        kwargs.setdefault('preexec_fn', os.setsid)
+
         try:
             process = subprocess.Popen(*args, **kwargs)
+            if not self.RUNS_WHEN_CANCELLED:
+                job_processes.add(self.cookie, process)
             return process
         except:
+            self._release_connection()
             self.message_service.publish_message(
                 line="{0}: Popen() failed".format(
                     self.__class__.__name__))
             self.message_service.publish_message(
                 line="{0}:  + SSH_CMD: '{1}'"
-                "".format(self.__class__.__name__, settings.SSH_BASE_ARGS))
+                "".format(self.__class__.__name__, self.ssh_gateway_args))
             self.message_service.publish_message(
                 line="{0}:  + ARGS: '{1}'".format(self.__class__.__name__,
                                                   args))
@@ -111,6 +456,9 @@ class BaseRemoteCommand(object):
             raise(Exception("{0}: process.communicate() failed".format(
                 self.__class__.__name__)))
 
+        finally:
+            self._release_connection(p)
+
     def _check_exit_status(self, process, stdout_data, stderr_data):
 
         if process.returncode == 0:
@@ -138,40 +486,140 @@ class BaseRemoteCommand(object):
                         "".format(self.__class__.__name__)))
 
     def _process_stdout(self, proc):
-        first_line = True
-        while True:
-            line = proc.stdout.readline()
-            # TODO: why sublines? to facilitate regexes!
-            for subline in [sl.rstrip()
-                            for sl in line.splitlines() if sl.strip()]:
+        """Reads and process the output of the process, waits for
+        it to finish and informs the web tier.
 
-                logger.info("%s> %s", self.__class__.__name__, subline)
+        :returns: exit status of subprocess
+        """
+        try:
+            self._read_stdout(proc)
 
-                if first_line:
-                    first_line = False
-                    self.message_service.log_and_publish(
-                        "The first line was received", sparkStarted=True)
+            self.message_service.log_and_publish(
+                "Waiting for the child to join...")
 
-                self._process_incoming_line(self.cookie, subline)
+            proc.wait()
+        finally:
+            self._release_connection(proc)
 
-            if not line:
-                # this works because empty lines are '\n' and so
-                # dont resovle to False
-                break
+        return self._publish_job_ended(proc)
 
-        self.message_service.log_and_publish(
-            "Waiting for the child to join...")
+    def _read_stdout(self, proc):
+        """Process each line of the output of the process, until EOF.
 
-        proc.wait()
+        With the 'eventloop' `JOB_ENGINE`, the output is read by the
+        OutputLoop of the worker process (see `engine`). Else, if
+        `OUTPUT_PIPELINE_ENABLED`, the output is read by another thread
+        (see `StdoutReader`), so the process isn't blocked while the
+        lines are parsed and published.
+
+        :returns: the count of received lines
+        """
+        if is_eventloop_engine():
+            self._received_lines = 0
+            try:
+                get_job_engine().output_loop.read(proc.stdout,
+                                                  self._process_batch)
+            except:
+                # The OutputLoop stopped reading: the process would block
+                self._kill(proc)
+                raise
+            return self._end_of_output()
+
+        if settings.OUTPUT_PIPELINE_ENABLED:
+            reader = StdoutReader(proc.stdout,
+                                  settings.OUTPUT_PIPELINE_BLOCKS_QUEUE_SIZE,
+                                  settings.OUTPUT_READ_BLOCK_SIZE)
+            reader.start()
+            batches = reader.iter_batches()
+        else:
+            reader = None
+            batches = split_lines(read_blocks(proc.stdout,
+                                              settings.OUTPUT_READ_BLOCK_SIZE))
+
+        try:
+            received_lines = self._process_lines(batches)
+        except:
+            # Nobody will read the rest of the output: the reader and the
+            # process would block forever
+            if reader is not None:
+                reader.stop()
+            self._kill(proc)
+            raise
+
+        if reader is not None:
+            logger.info("%s: stdout queue stats: %s",
+                        self.__class__.__name__, reader.queue.get_stats())
+
+        return received_lines
+
+    def _kill(self, proc):
+        """Kills the process group of the process (if still running)"""
+        if proc.poll() is not None:
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except OSError:
+            logger.exception("Couldn't kill process group %s", proc.pid)
+
+    def _process_lines(self, batches):
+        """Process each line of output (from an iterable of lists of lines,
+        see `linesplitter.split_lines()`). The console redraws are passed
+        to the parsers, but they aren't lines of the log.
+
+        :returns: the count of received lines
+        """
+        self._received_lines = 0
+        for batch in batches:
+            self._process_batch(batch)
+        return self._end_of_output()
+
+    def _process_batch(self, batch):
+        """Process a list of lines (and ConsoleRedraw) of output"""
+        log_lines = logger.isEnabledFor(logging.INFO)
+        log_prefix = "{0}>".format(self.__class__.__name__)
+        for subline in batch:
+            if subline.__class__ is ConsoleRedraw:
+                self.parser_dispatcher.dispatch(subline)
+                continue
+
+            if log_lines:
+                logger.info("%s %s", log_prefix, subline)
+
+            if self._received_lines == 0:
+                job_phase_timers.get(self.cookie).mark('first_output')
+                self.message_service.log_and_publish(
+                    "The first line was received", sparkStarted=True)
+            self._received_lines += 1
+
+            self._process_incoming_line(self.cookie, subline)
+
+    def _end_of_output(self):
+        """Flushes the parsers at the end of the output.
+
+        :returns: the count of received lines
+        """
+        self.parser_dispatcher.flush()
+        job_phase_timers.get(self.cookie).count('lines_parsed',
+                                                self._received_lines)
+        return self._received_lines
+
+    def _publish_job_ended(self, proc):
+        return self._publish_exit_status(proc.returncode)
+
+    def _publish_exit_status(self, exit_status):
+        if job_processes.is_cancelled(self.cookie):
+            raise JobCancelledException(
+                "{0}: job was cancelled. exit_status: {1}".format(
+                    self.__class__.__name__, exit_status))
 
         self.message_service.log_and_publish(
             "{0}: job ended. exit_status: %s".format(self.__class__.__name__),
-            proc.returncode,
+            exit_status,
             jobFinishedOk=True,
-            exitStatus=proc.returncode
+            exitStatus=exit_status
         )
 
-        return proc.returncode
+        return exit_status
 
 
 #==============================================================================
@@ -187,9 +635,9 @@ class MkTemp(BaseRemoteCommand):
     def get_command(self):
         """Gererates the command to execute to launch the remote process"""
 
-        ARGS = settings.SSH_BASE_ARGS + ["mktemp", "-t",
-                                         "spark-job-script-XXXXXXXXXX",
-                                         "--suffix=.scala"]
+        ARGS = self._ssh_base_args() + ["mktemp", "-t",
+                                        "spark-job-script-XXXXXXXXXX",
+                                        "--suffix=.scala"]
 
         return ARGS
 
@@ -198,11 +646,12 @@ class MkTemp(BaseRemoteCommand):
         self.message_service.log_and_publish("Executing mktemp in "
                                              "remote server")
 
-        proc, stdout_data, stderr_data = self._popen_and_communicate(
-            self.get_command(),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
+        with job_phase_timers.get(self.cookie).phase('mktemp'):
+            proc, stdout_data, stderr_data = self._popen_and_communicate(
+                self.get_command(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
 
         self._check_exit_status(proc, stdout_data, stderr_data)
 
@@ -225,7 +674,7 @@ class SendScript(BaseRemoteCommand):
     def get_command(self, temp_file):
         """Gererates the command to execute to launch the remote process"""
 
-        ARGS = settings.SSH_BASE_ARGS + ["cat > {0}".format(temp_file)]
+        ARGS = self._ssh_base_args() + ["cat > {0}".format(temp_file)]
 
         return ARGS
 
@@ -238,13 +687,14 @@ class SendScript(BaseRemoteCommand):
 
         temp_file = self.mktemp_service.mktemp()
 
-        proc, stdout_data, stderr_data = self._popen_and_communicate(
-            self.get_command(temp_file),
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            std_input=script
-        )
+        with job_phase_timers.get(self.cookie).phase('send_script'):
+            proc, stdout_data, stderr_data = self._popen_and_communicate(
+                self.get_command(temp_file),
+                stdout=subprocess.PIPE,
+                stdin=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                std_input=script
+            )
 
         self._check_exit_status(proc, stdout_data, stderr_data)
 
@@ -259,28 +709,36 @@ class RunSparkShell(BaseRemoteCommand):
     def __init__(self, message_service, cookie):
         super(RunSparkShell, self).__init__(message_service, cookie)
 
-    def get_command(self, script_path):
-        """Gererates the command to execute to launch the remote process"""
+    def _spark_shell_command(self, script_path=None, exec_=False):
+        """Generates the shell command that launches spark-shell (if
+        `script_path` is None, the script is read from stdin), with its
+        output filtered if `OUTPUT_FILTER_POLICY` is set (see
+        `smoke.services.outputfilter`).
 
-        REMOTE_COMMAND_TEMPLATE = \
-            "'" + \
+        If `exec_` is True, spark-shell replaces the shell (unless the
+        output is filtered).
+        """
+
+        SPARK_SHELL_TEMPLATE = \
             "{spark_shell} " + \
             "{spark_shell_opts} " + \
-            "--master yarn-client " + \
-            "-i {script_path} 2>&1" + \
-            "'"
+            "--master yarn-client" + \
+            "{script_option} 2>&1"
 
-        REMOTE_COMMAND = REMOTE_COMMAND_TEMPLATE.format(
+        command = SPARK_SHELL_TEMPLATE.format(
             spark_shell=settings.REMOTE_SPARK_SHELL_PATH,
-            script_path=script_path,
+            script_option=" -i " + script_path if script_path else "",
             spark_shell_opts=settings.REMOTE_SPARK_SHELL_PATH_OPTS,
         )
 
-        ARGS = settings.SSH_BASE_ARGS + ["env",
-                                         "DATATSUNAMI_COOKIE=" + self.cookie,
-                                         "sh", "-c", REMOTE_COMMAND]
+        filtered_command = outputfilter.filter_command(command)
+        if filtered_command is not None:
+            return filtered_command
+        return "exec " + command if exec_ else command
 
-        return ARGS
+    def get_command(self, script_path):
+        """Gererates the command to execute to launch the remote process"""
+        return self._remote_sh_command(self._spark_shell_command(script_path))
 
     def run_spark_shell(self, script_path):
         """Runs the spark script on the server.
@@ -296,6 +754,204 @@ class RunSparkShell(BaseRemoteCommand):
         return self._process_stdout(p)
 
 
+def script_digest(script):
+    """Returns the key of `script` on the remote script cache"""
+    return hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+
+_known_cached_scripts = set()
+"""(ssh base args, digest) of the scripts this process knows are
+on the remote script cache
+"""
+
+
+class UploadAndRunSparkShell(RunSparkShell):
+    """Uploads the script and launches spark-shell in a single ssh
+    round trip.
+
+    The script is saved on the remote script cache (a directory
+    on the server), with the hash of the contents as filename. If this
+    process already sent the same script, the upload is skipped, and only
+    if the file was removed from the cache, the script is sent again.
+
+    Each time a new script is saved, the old entries of the cache (not
+    used in the last `REMOTE_SCRIPT_CACHE_MAX_AGE_DAYS` days) are removed,
+    at most `REMOTE_SCRIPT_CACHE_GC_BATCH` files at a time.
+    """
+
+    CACHE_MISS_EXIT_STATUS = 97
+    """Exit status of the remote command when the script isn't cached"""
+
+    def __init__(self, message_service, cookie):
+        super(UploadAndRunSparkShell, self).__init__(message_service, cookie)
+
+    def _cache_key(self, digest):
+        return (tuple(self.ssh_gateway_args), digest)
+
+    def get_command(self, digest, upload):
+        """Gererates the command to execute to launch the remote process.
+
+        If `upload` is True, the script is read from stdin (if isn't
+        already cached).
+        """
+
+        cache_file = '"$d/{0}.scala"'.format(digest)
+
+        if upload:
+            ensure_cached = \
+                "if [ -s {f} ] ; then " \
+                "touch {f} && cat > /dev/null ; " \
+                "else " \
+                "mkdir -p \"$d\" && " \
+                "cat > {f}.$$ && mv {f}.$$ {f} || exit 1 ; " \
+                "( find \"$d\" -type f -name \"*.scala*\" -mtime +{age} " \
+                "| head -n {batch} | xargs rm -f ) " \
+                "< /dev/null > /dev/null 2>&1 & " \
+                "fi".format(f=cache_file,
+                            age=settings.REMOTE_SCRIPT_CACHE_MAX_AGE_DAYS,
+                            batch=settings.REMOTE_SCRIPT_CACHE_GC_BATCH)
+        else:
+            ensure_cached = \
+                "[ -s {f} ] || exit {status} ; touch {f}".format(
+                    f=cache_file, status=self.CACHE_MISS_EXIT_STATUS)
+
+        REMOTE_COMMAND_TEMPLATE = \
+            "d={cache_dir} ; {ensure_cached} ; {spark}"
+
+        REMOTE_COMMAND = REMOTE_COMMAND_TEMPLATE.format(
+            cache_dir=settings.REMOTE_SCRIPT_CACHE_DIR,
+            ensure_cached=ensure_cached,
+            spark=self._spark_shell_command(cache_file, exec_=True))
+
+        return self._remote_sh_command(REMOTE_COMMAND)
+
+    def run_script(self, script):
+        """Sends (if needed) and runs the spark script on the server.
+
+        :returns: exit status of subprocess
+        """
+        digest = script_digest(script)
+        cache_key = self._cache_key(digest)
+
+        self.message_service.log_and_publish("Using cookie: %s", self.cookie)
+
+        if cache_key in _known_cached_scripts:
+            self.message_service.log_and_publish(
+                "Script %s should be in the remote cache, won't be sent",
+                digest)
+
+            p = self._popen(self.get_command(digest, upload=False),
+                            stdout=subprocess.PIPE)
+            try:
+                received_lines = self._read_stdout(p)
+                p.wait()
+            finally:
+                self._release_connection(p)
+
+            if received_lines or p.returncode != self.CACHE_MISS_EXIT_STATUS:
+                return self._publish_job_ended(p)
+
+            _known_cached_scripts.discard(cache_key)
+            self.message_service.log_and_publish(
+                "Script %s wasn't found in the remote cache", digest)
+
+        self.message_service.log_and_publish(
+            "Sending script %s and launching spark-shell", digest)
+
+        p = self._popen(self.get_command(digest, upload=True),
+                        stdout=subprocess.PIPE,
+                        stdin=subprocess.PIPE)
+        try:
+            p.stdin.write(script.encode('utf-8'))
+            p.stdin.close()
+        except:
+            self._release_connection(p)
+            raise
+
+        exit_status = self._process_stdout(p)
+
+        if exit_status == 0:
+            if len(_known_cached_scripts) >= \
+                    settings.REMOTE_SCRIPT_CACHE_INDEX_SIZE:
+                _known_cached_scripts.clear()
+            _known_cached_scripts.add(cache_key)
+
+        return exit_status
+
+    def _publish_job_ended(self, proc):
+        # Without any output, spark-shell wasn't started
+        if gateways_enabled() and self._received_lines == 0 and \
+                proc.returncode == SSH_ERROR_EXIT_STATUS and \
+                not job_processes.is_cancelled(self.cookie):
+            raise SshConnectionFailedException(
+                "{0}: ssh exit status: {1}, no output received".format(
+                    self.__class__.__name__, proc.returncode))
+        return super(UploadAndRunSparkShell, self)._publish_job_ended(proc)
+
+
+class RunInSparkSession(RunSparkShell):
+    """Runs the script in a warm spark-shell session of the user (see
+    `SparkSessionPool`). A new session is started if the user has no
+    idle session on the gateway of the job: its startup output is
+    processed as part of the job.
+
+    The ssh channel of the session is only reserved while it runs a
+    script of a job.
+    """
+
+    def __init__(self, message_service, cookie):
+        super(RunInSparkSession, self).__init__(message_service, cookie)
+
+    def get_command(self):
+        """Gererates the command to execute to launch the remote process"""
+        return self._remote_sh_command(self._spark_shell_command())
+
+    def _start_session(self, user):
+        self.message_service.log_and_publish(
+            "Starting a new spark-shell session")
+        process = self._popen(self.get_command(), stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE)
+        return SparkShellSession(user, process, cookie=self.cookie,
+                                 ssh_gateway_args=self.ssh_gateway_args)
+
+    def run_script(self, script, user):
+        """Runs the spark script in a session of `user`.
+
+        :returns: exit status (0 if the script finished, or the exit
+            status of spark-shell if the session ended)
+        """
+        pool = get_session_pool()
+        session, reused = pool.acquire(user, self._start_session,
+                                       self.ssh_gateway_args)
+        if reused:
+            self.message_service.log_and_publish(
+                "Using a warm spark-shell session (scripts run: %s, "
+                "age: %d secs)", session.scripts_run,
+                time.time() - session.created, sparkSessionReused=True)
+            try:
+                self._setup_connection()
+            except:
+                pool.release(session, reusable=True)
+                raise
+
+        # If the job is cancelled, the session is killed (with the cookie
+        # of the job that started it)
+        job_processes.set_remote(self.cookie, session.cookie,
+                                 session.ssh_gateway_args)
+        job_processes.add(self.cookie, session.process)
+        try:
+            session.send_script(script, self.cookie)
+            self._process_lines(
+                split_lines(session.iter_output(self.cookie)))
+        finally:
+            self._release_connection(session.process)
+            pool.release(session, reusable=session.last_script_finished)
+
+        if session.last_script_finished:
+            return self._publish_exit_status(0)
+        return self._publish_exit_status(session.process.wait())
+
+
 class Cat(BaseRemoteCommand):
 
     def __init__(self, message_service, cookie):
@@ -304,7 +960,7 @@ class Cat(BaseRemoteCommand):
     def get_command(self, script_path):
         """Gererates the command to execute to launch the remote process"""
 
-        ARGS = settings.SSH_BASE_ARGS + ["cat", script_path]
+        ARGS = self._ssh_base_args() + ["cat", script_path]
 
         return ARGS
 
@@ -329,7 +985,7 @@ class Echo(BaseRemoteCommand):
     def get_command(self):
         """Gererates the command to execute to launch the remote process"""
 
-        ARGS = settings.SSH_BASE_ARGS + ["echo", "pong"]
+        ARGS = self._ssh_base_args() + ["echo", "pong"]
 
         return ARGS
 
@@ -344,3 +1000,64 @@ class Echo(BaseRemoteCommand):
         p = self._popen(self.get_command(), stdout=subprocess.PIPE)
 
         return self._process_stdout(p)
+
+
+class KillRemoteProcesses(BaseRemoteCommand):
+    """Kills the remote processes of a job: the process groups of the
+    processes with the cookie of the job in their environment
+    (`DATATSUNAMI_COOKIE`, see `_remote_sh_command()`).
+
+    `remote_cookie` and `ssh_gateway_args` are given when the processes
+    don't have the cookie of the job or don't run on its gateway (see
+    `JobProcesses.remote_of()`).
+    """
+
+    RUNS_WHEN_CANCELLED = True
+
+    def __init__(self, message_service, cookie, remote_cookie=None,
+                 ssh_gateway_args=None):
+        super(KillRemoteProcesses, self).__init__(message_service, cookie)
+        self.remote_cookie = remote_cookie or cookie
+        if ssh_gateway_args is not None:
+            self.ssh_gateway_args = ssh_gateway_args
+
+    def get_command(self):
+        """Gererates the command to execute to launch the remote process"""
+
+        REMOTE_COMMAND_TEMPLATE = \
+            "pids=$(for p in /proc/[0-9]* ; do " \
+            "tr \"\\000\" \"\\n\" < $p/environ 2> /dev/null " \
+            "| grep -qx DATATSUNAMI_COOKIE={cookie} && echo ${{p#/proc/}} ; " \
+            "done) ; " \
+            "[ -n \"$pids\" ] || exit 0 ; " \
+            "pgids=$(ps -o pgid= -p \"$(echo $pids | tr \" \" \",\")\" " \
+            "| sort -u) ; " \
+            "echo \"Killing process groups: \"$pgids ; " \
+            "for g in $pgids ; do kill -s TERM -- -$g ; done ; " \
+            "sleep {grace} ; " \
+            "for g in $pgids ; do kill -s KILL -- -$g 2> /dev/null ; done ; " \
+            "exit 0"
+
+        # The cookie isn't set in the environment of this command, so it
+        # doesn't kill itself
+        return self._remote_sh_command(
+            REMOTE_COMMAND_TEMPLATE.format(
+                cookie=self.remote_cookie,
+                grace=settings.JOB_CANCEL_KILL_GRACE_SECONDS),
+            with_cookie=False)
+
+    def kill(self):
+        """Kills the remote processes of the job"""
+        self.message_service.log_and_publish(
+            "Killing the remote processes of the job")
+
+        proc, stdout_data, stderr_data = self._popen_and_communicate(
+            self.get_command(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+
+        self._check_exit_status(proc, stdout_data, stderr_data)
+
+        for line in stdout_data.splitlines():
+            self.message_service.log_and_publish("%s", line)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the results of the jobs: the messages published while the
+job was executed, replayed when an identical job is submitted.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import time
+import zlib
+
+from django.conf import settings
+from redis import StrictRedis
+from ws4redis.publisher import redis_connection_pool
+from ws4redis.redis_store import RedisStore
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_script(script):
+    """Removes the differences that don't change the result of a script:
+    trailing spaces, blank lines at start and end, and line endings
+    """
+    lines = [line.rstrip() for line in script.splitlines()]
+    return "\n".join(lines).strip("\n")
+
+
+def result_cache_key(script, action):
+    """Returns the key of the result of running `script` with `action`"""
+    key_data = json.dumps([normalize_script(script), action,
+                           settings.REMOTE_SPARK_SHELL_PATH,
+                           settings.REMOTE_SPARK_SHELL_PATH_OPTS])
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """Results saved in Redis, compressed.
+
+    The entries expire after `ttl` seconds. The total (compressed) size is
+    kept under `max_size` bytes removing the oldest entries, using an
+    index of the entries saved in Redis and modified while holding a lock.
+    """
+
+    def __init__(self, connection, ttl, max_size):
+        self._connection = connection
+        self.ttl = ttl
+        self.max_size = max_size
+        self._prefix = "{0}resultcache:".format(RedisStore.get_prefix())
+
+    def _entry_key(self, key):
+        return self._prefix + key
+
+    @contextmanager
+    def _index(self):
+        """Yields the index (key -> [size, created]), saving it
+        afterwards (holding the lock)
+        """
+        with self._connection.lock(self._prefix + "lock", timeout=30,
+                                   sleep=0.05):
+            index = json.loads(self._connection.get(self._prefix + "index")
+                               or "{}")
+            yield index
+            self._connection.set(self._prefix + "index", json.dumps(index))
+
+    def has(self, key):
+        return bool(self._connection.exists(self._entry_key(key)))
+
+    def get(self, key):
+        """Returns the cached result (a dict with the `messages`,
+        `exit_status` and `created`), or None
+        """
+        data = self._connection.get(self._entry_key(key))
+        if data is None:
+            return None
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def set(self, key, messages, exit_status):
+        """Saves the result of a job: the list of published messages
+        (dicts) and its exit status
+        """
+        now = time.time()
+        data = zlib.compress(json.dumps({
+            'messages': messages,
+            'exit_status': exit_status,
+            'created': now,
+        }).encode('utf-8'))
+        if len(data) > self.max_size:
+            logger.info("Result too big to be cached: %s bytes", len(data))
+            return
+
+        with self._index() as index:
+            for cached_key, (size, created) in list(index.items()):
+                if now - created > self.ttl:
+                    del index[cached_key]
+
+            index.pop(key, None)
+            total_size = sum(size for size, _ in index.values()) + len(data)
+            for cached_key in sorted(index, key=lambda k: index[k][1]):
+                if total_size <= self.max_size:
+                    break
+                total_size -= index.pop(cached_key)[0]
+                self._connection.delete(self._entry_key(cached_key))
+
+            self._connection.setex(self._entry_key(key), self.ttl, data)
+            index[key] = [len(data), now]
+
+
+def get_result_cache():
+    """Returns the ResultCache, configured from settings"""
+    return ResultCache(StrictRedis(connection_pool=redis_connection_pool),
+                       ttl=settings.RESULT_CACHE_TTL,
+                       max_size=settings.RESULT_CACHE_MAX_SIZE)
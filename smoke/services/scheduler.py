@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control of the jobs: caps the jobs running in the cluster
+(and per user), and dispatches the queued jobs fairly (round robin
+between the users with queued jobs).
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import json
+import logging
+import math
+import time
+
+from django.conf import settings
+from redis import StrictRedis
+from ws4redis.publisher import redis_connection_pool
+from ws4redis.redis_store import RedisStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerState(object):
+    """Queued and running jobs. Saved in Redis as JSON, and modified
+    only while holding the lock of the scheduler.
+    """
+
+    MAX_DURATIONS = 20
+    """Durations of the latest finished jobs, used to estimate waits"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.running = data.get('running', {})
+        """cookie -> {'user': user, 'start': timestamp}"""
+        self.queues = data.get('queues', {})
+        """user -> list of cookies of the queued jobs"""
+        self.users = data.get('users', [])
+        """Users with queued jobs, in the order they will be served"""
+        self.durations = data.get('durations', [])
+
+    def to_json(self):
+        return json.dumps({'running': self.running, 'queues': self.queues,
+                           'users': self.users,
+                           'durations': self.durations})
+
+    def enqueue(self, cookie, user):
+        self.queues.setdefault(user, []).append(cookie)
+        if user not in self.users:
+            self.users.append(user)
+
+    def _running_count(self, user):
+        return sum(1 for job in self.running.values() if job['user'] == user)
+
+    def expire_running(self, max_seconds, now):
+        """Forgets the running jobs started more than `max_seconds` ago
+        (their worker died without reporting the end of the job)
+        """
+        for cookie, job in list(self.running.items()):
+            if now - job['start'] > max_seconds:
+                logger.warn("Forgetting job %s, running since %s",
+                            cookie, job['start'])
+                del self.running[cookie]
+
+    def dispatch(self, max_running, max_running_per_user, now):
+        """Marks as running the next queued jobs, while there's capacity.
+
+        :returns: list of cookies of the jobs to launch
+        """
+        dispatched = []
+        skipped = 0
+        while self.users and len(self.running) < max_running and \
+                skipped < len(self.users):
+            user = self.users.pop(0)
+            if self._running_count(user) >= max_running_per_user:
+                self.users.append(user)
+                skipped += 1
+                continue
+
+            cookie = self.queues[user].pop(0)
+            self.running[cookie] = {'user': user, 'start': now}
+            dispatched.append(cookie)
+            skipped = 0
+            if self.queues[user]:
+                self.users.append(user)
+            else:
+                del self.queues[user]
+        return dispatched
+
+    def is_queued(self, cookie):
+        return any(cookie in cookies for cookies in self.queues.values())
+
+    def finish(self, cookie, now):
+        """Removes a job from the running (or queued) jobs"""
+        job = self.running.pop(cookie, None)
+        if job is not None:
+            self.durations = (self.durations + [now - job['start']])[
+                -self.MAX_DURATIONS:]
+            return
+
+        for user, cookies in list(self.queues.items()):
+            if cookie in cookies:
+                cookies.remove(cookie)
+                if not cookies:
+                    del self.queues[user]
+                    self.users.remove(user)
+
+    def queue_order(self):
+        """Returns the cookies of the queued jobs, in the order they are
+        expected to be dispatched (ignoring the limits per user)
+        """
+        queues = [list(self.queues[user]) for user in self.users]
+        order = []
+        while queues:
+            for cookies in queues:
+                order.append(cookies.pop(0))
+            queues = [cookies for cookies in queues if cookies]
+        return order
+
+    def estimate_wait(self, position, max_running, default_duration):
+        """Returns the estimated seconds until the job at `position`
+        (0-based) of the queue is dispatched
+        """
+        if self.durations:
+            duration = sum(self.durations) / len(self.durations)
+        else:
+            duration = default_duration
+        free_slots = max(max_running - len(self.running), 0)
+        if position < free_slots:
+            return 0
+        rounds = int(math.ceil(float(position - free_slots + 1) /
+                               max_running))
+        return int(rounds * duration)
+
+
+class JobScheduler(object):
+    """Queue of the jobs of a cluster, saved in Redis (shared by the
+    web tier and the workers)
+    """
+
+    def __init__(self, connection, cluster, max_running,
+                 max_running_per_user, running_timeout,
+                 default_duration):
+        self._connection = connection
+        self.max_running = max_running
+        self.max_running_per_user = max_running_per_user
+        self.running_timeout = running_timeout
+        self.default_duration = default_duration
+        self._key = "{0}scheduler:{1}".format(RedisStore.get_prefix(),
+                                              cluster)
+
+    def _job_key(self, cookie):
+        return "{0}:job:{1}".format(self._key, cookie)
+
+    @contextmanager
+    def _state(self):
+        """Yields the state, saving it afterwards (holding the lock)"""
+        with self._connection.lock(self._key + ":lock", timeout=30,
+                                   sleep=0.05):
+            state = SchedulerState(json.loads(
+                self._connection.get(self._key) or "{}"))
+            yield state
+            self._connection.set(self._key, state.to_json())
+
+    def _dispatch(self, state):
+        """Returns the jobs to launch: list of (cookie, job_args)"""
+        now = time.time()
+        state.expire_running(self.running_timeout, now)
+        jobs = []
+        for cookie in state.dispatch(self.max_running,
+                                     self.max_running_per_user, now):
+            job_args = self._connection.get(self._job_key(cookie))
+            self._connection.delete(self._job_key(cookie))
+            if job_args is None:
+                logger.warn("Arguments of job %s not found", cookie)
+                del state.running[cookie]
+                continue
+            jobs.append((cookie, json.loads(job_args)))
+        return jobs
+
+    def submit(self, cookie, user, job_args):
+        """Queues a job. `job_args` (a dict) are returned by
+        `submit()` or `finish()` when the job can be launched.
+
+        :returns: list of (cookie, job_args) of the jobs to launch
+        """
+        self._connection.set(self._job_key(cookie), json.dumps(job_args))
+        with self._state() as state:
+            state.enqueue(cookie, user)
+            return self._dispatch(state)
+
+    def finish(self, cookie):
+        """Reports the end of a job (or removes it from the queue)
+
+        :returns: list of (cookie, job_args) of the jobs to launch
+        """
+        with self._state() as state:
+            state.finish(cookie, time.time())
+            self._connection.delete(self._job_key(cookie))
+            return self._dispatch(state)
+
+    def cancel(self, cookie):
+        """Removes a job from the queue (a running job is removed by
+        `finish()` when its worker stops it)
+
+        :returns: (True if the job was queued, list of (cookie, job_args)
+            of the jobs to launch)
+        """
+        with self._state() as state:
+            if not state.is_queued(cookie):
+                return False, []
+            state.finish(cookie, time.time())
+            self._connection.delete(self._job_key(cookie))
+            return True, self._dispatch(state)
+
+    def get_queue(self):
+        """Returns the queued jobs, in the expected order of dispatch,
+        as a list of (cookie, position, estimated seconds to start)
+        """
+        state = SchedulerState(json.loads(
+            self._connection.get(self._key) or "{}"))
+        return [(cookie, position,
+                 state.estimate_wait(position, self.max_running,
+                                     self.default_duration))
+                for position, cookie in enumerate(state.queue_order())]
+
+
+def get_scheduler():
+    """Returns the scheduler of the cluster, configured from settings"""
+    return JobScheduler(
+        StrictRedis(connection_pool=redis_connection_pool),
+        cluster=settings.SCHEDULER_CLUSTER_NAME,
+        max_running=settings.SCHEDULER_MAX_RUNNING_JOBS,
+        max_running_per_user=settings.SCHEDULER_MAX_RUNNING_JOBS_PER_USER,
+        running_timeout=settings.SCHEDULER_RUNNING_TIMEOUT,
+        default_duration=settings.SCHEDULER_DEFAULT_JOB_DURATION)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of warm spark-shell sessions: long-lived spark-shell processes
+(and YARN ApplicationMasters) that run the scripts sent on stdin, to not
+pay the startup of spark-shell on each job.
+
+The remote processes of a session have the cookie of the job that started
+it in their environment (`DATATSUNAMI_COOKIE`), so they're killed with
+that cookie. The cookie of the current job is set in the system property
+`DATATSUNAMI_COOKIE` before each script.
+"""
+
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import os
+import re
+import signal
+import threading
+import time
+
+from django.conf import settings
+from smoke.services.perprocess import PerProcess
+
+
+logger = logging.getLogger(__name__)
+
+REPL_PROMPTS = (b"scala> ", b"     | ")
+"""Prompts printed by the REPL before the output (stdin isn't a tty)"""
+
+RE_ENVIRONMENT_COOKIE = re.compile(
+    r'(?:sys\.env|System\.getenv)\b[^\n]*DATATSUNAMI_COOKIE')
+"""Reads of the cookie from the environment (the cookie of the job that
+started the session)
+"""
+
+
+def reads_cookie_from_environment(script):
+    """Returns True if the script reads the cookie from the environment:
+    it can't run in a session started by another job
+    """
+    return RE_ENVIRONMENT_COOKIE.search(script) is not None
+
+
+def script_finished_marker(cookie):
+    """Returns the line printed by spark-shell when a script finished"""
+    return '@@<msgFromShell cookie="{0}"><scriptFinished/>' \
+        '</msgFromShell>@@'.format(cookie)
+
+
+class SparkShellSession(object):
+    """A spark-shell process that runs the scripts sent on stdin.
+
+    After each script, the session prints the marker returned by
+    `script_finished_marker()` (a message of the `msgFromShell`
+    protocol), so the end of the script can be detected.
+    """
+
+    def __init__(self, user, process, cookie=None, ssh_gateway_args=None,
+                 clock=time.time):
+        self.user = user
+        self.process = process
+        self.cookie = cookie
+        """Cookie of the job that started the session (in the environment
+        of its remote processes)
+        """
+        self.ssh_gateway_args = ssh_gateway_args
+        """ssh base args of the gateway where the session runs"""
+        self.clock = clock
+        self.created = clock()
+        self.last_used = self.created
+        self.scripts_run = 0
+        self.last_script_finished = False
+        """True if the marker of the last script was received"""
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def send_script(self, script, cookie):
+        """Sends the script, preceded by the command that sets the cookie
+        of the job and followed by the command that prints the marker of
+        the end of the script
+        """
+        marker = script_finished_marker(cookie).replace('"', '\\"')
+        self.last_script_finished = False
+        # A block returning Unit: the REPL prints nothing
+        self.process.stdin.write(
+            '{{ System.setProperty("DATATSUNAMI_COOKIE", "{0}") ; () }}\n'
+            .format(cookie).encode('utf-8'))
+        self.process.stdin.write(script.encode('utf-8'))
+        self.process.stdin.write('\nprintln("{0}")\n'.format(
+            marker).encode('utf-8'))
+        self.process.stdin.flush()
+
+    def iter_output(self, cookie):
+        """Yields the lines of output of the script, until the marker
+        (or EOF, if the session ended)
+        """
+        marker = script_finished_marker(cookie).encode('utf-8')
+        for line in iter(self.process.stdout.readline, b''):
+            while line.startswith(REPL_PROMPTS):
+                # All the prompts have the same length
+                line = line[len(REPL_PROMPTS[0]):]
+            if line.rstrip() == marker:
+                self.scripts_run += 1
+                self.last_script_finished = True
+                self.last_used = self.clock()
+                return
+            yield line
+
+    def close(self, timeout=10):
+        """Ends the REPL (closing stdin), killing it after `timeout`"""
+        logger.info("Closing spark-shell session of %s (pid %s)",
+                    self.user, self.process.pid)
+        try:
+            if self.is_alive():
+                self.process.stdin.close()
+                deadline = time.time() + timeout
+                while self.is_alive() and time.time() < deadline:
+                    time.sleep(0.1)
+            if self.is_alive():
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait()
+        except (IOError, OSError):
+            logger.exception("Error closing spark-shell session")
+
+
+class SparkSessionPool(object):
+    """Idle sessions of spark-shell of a worker process.
+
+    Sessions are only reused for jobs of the same user on the same
+    gateway. A session is closed when it's idle for more than
+    `idle_timeout` seconds, when it's older than `max_lifetime` seconds,
+    or when a script didn't finish normally (ie: it called `exit`). At
+    most `max_sessions` sessions are kept (the least recently used is
+    closed).
+    """
+
+    def __init__(self, max_sessions, idle_timeout, max_lifetime,
+                 clock=time.time):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.clock = clock
+        self._idle = []
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.stats = {'created': 0, 'reused': 0, 'closed': 0}
+
+    def _is_expired(self, session, now):
+        return now - session.last_used > self.idle_timeout or \
+            now - session.created > self.max_lifetime or \
+            not session.is_alive()
+
+    def _take_expired(self):
+        """Removes (and returns) the expired sessions"""
+        now = self.clock()
+        with self._lock:
+            expired = [session for session in self._idle
+                       if self._is_expired(session, now)]
+            self._idle = [session for session in self._idle
+                          if session not in expired]
+        return expired
+
+    def _close(self, sessions):
+        for session in sessions:
+            self.stats['closed'] += 1
+            session.close()
+
+    def evict_expired(self):
+        """Closes the expired idle sessions"""
+        self._close(self._take_expired())
+
+    def acquire(self, user, start_session, ssh_gateway_args=None):
+        """Returns an idle session of `user` on the gateway, or a new one
+        (created with `start_session(user)`)
+
+        :returns: (session, True if the session was reused)
+        """
+        self._close(self._take_expired())
+        self._start_reaper()
+
+        to_close = []
+        with self._lock:
+            for session in reversed(self._idle):
+                if session.user == user and \
+                        session.ssh_gateway_args == ssh_gateway_args:
+                    self._idle.remove(session)
+                    self.stats['reused'] += 1
+                    return session, True
+            while self._idle and len(self._idle) >= self.max_sessions:
+                to_close.append(self._idle.pop(0))
+
+        self._close(to_close)
+        self.stats['created'] += 1
+        return start_session(user), False
+
+    def release(self, session, reusable):
+        """Returns the session to the pool, or closes it if it isn't
+        `reusable`, or is expired
+        """
+        if not reusable or self._is_expired(session, self.clock()):
+            self._close([session])
+            return
+        with self._lock:
+            self._idle.append(session)
+
+    def _start_reaper(self):
+        """Starts a thread that closes the expired idle sessions"""
+        if self._reaper is not None:
+            return
+        interval = min(self.idle_timeout / 2.0, 60)
+
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_expired()
+                except:
+                    logger.exception("Error closing idle sessions")
+
+        self._reaper = threading.Thread(target=reap,
+                                        name="SparkSessionReaper")
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        self._close(sessions)
+
+
+def _create_session_pool():
+    pool = SparkSessionPool(max_sessions=settings.SPARK_SESSION_POOL_SIZE,
+                            idle_timeout=settings.SPARK_SESSION_IDLE_TIMEOUT,
+                            max_lifetime=settings.SPARK_SESSION_MAX_LIFETIME)
+    atexit.register(pool.close_all)
+    return pool
+
+
+_session_pool = PerProcess(_create_session_pool)
+
+
+def get_session_pool():
+    """Returns the SparkSessionPool of this process"""
+    return _session_pool.get()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Messages from the shell: the lines `@@...@@` printed by the scripts (or by
+Smoke, see `sessions.script_finished_marker()`) to report things to Smoke.
+
+Two encodings are accepted, both decoded to a `ShellMessage`:
+
+- XML, parsed with expat (documents with a DTD are rejected, so there are
+  no entities to expand, internal or external):
+
+    @@<msgFromShell cookie="..."><outputFileName>/out</outputFileName></msgFromShell>@@
+
+- Compact JSON, versioned (`v`):
+
+    @@{"v":1,"cookie":"...","outputFileName":"/out"}@@
+
+The payloads (any combination of them) are:
+
+======================  ===================================================
+XML                     JSON
+======================  ===================================================
+`<errorLine>`           `"errorLines": ["..."]`
+`<outputFileName>`      `"outputFileName": "..."`
+`<scriptFinished/>`     `"scriptFinished": true`
+`<metric name="n">`     `"metrics": {"n": 1.5}`
+`<table>`               `"table": {"columns": [...], "rows": [[...]]}`
+`<progress done="1"     `"progress": {"done": 1, "total": 10}`
+total="10"/>`
+======================  ===================================================
+
+A table in XML is `<table><columns><cell>..</cell></columns><row><cell>..
+</cell></row></table>`. A progress can have a `stage` (a label).
+"""
+
+from __future__ import unicode_literals
+
+import json
+import math
+from xml.parsers import expat
+
+
+JSON_VERSION = 1
+"""Version of the JSON encoding generated by `encode_json()`"""
+
+SUPPORTED_JSON_VERSIONS = (1,)
+
+
+class ShellMessageError(ValueError):
+    """The message from shell is invalid"""
+
+
+class ShellMessage(object):
+
+    def __init__(self, cookie):
+        self.cookie = cookie
+        self.error_lines = []
+        self.output_filename = None
+        self.script_finished = False
+        self.metrics = {}
+        self.table = None
+        """dict with `columns` (list) and `rows` (list of lists)"""
+        self.progress = None
+        """dict with `done`, `total` and optionally `stage`"""
+
+    def is_empty(self):
+        return not (self.error_lines or self.output_filename or
+                    self.script_finished or self.metrics or
+                    self.table is not None or self.progress is not None)
+
+
+def _number(value, name):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ShellMessageError("Invalid number in {0}: {1!r}".format(
+            name, value))
+    if math.isinf(number) or math.isnan(number):
+        raise ShellMessageError("Non-finite number in {0}: {1!r}".format(
+            name, value))
+    return int(number) if number.is_integer() else number
+
+
+def _progress(done, total, stage=None):
+    progress = {'done': int(_number(done, "progress")),
+                'total': int(_number(total, "progress"))}
+    if stage is not None:
+        progress['stage'] = "{0}".format(stage)
+    return progress
+
+
+#==============================================================================
+# XML
+#==============================================================================
+
+class _XmlDecoder(object):
+    """Builds a ShellMessage from the events of expat"""
+
+    def __init__(self):
+        self.message = None
+        self._path = []
+        self._text = []
+        self._table_row = None
+
+    def _reject_dtd(self, *args):
+        raise ShellMessageError("DTDs aren't allowed")
+
+    def start(self, name, attributes):
+        parent = self._path[-1] if self._path else None
+        self._path.append(name)
+        self._text = []
+        if parent is None:
+            if name != 'msgFromShell':
+                raise ShellMessageError("Unknown root element: " + name)
+            if 'cookie' not in attributes:
+                raise ShellMessageError("The message has no cookie")
+            self.message = ShellMessage(attributes['cookie'])
+        elif name == 'table':
+            self.message.table = {'columns': [], 'rows': []}
+        elif name in ('columns', 'row') and parent == 'table':
+            self._table_row = []
+        elif name == 'progress':
+            self.message.progress = _progress(attributes.get('done'),
+                                              attributes.get('total'),
+                                              attributes.get('stage'))
+        elif name == 'metric' and 'name' not in attributes:
+            raise ShellMessageError("The metric has no name")
+        self._attributes = attributes
+
+    def end(self, name):
+        self._path.pop()
+        text = "".join(self._text)
+        self._text = []
+        message = self.message
+        if name == 'errorLine':
+            message.error_lines.append(text.rstrip())
+        elif name == 'outputFileName':
+            message.output_filename = text.strip()
+        elif name == 'scriptFinished':
+            message.script_finished = True
+        elif name == 'metric':
+            message.metrics[self._attributes['name']] = _number(text,
+                                                                "metric")
+        elif name == 'cell' and self._table_row is not None:
+            self._table_row.append(text)
+        elif name == 'columns' and message.table is not None:
+            message.table['columns'] = self._table_row
+            self._table_row = None
+        elif name == 'row' and message.table is not None:
+            message.table['rows'].append(self._table_row)
+            self._table_row = None
+
+    def characters(self, data):
+        self._text.append(data)
+
+    def decode(self, text):
+        parser = expat.ParserCreate()
+        parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        parser.StartDoctypeDeclHandler = self._reject_dtd
+        parser.EntityDeclHandler = self._reject_dtd
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.characters
+        try:
+            parser.Parse(text.encode('utf-8'), True)
+        except expat.ExpatError as e:
+            raise ShellMessageError("Invalid XML: {0}".format(e))
+        return self.message
+
+
+def decode_xml(text):
+    """Decodes a message in XML (without the `@@`)"""
+    return _XmlDecoder().decode(text)
+
+
+#==============================================================================
+# JSON
+#==============================================================================
+
+def decode_json(text):
+    """Decodes a message in JSON (without the `@@`)"""
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ShellMessageError("Invalid JSON: {0}".format(e))
+    if not isinstance(data, dict):
+        raise ShellMessageError("The message isn't a JSON object")
+    if data.get('v') not in SUPPORTED_JSON_VERSIONS:
+        raise ShellMessageError("Unsupported version: {0!r}".format(
+            data.get('v')))
+    if not data.get('cookie'):
+        raise ShellMessageError("The message has no cookie")
+
+    message = ShellMessage(data['cookie'])
+    try:
+        message.error_lines = ["{0}".format(line).rstrip()
+                               for line in data.get('errorLines', ())]
+        if data.get('outputFileName'):
+            message.output_filename = data['outputFileName'].strip()
+        message.script_finished = bool(data.get('scriptFinished'))
+        message.metrics = dict(
+            (name, _number(value, "metric"))
+            for name, value in data.get('metrics', {}).items())
+        if 'table' in data:
+            message.table = {
+                'columns': ["{0}".format(column)
+                            for column in data['table'].get('columns', ())],
+                'rows': [["{0}".format(cell) for cell in row]
+                         for row in data['table'].get('rows', ())]}
+        if 'progress' in data:
+            progress = data['progress']
+            message.progress = _progress(progress.get('done'),
+                                         progress.get('total'),
+                                         progress.get('stage'))
+    except (AttributeError, TypeError) as e:
+        raise ShellMessageError("Invalid message: {0}".format(e))
+    return message
+
+
+def encode_json(cookie, **payloads):
+    """Returns the line of a message in JSON. The payloads are the keys
+    of the JSON encoding (`outputFileName`, `metrics`...)
+    """
+    payloads.update(v=JSON_VERSION, cookie=cookie)
+    return "@@" + json.dumps(payloads, separators=(',', ':')) + "@@"
+
+
+def decode(text):
+    """Decodes a message (without the `@@`), in XML or JSON.
+
+    :raises ShellMessageError: if the message is invalid
+    """
+    text = text.strip()
+    if text.startswith("{"):
+        return decode_json(text)
+    return decode_xml(text)
+
+
+def format_table(table, max_rows):
+    """Returns the table as text, with aligned columns (at most
+    `max_rows` rows)
+    """
+    rows = [table['columns']] + table['rows'][:max_rows]
+    widths = {}
+    for row in rows:
+        for i, cell in enumerate(row):
+            widths[i] = max(widths.get(i, 0), len(cell))
+    lines = [" | ".join(cell.ljust(widths[i])
+                        for i, cell in enumerate(row)).rstrip()
+             for row in rows if row]
+    if table['columns']:
+        lines.insert(1, "-+-".join("-" * widths[i]
+                                   for i in range(len(table['columns']))))
+    if len(table['rows']) > max_rows:
+        lines.append("({0} more rows)".format(len(table['rows']) - max_rows))
+    return "\n".join(lines)
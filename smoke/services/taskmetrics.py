@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of the tasks of the jobs, aggregated while the lines of the
+finished tasks are parsed (see `TaskFinishedWithProgressParser`).
+"""
+
+from __future__ import unicode_literals
+
+import heapq
+import math
+import threading
+
+from django.conf import settings
+
+
+class DurationHistogram(object):
+    """Histogram of durations (ms) with logarithmic buckets: each bucket
+    is `BUCKET_GROWTH` times wider than the previous one, so the memory
+    used doesn't depend on the number of durations, and the quantiles
+    have a relative error below ~10%.
+    """
+
+    BUCKET_GROWTH = 2 ** 0.25
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+
+    def _bucket(self, ms):
+        return int(math.floor(math.log(max(ms, 1), self.BUCKET_GROWTH)))
+
+    def add(self, ms):
+        bucket = self._bucket(ms)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+
+    def quantile(self, q):
+        """Returns the (approximate) duration of the quantile `q`
+        (0 <= q <= 1), or None if there are no durations
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen > rank:
+                # Geometric middle of the bucket
+                return self.BUCKET_GROWTH ** (bucket + 0.5)
+
+    def count_above(self, ms):
+        """Returns the (approximate) count of durations greater than `ms`
+        (the buckets that start above `ms`)
+        """
+        return sum(count for bucket, count in self.counts.items()
+                   if self.BUCKET_GROWTH ** bucket > ms)
+
+
+class StageTaskMetrics(object):
+    """Metrics of the tasks of a stage: histogram of the durations,
+    count and total time by host, and the slowest tasks
+    """
+
+    def __init__(self, stage, slowest_size):
+        self.stage = stage
+        self.slowest_size = slowest_size
+        self.histogram = DurationHistogram()
+        self.total_ms = 0
+        self.min_ms = None
+        self.max_ms = None
+        self.hosts = {}
+        """host -> [task count, total ms]"""
+        self.slowest = []
+        """Heap of (ms, tid, host) of the slowest tasks"""
+
+    def add(self, tid, ms, host):
+        self.histogram.add(ms)
+        self.total_ms += ms
+        self.min_ms = ms if self.min_ms is None else min(self.min_ms, ms)
+        self.max_ms = ms if self.max_ms is None else max(self.max_ms, ms)
+
+        host_metrics = self.hosts.setdefault(host, [0, 0])
+        host_metrics[0] += 1
+        host_metrics[1] += ms
+
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, (ms, tid, host))
+        elif ms > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (ms, tid, host))
+
+    def quantile(self, q):
+        """Returns the duration of the quantile `q` (limited to the
+        durations seen, the buckets are approximate)
+        """
+        return min(max(self.histogram.quantile(q), self.min_ms), self.max_ms)
+
+    def get_stragglers(self, factor, min_tasks):
+        """Returns the slowest tasks that took more than `factor` times
+        the median, as a list of (ms, tid, host), slowest first
+        """
+        if self.histogram.count < min_tasks:
+            return []
+        threshold = factor * self.quantile(0.5)
+        return sorted([task for task in self.slowest if task[0] > threshold],
+                      reverse=True)
+
+    def to_dict(self, straggler_factor, straggler_min_tasks):
+        median = self.quantile(0.5)
+        stragglers = self.get_stragglers(straggler_factor,
+                                         straggler_min_tasks)
+        if self.histogram.count >= straggler_min_tasks:
+            straggler_count = self.histogram.count_above(
+                straggler_factor * median)
+        else:
+            straggler_count = 0
+        return {
+            'stage': self.stage,
+            'tasks': self.histogram.count,
+            'total_ms': self.total_ms,
+            'min_ms': self.min_ms,
+            'max_ms': self.max_ms,
+            'p50_ms': int(round(median)),
+            'p90_ms': int(round(self.quantile(0.9))),
+            'p99_ms': int(round(self.quantile(0.99))),
+            'straggler_count': max(straggler_count, len(stragglers)),
+            'stragglers': [{'tid': tid, 'ms': ms, 'host': host}
+                           for ms, tid, host in stragglers],
+        }
+
+
+class TaskMetricsAggregator(object):
+    """Aggregates the finished tasks of a job, by stage.
+
+    A task is a straggler if it took more than `straggler_factor` times
+    the median of its stage (stages with less than `straggler_min_tasks`
+    tasks are not checked). Only the `slowest_size` slowest tasks of each
+    stage are kept, to report the stragglers.
+    """
+
+    def __init__(self, straggler_factor=1.5, straggler_min_tasks=10,
+                 slowest_size=5):
+        self.straggler_factor = straggler_factor
+        self.straggler_min_tasks = straggler_min_tasks
+        self.slowest_size = slowest_size
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add_task(self, stage, tid, ms, host):
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = StageTaskMetrics(stage,
+                                                       self.slowest_size)
+            self._stages[stage].add(tid, ms, host)
+
+    def has_tasks(self):
+        return bool(self._stages)
+
+    def to_dict(self):
+        """Returns the metrics of the stages, and of the hosts (the
+        hosts with the highest average duration first)
+        """
+        with self._lock:
+            stages = [self._stages[stage].to_dict(self.straggler_factor,
+                                                  self.straggler_min_tasks)
+                      for stage in sorted(self._stages)]
+
+            hosts = {}
+            for stage_metrics in self._stages.values():
+                for host, (count, total_ms) in stage_metrics.hosts.items():
+                    host_metrics = hosts.setdefault(
+                        host, {'host': host, 'tasks': 0, 'total_ms': 0,
+                               'stragglers': 0})
+                    host_metrics['tasks'] += count
+                    host_metrics['total_ms'] += total_ms
+
+        for stage in stages:
+            for straggler in stage['stragglers']:
+                hosts[straggler['host']]['stragglers'] += 1
+        for host_metrics in hosts.values():
+            host_metrics['avg_ms'] = \
+                host_metrics['total_ms'] // host_metrics['tasks']
+
+        return {
+            'stages': stages,
+            'hosts': sorted(hosts.values(),
+                            key=lambda host: host['avg_ms'], reverse=True),
+        }
+
+
+class JobTaskMetrics(object):
+    """The TaskMetricsAggregator of each running job, by cookie"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aggregators = {}
+
+    def create(self, cookie):
+        """Creates (and returns) the aggregator of a job that starts"""
+        aggregator = TaskMetricsAggregator(settings.TASK_STRAGGLER_FACTOR,
+                                           settings.TASK_STRAGGLER_MIN_TASKS,
+                                           settings.TASK_METRICS_SLOWEST_TASKS)
+        with self._lock:
+            self._aggregators[cookie] = aggregator
+        return aggregator
+
+    def get(self, cookie):
+        """Returns the aggregator of the job, or None if the job isn't
+        running (like the commands run after the end of a cancelled job)
+        """
+        with self._lock:
+            return self._aggregators.get(cookie)
+
+    def pop(self, cookie):
+        """Returns (and forgets) the aggregator of a finished job, or None
+        if it wasn't created
+        """
+        with self._lock:
+            return self._aggregators.pop(cookie, None)
+
+
+job_task_metrics = JobTaskMetrics()
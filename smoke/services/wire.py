@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Compact wire format of the messages of the jobs (see `MESSAGES_WIRE_FORMAT`).
+
+Each message (a dict, see `MessageService.publish_message()`) is encoded
+as a JSON array:
+
+    [seq, line, flags]  or  [seq, line, flags, fields]
+
+- `seq`: number of the message, or null.
+- `line`: the line ("" if none).
+- `flags`: the boolean keys (`FLAGS`) that are true, as a bitmask (bit `i`
+  is `FLAGS[i]`).
+- `fields`: the rest of the keys, with the names of `FIELDS` replaced by
+  their short codes (other names are kept).
+
+The messages published together (a batch of `BufferedRedisPublisher`) are
+sent in a single frame, with the version of the format first:
+
+    [1, message, message, ...]
+
+The client decodes them with the schema (`get_schema()`) rendered in the
+page, so both sides always use the same codes. The format is versioned:
+any change of the codes needs a new `WIRE_VERSION`.
+
+This module doesn't depend on Django (it's used by `smoke/dev/load_test.py`).
+"""
+
+from __future__ import unicode_literals
+
+import json
+
+
+WIRE_VERSION = 1
+
+FLAGS = (
+    'lineIsFromRemoteOutput',
+    'errorLine',
+    'progressUpdate',
+    'jobSubmitted',
+    'receivedByWorker',
+    'sparkStarted',
+    'jobFinishedOk',
+    'jobFinishedWithError',
+    'jobCancelled',
+    'appMasterLaunched',
+    'sparkSessionReused',
+    'resultCacheHit',
+    'scriptFinished',
+)
+"""Boolean keys, encoded as bits of `flags`. Append only"""
+
+FIELDS = (
+    ('progressStage', 's'),
+    ('progressDone', 'd'),
+    ('progressTotal', 't'),
+    ('queuePosition', 'q'),
+    ('estimatedStartSeconds', 'w'),
+    ('exitStatus', 'x'),
+    ('savedJobId', 'j'),
+    ('outputFilenameReported', 'o'),
+    ('sshSetupSeconds', 'c'),
+    ('sshGateway', 'g'),
+    ('shellMetrics', 'm'),
+    ('shellTable', 'b'),
+)
+"""(key, short code) of the other keys"""
+
+_FLAG_BITS = dict((flag, 1 << bit) for bit, flag in enumerate(FLAGS))
+_CODES = dict(FIELDS)
+_NAMES = dict((code, name) for name, code in FIELDS)
+
+assert len(_CODES) == len(_NAMES), "Duplicated code in FIELDS"
+assert not set(_NAMES) & set(_CODES), "Code used as a name in FIELDS"
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def encode_message(message_dict):
+    """Returns the compact encoding (a JSON string) of a message"""
+    flags = 0
+    fields = {}
+    for key, value in message_dict.items():
+        if key == 'line' or key == 'seq':
+            continue
+        bit = _FLAG_BITS.get(key)
+        if bit is not None and value is True:
+            flags |= bit
+        elif bit is None or value:
+            # A false flag isn't encoded
+            fields[_CODES.get(key, key)] = value
+    encoded = [message_dict.get('seq'), message_dict.get('line') or "",
+               flags]
+    if fields:
+        encoded.append(fields)
+    return _dumps(encoded)
+
+
+def _decode(encoded):
+    """Returns the message (a dict) of a decoded JSON value: a compact
+    message, or a message in the original format (a dict)
+    """
+    if isinstance(encoded, dict):
+        return encoded
+    seq, line, flags = encoded[:3]
+    message_dict = {'line': line}
+    if seq is not None:
+        message_dict['seq'] = seq
+    for bit, flag in enumerate(FLAGS):
+        if flags & (1 << bit):
+            message_dict[flag] = True
+    if len(encoded) > 3:
+        for key, value in encoded[3].items():
+            message_dict[_NAMES.get(key, key)] = value
+    return message_dict
+
+
+def decode_message(data):
+    """Returns the message (a dict) of an encoded message (JSON string,
+    compact or in the original format)
+    """
+    return _decode(json.loads(data))
+
+
+def message_seq(data):
+    """Returns the `seq` of an encoded message (or None)"""
+    encoded = json.loads(data)
+    if isinstance(encoded, dict):
+        return encoded.get('seq')
+    return encoded[0]
+
+
+def pack_frame(encoded_messages):
+    """Returns a frame with the encoded messages (JSON strings)"""
+    return "[{0}{1}{2}]".format(WIRE_VERSION,
+                                "," if encoded_messages else "",
+                                ",".join(encoded_messages))
+
+
+def decode_frame(data):
+    """Returns the list of messages (dicts) of a frame. A single message
+    or a list of messages in the original format are also accepted.
+
+    :raises ValueError: if the version of the frame isn't supported
+    """
+    decoded = json.loads(data)
+    if isinstance(decoded, dict):
+        return [decoded]
+    if decoded and not isinstance(decoded[0], dict):
+        if decoded[0] != WIRE_VERSION:
+            raise ValueError("Unsupported version of the wire format: "
+                             "{0!r}".format(decoded[0]))
+        decoded = decoded[1:]
+    return [_decode(encoded) for encoded in decoded]
+
+
+def get_schema():
+    """Returns the schema used by the clients to decode the messages"""
+    return {'version': WIRE_VERSION, 'flags': list(FLAGS),
+            'fields': _NAMES}
@@ -180,6 +180,214 @@ CELERY_RESULT_SERIALIZER = 'json'
 SSH_BASE_ARGS = None
 
 REDIS_PUBLISHER_FACILITY_LABEL = 'liveLogsAndEvents'
+"""Prefix of the facilities of the jobs: the messages of each job are
+published in `<label>-<cookie>`
+"""
+
+MESSAGES_BACKLOG_SIZE = 1000
+"""Latest messages of each job kept in Redis, replayed to clients
+that connect late or reconnect
+"""
+
+MESSAGES_BACKLOG_EXPIRE = 60 * 60
+"""Seconds the backlog of a job is kept after its last message"""
+
+SPARK_SESSION_POOL_ENABLED = False
+"""Run the spark-shell jobs in warm spark-shell sessions (see
+`SparkSessionPool`), skipping the startup of spark-shell and of the YARN
+ApplicationMaster. The scripts of a user share the state of the REPL.
+In a session, the cookie of the job is in the system property
+`DATATSUNAMI_COOKIE`: the scripts that read it from the environment aren't
+run in a session.
+"""
+
+SPARK_SESSION_POOL_SIZE = 2
+"""Max. idle spark-shell sessions kept by each worker process"""
+
+SPARK_SESSION_IDLE_TIMEOUT = 10 * 60
+"""Seconds after which an idle spark-shell session is closed"""
+
+SPARK_SESSION_MAX_LIFETIME = 4 * 60 * 60
+"""Seconds after which a spark-shell session is closed (when idle)"""
+
+JOB_CANCEL_POLL_INTERVAL = 1.0
+"""Seconds between checks of the cancellation requests of a running job"""
+
+JOB_CANCEL_KILL_GRACE_SECONDS = 5
+"""Seconds between the SIGTERM and the SIGKILL sent to the remote
+processes of a cancelled job
+"""
+
+JOB_CANCEL_REQUEST_EXPIRE = 24 * 60 * 60
+"""Seconds a cancellation request is kept (the job may be waiting for
+a Celery worker)
+"""
+
+SCHEDULER_ENABLED = True
+"""Queue the jobs, limiting the jobs running concurrently (see below).
+If False, the jobs are sent directly to Celery
+"""
+
+SCHEDULER_CLUSTER_NAME = 'default'
+"""Name of the queue of the cluster (used in the Redis keys)"""
+
+SCHEDULER_MAX_RUNNING_JOBS = 4
+"""Max. jobs running concurrently in the cluster"""
+
+SCHEDULER_MAX_RUNNING_JOBS_PER_USER = 2
+"""Max. jobs of a user running concurrently"""
+
+SCHEDULER_RUNNING_TIMEOUT = 6 * 60 * 60
+"""Seconds after which a job is considered finished, even if its worker
+didn't report it (ie: the worker died)
+"""
+
+SCHEDULER_DEFAULT_JOB_DURATION = 120
+"""Seconds, to estimate the start of the queued jobs until some jobs
+have finished
+"""
+
+RESULT_CACHE_ENABLED = False
+"""Save the messages of the successful jobs, and replay them (without
+running the job) when the same script is submitted with the same action.
+The users can bypass the cache on each submission.
+"""
+
+RESULT_CACHE_TTL = 24 * 60 * 60
+"""Seconds the results are kept in the cache"""
+
+RESULT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+"""Max. bytes (compressed) of all the cached results. The oldest results
+are removed to make room for the new ones
+"""
+
+RESULT_CACHE_MAX_JOB_OUTPUT = 16 * 1024 * 1024
+"""Max. bytes of output of a job to cache its result"""
+
+METRICS_ENABLED = True
+"""Save the timings of the phases of the jobs and the counters of lines
+and messages, exported (Prometheus text format) in /metrics
+"""
+
+STATSD_ADDRESS = None
+"""(host, port) of statsd, to also send it the metrics of the jobs"""
+
+STATSD_PREFIX = 'smoke'
+"""Prefix of the names of the metrics sent to statsd"""
+
+MESSAGES_BATCH_SIZE = 100
+"""Max. number of messages published to Redis in a single batch"""
+
+MESSAGES_BATCH_MAX_DELAY = 0.25
+"""Max. seconds a message waits in the buffer before being published"""
+
+MESSAGES_WIRE_FORMAT = 'compact'
+"""Format of the messages sent to the browser:
+
+- 'compact': positional arrays with short codes, and the messages of a
+  batch (see MESSAGES_BATCH_SIZE) in a single websocket frame (see
+  `smoke.services.wire`).
+- 'json': a JSON object (with the full names of the keys) per message and
+  frame, for external clients of the websocket.
+"""
+
+OUTPUT_PIPELINE_ENABLED = True
+"""Read, parse and publish the output of the remote commands
+in different threads
+"""
+
+OUTPUT_READ_BLOCK_SIZE = 64 * 1024
+"""Max. bytes of output of the remote commands read at a time"""
+
+OUTPUT_PIPELINE_BLOCKS_QUEUE_SIZE = 160
+"""Max. blocks of output (of up to `OUTPUT_READ_BLOCK_SIZE` bytes) read
+but not yet parsed, per remote command (also with the 'eventloop'
+`JOB_ENGINE`). When full, the reading of the output stops until the
+parser catches up
+"""
+
+OUTPUT_PIPELINE_MESSAGES_QUEUE_SIZE = 10000
+"""Max. messages waiting to be published. When full, the parsing
+stops until the messages are published
+"""
+
+JOB_ENGINE = 'prefork'
+"""How the Celery workers run the jobs:
+
+- 'prefork': each job takes a worker process (see `--concurrency`)
+  until it ends.
+- 'eventloop': the task hands the job to the engine of the worker
+  process and returns. The output of all the jobs of the process is read
+  by a single thread (see `smoke.services.engine`), and parsed by the
+  thread of each job, so a process runs up to `JOB_ENGINE_MAX_JOBS` jobs. The jobs running in a
+  process are lost if the worker process is stopped. Each job uses ssh
+  channels: raise SSH_MAX_CHANNELS accordingly.
+"""
+
+JOB_ENGINE_MAX_JOBS = 50
+"""Max. jobs run at a time by each worker process with the 'eventloop'
+`JOB_ENGINE`. When reached, the task waits for a job to end
+"""
+
+JOB_LOG_MEMORY_LIMIT = 8 * 1024 * 1024
+"""Max. bytes of the log of a job kept in memory by the worker. The rest
+of the log is compressed to a spool file
+"""
+
+JOB_LOG_SPOOL_DIR = None
+"""Directory of the spool files of the logs (defaults to the temp dir)"""
+
+JOB_LOG_CHUNK_LINES = 1000
+"""Lines of each chunk of the saved logs (see `JobLogChunk`)"""
+
+JOB_LOG_LINES_PER_PAGE = 500
+"""Lines of the log shown in each page of the job details"""
+
+JOB_LOG_DOWNLOAD_MAX_AGE = 24 * 60 * 60
+"""Seconds the downloaded logs can be cached by browsers and proxies
+(the log of a saved job never changes)
+"""
+
+EXTRA_LINE_PARSERS = ()
+"""Dotted paths of additional parsers of the spark-shell output
+(see `smoke.services.parsers.register_parser()`)
+"""
+
+PROGRESS_UPDATES_PER_SECOND = 4
+"""Max. progress updates sent to the web per second for each stage
+(0 to send all the updates). The last update of each stage is always sent.
+"""
+
+TASK_STRAGGLER_FACTOR = 1.5
+"""A task is reported as straggler if it took more than this times the
+median duration of the tasks of its stage
+"""
+
+TASK_STRAGGLER_MIN_TASKS = 10
+"""Min. finished tasks of a stage to look for stragglers"""
+
+TASK_METRICS_SLOWEST_TASKS = 5
+"""Slowest tasks of each stage kept to report the stragglers"""
+
+OUTPUT_FILTER_POLICY = None
+"""Filter of the log of Spark, run on the server before the output is
+sent through ssh (see `smoke.services.outputfilter`): None (no filter),
+'drop' or 'sample'. The lines needed by the parsers are always kept.
+"""
+
+OUTPUT_FILTER_LEVELS = ('INFO', 'DEBUG')
+"""Levels of the lines of the log that are filtered"""
+
+OUTPUT_FILTER_SAMPLE_EVERY = 100
+"""With the 'sample' policy, one of each this lines is kept"""
+
+OUTPUT_FILTER_KEEP = ()
+"""Substrings of the lines of the log that are never filtered"""
+
+SHELL_MESSAGE_MAX_TABLE_ROWS = 100
+"""Max. rows of the tables reported by the scripts (messages from shell)
+sent to the web
+"""
 
 REMOTE_SPARK_SHELL_PATH = "$SPARK_PREFIX/bin/spark-shell"
 """Path (may use environment variables) of the `spark-shell`
@@ -189,6 +397,78 @@ script on the remote srever
 REMOTE_SPARK_SHELL_PATH_OPTS = ""
 """Options for the spark-shell command executed on the server"""
 
+
+#==============================================================================
+# SSH connections
+#==============================================================================
+
+SSH_MULTIPLEXING = True
+"""Reuse the ssh connections (OpenSSH `ControlMaster`) to execute
+the remote commands
+"""
+
+SSH_CONTROL_PATH_DIR = None
+"""Directory for the ssh control sockets (defaults to the temp directory)"""
+
+SSH_CONTROL_PERSIST = 600
+"""Seconds the idle master connection is kept open"""
+
+SSH_HEALTH_CHECK_INTERVAL = 30
+"""Seconds between health checks of the master connection"""
+
+SSH_MAX_CHANNELS = 8
+"""Max. concurrent channels (commands) per master connection. Must be
+lower than `MaxSessions` of the remote sshd (10 by default), minus
+`SPARK_SESSION_POOL_SIZE` with `SPARK_SESSION_POOL_ENABLED` (the channels of
+the idle sessions aren't counted)
+"""
+
+SSH_CHANNEL_WAIT_TIMEOUT = 300
+"""Seconds to wait for a free channel before failing"""
+
+SSH_GATEWAYS = None
+"""Gateways where spark-shell is launched, as a dict of name -> ssh base
+args (like `SSH_BASE_ARGS`). Each job is routed to the live gateway with
+the fewest running jobs and the lowest round-trip time, and fails over to
+another gateway if the script can't be sent (see
+`smoke.services.gateways`). If None, `SSH_BASE_ARGS` is used.
+"""
+
+SSH_GATEWAY_PROBE_INTERVAL = 30
+"""Seconds between probes (`echo pong` through ssh) of the gateways.
+If 0, the gateways aren't probed
+"""
+
+SSH_GATEWAY_PROBE_TIMEOUT = 10
+"""Seconds to wait for the reply of a gateway (connection included) before
+considering it dead
+"""
+
+
+#==============================================================================
+# Upload of scripts
+#==============================================================================
+
+SINGLE_ROUND_TRIP_UPLOAD = True
+"""Upload the script and launch spark-shell with a single ssh command,
+using the remote script cache. If False, `mktemp` and `cat` are
+executed before launching spark-shell.
+"""
+
+REMOTE_SCRIPT_CACHE_DIR = "$HOME/.smoke/script-cache"
+"""Directory (may use environment variables) on the remote server where
+the scripts are saved
+"""
+
+REMOTE_SCRIPT_CACHE_MAX_AGE_DAYS = 7
+"""Scripts not used in this number of days are removed from the cache"""
+
+REMOTE_SCRIPT_CACHE_GC_BATCH = 100
+"""Max. number of scripts removed from the cache each time"""
+
+REMOTE_SCRIPT_CACHE_INDEX_SIZE = 1000
+"""Max. number of cached scripts remembered by each worker process"""
+
 #==============================================================================
 # Import de `smoke_settings_local`
 #==============================================================================
@@ -204,5 +484,6 @@ except ImportError as e:
     print "# "
     raise Exception("Couldn't import module smoke_settings_local")
 
-assert SSH_BASE_ARGS is not None, \
-    "SSH_BASE_ARGS must be defined, check your 'smoke_settings_local.py' file"
+assert SSH_BASE_ARGS is not None or SSH_GATEWAYS, \
+    "SSH_BASE_ARGS (or SSH_GATEWAYS) must be defined, check your " \
+    "'smoke_settings_local.py' file"
@@ -2,14 +2,22 @@
 
 from __future__ import unicode_literals
 
+import datetime
 import logging
+import time
 import uuid
 
 from django.conf import settings
 from django.utils import timezone
 from smoke.models import Job
 from smoke.services import remote
+from smoke.services.cancel import CancelWatcher, is_cancel_requested
+from smoke.services.gateways import gateways_enabled, get_gateway_router
 from smoke.services.messages import MessageService
+from smoke.services.metrics import job_phase_timers, record_job_metrics
+from smoke.services.resultcache import get_result_cache, result_cache_key
+from smoke.services.sessions import reads_cookie_from_environment
+from smoke.services.taskmetrics import job_task_metrics
 
 
 logger = logging.getLogger(__name__)
@@ -20,11 +28,11 @@ SSH_BASE_ARGS = settings.SSH_BASE_ARGS
 class SparkService(object):
     """Service to launch and handle the execution of Spark Shell"""
 
-    def __init__(self, *args, **kwargs):
-        super(SparkService, self).__init__(*args, **kwargs)
+    def __init__(self, cookie=None, first_seq=0):
+        super(SparkService, self).__init__()
 
-        self.message_service = MessageService()
-        self.cookie = uuid.uuid4().hex
+        self.cookie = cookie or uuid.uuid4().hex
+        self.message_service = MessageService(self.cookie, first_seq)
 
     def _log_script(self, script):
         """Log the script using logger.info()"""
@@ -37,32 +45,190 @@ class SparkService(object):
         """Adds 'exit' at the end of the script"""
         return script + "\n/* EXIT */\nexit\n"
 
-    def launc_job(self, script, action):
-        """Launches a job in the remote server"""
+    def cancel(self):
+        """Cancels the job: kills the local processes (ssh) and the
+        remote processes of the job
+        """
+        self.message_service.log_and_publish("Cancelling the job")
+        remote_cookie, ssh_gateway_args = \
+            remote.job_processes.remote_of(self.cookie)
+        killed = remote.job_processes.cancel(self.cookie)
+        logger.info("Local processes killed: %s", killed)
+        try:
+            remote.KillRemoteProcesses(self.message_service, self.cookie,
+                                       remote_cookie,
+                                       ssh_gateway_args).kill()
+        except:
+            logger.exception("Couldn't kill the remote processes")
+
+    def _assign_gateway(self):
+        """Assigns a gateway to the job (if SSH_GATEWAYS)"""
+        if not gateways_enabled():
+            return
+        gateway = get_gateway_router().assign(self.cookie)
+        self.message_service.log_and_publish("Using gateway %s", gateway,
+                                             sshGateway=gateway)
+
+    def _with_failover(self, send, errors=(Exception,)):
+        """Calls `send()`, which sends the script to the server. If it
+        fails with one of `errors` (and SSH_GATEWAYS), it's called again
+        on the other gateways, until it succeeds.
+
+        :returns: the return value of `send()`
+        """
+        tried = []
+        while True:
+            try:
+                return send()
+            except remote.JobCancelledException:
+                raise
+            except errors:
+                if not gateways_enabled():
+                    raise
+                router = get_gateway_router()
+                failed = router.gateway_of(self.cookie)
+                tried.append(failed)
+                logger.exception("Couldn't send the script to gateway %s",
+                                 failed)
+                gateway = router.fail_over(self.cookie, tried)
+                if gateway is None:
+                    raise
+                self.message_service.log_and_publish(
+                    "Sending the script to gateway %s failed, failing over "
+                    "to gateway %s", failed, gateway, sshGateway=gateway)
+
+    def _send_script(self, script):
+        """Sends the script to the server (see `_with_failover()`)
+
+        :returns: path of the script on the server
+        """
+        return self._with_failover(lambda: remote.SendScript(
+            self.message_service, self.cookie).send_script(script))
+
+    def _upload_and_run_script(self, script):
+        """Sends and runs the script in a single ssh round trip. Fails over
+        to the other gateways only if ssh couldn't connect (see
+        `_with_failover()`): once spark-shell started, the job isn't run
+        again.
+
+        :returns: exit status of the job
+        """
+        return self._with_failover(
+            lambda: remote.UploadAndRunSparkShell(
+                self.message_service, self.cookie).run_script(script),
+            errors=remote.SshConnectionFailedException)
+
+    def _replay_cached_result(self, cached_result):
+        """Publishes the messages of a cached result
+
+        :returns: the exit status of the cached job
+        """
+        created = datetime.datetime.fromtimestamp(cached_result['created'])
+        self.message_service.log_and_publish(
+            "Replaying the result cached at %s (the job wasn't run)",
+            created.strftime("%Y-%m-%d %H:%M:%S"), resultCacheHit=True)
+        for message in cached_result['messages']:
+            self.message_service.publish_message(**message)
+        return cached_result['exit_status']
+
+    def launc_job(self, script, action, user=None, use_cache=True,
+                  submitted_at=None, queued_at=None, cached_result=None):
+        """Launches a job in the remote server
+
+        :param use_cache: to replay the cached result of the job (if
+            RESULT_CACHE_ENABLED), or to cache its result
+        :param cached_result: the cached result of the job, if the caller
+            already read it
+        :param submitted_at: when the job was submitted (timestamp)
+        :param queued_at: when the job was sent to Celery (timestamp)
+        """
+        timer = job_phase_timers.create(self.cookie)
+        job_task_metrics.create(self.cookie)
+        if queued_at is not None:
+            timer.add('queue_wait', timer.start - queued_at)
+            if submitted_at is not None:
+                timer.add('scheduler_wait', queued_at - submitted_at)
         job = Job(script=script, start=timezone.now())
+        if settings.OUTPUT_PIPELINE_ENABLED:
+            self.message_service.start_publisher_thread(
+                settings.OUTPUT_PIPELINE_MESSAGES_QUEUE_SIZE)
+        cancel_watcher = CancelWatcher(self.cookie, self.cancel,
+                                       settings.JOB_CANCEL_POLL_INTERVAL)
+        cancel_watcher.start()
+        exit_status = None
+        status = Job.STATUS_FAILED
+        run_start = None
         try:
             assert action in ("spark-shell", "cat", "echo")
+            if is_cancel_requested(self.cookie):
+                # Cancelled while waiting for a worker
+                remote.job_processes.cancel(self.cookie)
             self.message_service.publish_message(line="",
                                                  receivedByWorker=True)
 
-            if action == 'echo':
-                remote.Echo(self.message_service, self.cookie).remote_echo()
+            cache_key = None
+            if settings.RESULT_CACHE_ENABLED and use_cache:
+                cache_key = result_cache_key(script, action)
+                if cached_result is None:
+                    cached_result = get_result_cache().get(cache_key)
+                if cached_result is None:
+                    self.message_service.start_recording(
+                        settings.RESULT_CACHE_MAX_JOB_OUTPUT)
+
+            if cached_result is None:
+                self._assign_gateway()
+
+            run_start = time.time()
+            if cached_result is not None:
+                exit_status = self._replay_cached_result(cached_result)
+            elif action == 'echo':
+                exit_status = remote.Echo(self.message_service,
+                                          self.cookie).remote_echo()
+            elif action == 'spark-shell' and \
+                    settings.SPARK_SESSION_POOL_ENABLED and \
+                    not reads_cookie_from_environment(script):
+                self._log_script(script)
+                exit_status = remote.RunInSparkSession(
+                    self.message_service, self.cookie).run_script(
+                        script, user or "")
+            elif action == 'spark-shell' and \
+                    settings.SINGLE_ROUND_TRIP_UPLOAD:
+                script = self._fix_script(script)
+                self._log_script(script)
+                exit_status = self._upload_and_run_script(script)
             else:
                 script = self._fix_script(script)
                 self._log_script(script)
-                script_path = remote.SendScript(
-                    self.message_service, self.cookie).send_script(script)
+                script_path = self._send_script(script)
 
                 self.message_service.log_and_publish("Will launch action "
                                                      "%s job on remote",
                                                      action)
                 if action == 'spark-shell':
-                    remote.RunSparkShell(
+                    exit_status = remote.RunSparkShell(
                         self.message_service, self.cookie).run_spark_shell(
                             script_path)
                 elif action == 'cat':
-                    remote.Cat(
+                    exit_status = remote.Cat(
                         self.message_service, self.cookie).run_cat(script_path)
+            if exit_status == 0:
+                status = Job.STATUS_FINISHED
+            recorded = self.message_service.stop_recording()
+            if exit_status == 0 and cached_result is None and \
+                    recorded is not None:
+                try:
+                    get_result_cache().set(cache_key, recorded, exit_status)
+                except:
+                    logger.exception("Couldn't cache the result of the job")
+        except remote.JobCancelledException:
+            logger.info("Job %s was cancelled", self.cookie)
+            status = Job.STATUS_CANCELLED
+            try:
+                self.message_service.publish_message(
+                    line="The job was cancelled", jobCancelled=True)
+            except:
+                logger.warn("Cound't send 'jobCancelled' message "
+                            "to web tier")
         except:
             logger.exception("Exception detected")
             try:
@@ -72,9 +238,41 @@ class SparkService(object):
                 logger.warn("Cound't send 'jobFinishedWithError' message "
                             "to web tier")
 
-        job.log = self.message_service.get_log()
+        finally:
+            # Failed and cancelled jobs are timed too
+            if run_start is not None:
+                timer.add('run', time.time() - run_start)
+            cancel_watcher.stop()
+            remote.job_processes.forget(self.cookie)
+            task_metrics = job_task_metrics.pop(self.cookie)
+            job_phase_timers.pop(self.cookie)
+            if gateways_enabled():
+                try:
+                    get_gateway_router().finish(self.cookie)
+                except:
+                    logger.exception("Couldn't report the end of the job "
+                                     "to the gateway router")
+
         job.end = timezone.now()
-        job.save()
+        job.exit_status = exit_status
+        job.status = status
+        if task_metrics is not None and task_metrics.has_tasks():
+            job.set_task_metrics(task_metrics.to_dict())
+        try:
+            job.error_count = self.message_service.error_count
+            job.set_log_lines(self.message_service.iter_log_lines())
+            with timer.phase('save'):
+                job.save()
+
+            self.message_service.log_and_publish("Job saved: %s", job.id,
+                                                 savedJobId=job.id)
+        finally:
+            self.message_service.stop_publisher_thread()
+            self.message_service.close()
+
+            publish_stats = self.message_service.get_publish_stats()
+            logger.info("Messages published: %s", publish_stats)
 
-        self.message_service.log_and_publish("Job saved: %s", job.id,
-                                             savedJobId=job.id)
+            timer.count('messages_published', publish_stats['messages'])
+            record_job_metrics(action, status, timer.timings,
+                               timer.counters)
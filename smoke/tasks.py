@@ -6,8 +6,15 @@ Tasks to be run in the Celery workers.
 from __future__ import unicode_literals
 
 import logging
+import time
+import uuid
 
+from django.conf import settings
 from smoke import celery_app
+from smoke.services.cancel import request_cancel
+from smoke.services.engine import get_job_engine, is_eventloop_engine
+from smoke.services.resultcache import get_result_cache, result_cache_key
+from smoke.services.scheduler import get_scheduler
 from smoke.spark_job import SparkService, MessageService
 
 
@@ -15,21 +22,129 @@ logger = logging.getLogger(__name__)
 
 
 @celery_app.app.task(ignore_result=True)
-def spark_job(script, action):
-    """Launch a job. Sincrhronous version."""
-    SparkService().launc_job(script, action)
+def spark_job(script, action, cookie=None, first_seq=0, user=None,
+              use_cache=True, scheduled=True, submitted_at=None,
+              queued_at=None):
+    """Launch a job. Sincrhronous version.
 
+    With the 'eventloop' `JOB_ENGINE`, the job is run by the JobEngine of
+    the worker process, and the task returns without waiting for it.
+    """
+    args = (script, action, cookie, first_seq, user, use_cache, scheduled,
+            submitted_at, queued_at)
+    if is_eventloop_engine():
+        get_job_engine().submit(cookie, lambda: _run_spark_job(*args))
+    else:
+        _run_spark_job(*args)
 
-def spark_job_async(script, action):
-    """Launches a job asynchronously on Celery"""
+
+def _run_spark_job(script, action, cookie, first_seq, user, use_cache,
+                   scheduled, submitted_at, queued_at):
+    cached_result = None
+    if not scheduled and settings.RESULT_CACHE_ENABLED and use_cache:
+        # Sent without the scheduler because its result was cached: if
+        # the result expired since, the job must go through the scheduler
+        cached_result = get_result_cache().get(
+            result_cache_key(script, action))
+        if cached_result is None and settings.SCHEDULER_ENABLED:
+            logger.info("Result of job %s no longer cached, scheduling it",
+                        cookie)
+            _launch_jobs(get_scheduler().submit(cookie, user, _job_args(
+                script, action, user, first_seq, use_cache,
+                submitted_at or time.time())))
+            return
+
+    try:
+        SparkService(cookie=cookie, first_seq=first_seq).launc_job(
+            script, action, user, use_cache, submitted_at, queued_at,
+            cached_result=cached_result)
+    finally:
+        if settings.SCHEDULER_ENABLED and cookie and scheduled:
+            _launch_jobs(get_scheduler().finish(cookie))
+
+
+def _job_args(script, action, user, first_seq, use_cache, submitted_at):
+    """Returns the arguments of a job queued in the scheduler"""
+    return {'script': script, 'action': action, 'user': user,
+            'first_seq': first_seq, 'use_cache': use_cache,
+            'submitted_at': submitted_at}
+
+
+def _launch_jobs(jobs):
+    """Sends to Celery the jobs dispatched by the scheduler"""
+    for cookie, job_args in jobs:
+        logger.info("Launching queued job %s", cookie)
+        spark_job.delay(job_args['script'], job_args['action'], cookie,
+                        job_args['first_seq'], job_args.get('user'),
+                        job_args.get('use_cache', True),
+                        submitted_at=job_args.get('submitted_at'),
+                        queued_at=time.time())
+    publish_queue_positions()
+
+
+def publish_queue_positions():
+    """Publishes the position in the queue of each queued job, and the
+    estimated seconds until it starts
+    """
+    for cookie, position, wait in get_scheduler().get_queue():
+        message_service = MessageService(cookie, first_seq=None)
+        message_service.publish_message("", queuePosition=position + 1,
+                                        estimatedStartSeconds=wait)
+        message_service.flush()
+        message_service.close()
+
+
+def cancel_job(cookie):
+    """Cancels a job: removes it from the queue, or asks its worker
+    to stop it
+    """
+    logger.info("Cancelling job %s", cookie)
+    request_cancel(cookie)
+    if not settings.SCHEDULER_ENABLED:
+        return
+
+    was_queued, jobs = get_scheduler().cancel(cookie)
+    if was_queued:
+        message_service = MessageService(cookie, first_seq=None)
+        message_service.publish_message("The job was cancelled",
+                                        jobCancelled=True)
+        message_service.close()
+    _launch_jobs(jobs)
+
+
+def spark_job_async(script, action, user, bypass_cache=False):
+    """Launches a job asynchronously on Celery (through the scheduler,
+    if SCHEDULER_ENABLED).
+
+    The jobs with a cached result (see RESULT_CACHE_ENABLED) skip the
+    scheduler: they don't use the cluster.
+
+    :returns: the cookie of the job (identifies its messages)
+    """
     logger.info("Launching Celery asynchronous job - action: %s", action)
 
-    message_service = MessageService()
+    cookie = uuid.uuid4().hex
+    message_service = MessageService(cookie)
     message_service.publish_message("Scheduling async execution of script",
                                     jobSubmitted=True)
+    message_service.flush()
 
     # Log the script
     for line in script.splitlines():
         logger.info("# {0}".format(line.strip()))
 
-    return spark_job.delay(script, action)
+    use_cache = not bypass_cache
+    if settings.RESULT_CACHE_ENABLED and use_cache and \
+            get_result_cache().has(result_cache_key(script, action)):
+        logger.info("Result of job %s found in cache", cookie)
+        spark_job.delay(script, action, cookie, message_service.next_seq,
+                        user, use_cache, scheduled=False,
+                        queued_at=time.time())
+    elif settings.SCHEDULER_ENABLED:
+        job_args = _job_args(script, action, user, message_service.next_seq,
+                             use_cache, time.time())
+        _launch_jobs(get_scheduler().submit(cookie, user, job_args))
+    else:
+        spark_job.delay(script, action, cookie, message_service.next_seq,
+                        user, use_cache, queued_at=time.time())
+    return cookie
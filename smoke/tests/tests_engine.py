@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from django.test import TestCase
+from smoke.services.engine import JobEngine, OutputLoop
+
+
+class TestOutputLoop(TestCase):
+
+    def setUp(self):
+        self.loop = OutputLoop(block_size=8, queue_size=2)
+        self.loop.start()
+
+    def _read_in_thread(self, stream, received):
+        thread = threading.Thread(target=self.loop.read,
+                                  args=(stream, received.extend))
+        thread.start()
+        return thread
+
+    def test_many_streams(self):
+        pipes = [os.pipe() for _ in range(3)]
+        streams = [os.fdopen(read_fd, 'rb') for read_fd, _ in pipes]
+        received = [[] for _ in pipes]
+        threads = [self._read_in_thread(stream, lines)
+                   for stream, lines in zip(streams, received)]
+
+        # Interleaved output, lines longer than a block
+        for i in range(5):
+            for n, (_, write_fd) in enumerate(pipes):
+                os.write(write_fd, "stream {0} line {1}\n".format(
+                    n, i).encode('utf-8'))
+        for _, write_fd in pipes:
+            os.write(write_fd, b"last")
+            os.close(write_fd)
+
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        for n, lines in enumerate(received):
+            self.assertEqual(lines, ["stream {0} line {1}".format(n, i)
+                                     for i in range(5)] + ["last"])
+        self.assertEqual(self.loop.stream_count(), 0)
+        for stream in streams:
+            stream.close()
+
+    def test_callback_error(self):
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(read_fd, 'rb')
+        os.write(write_fd, b"line\n")
+
+        def on_batch(batch):
+            raise ValueError("parser error")
+
+        with self.assertRaises(ValueError):
+            self.loop.read(stream, on_batch)
+        os.close(write_fd)
+        stream.close()
+
+    def test_slow_stream(self):
+        slow_read_fd, slow_write_fd = os.pipe()
+        read_fd, write_fd = os.pipe()
+        slow_stream = os.fdopen(slow_read_fd, 'rb')
+        stream = os.fdopen(read_fd, 'rb')
+        release = threading.Event()
+        slow_received = []
+        received = []
+
+        def slow_on_batch(batch):
+            release.wait(5)
+            slow_received.extend(batch)
+
+        slow_thread = threading.Thread(target=self.loop.read,
+                                       args=(slow_stream, slow_on_batch))
+        slow_thread.start()
+        # The slow stream is paused: no more than 2 batches are pending
+        for i in range(10):
+            os.write(slow_write_fd, "slow {0}\n".format(i).encode('utf-8'))
+        os.close(slow_write_fd)
+
+        thread = self._read_in_thread(stream, received)
+        os.write(write_fd, b"line\n")
+        os.close(write_fd)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(received, ["line"])
+
+        release.set()
+        slow_thread.join(5)
+        self.assertFalse(slow_thread.is_alive())
+        self.assertEqual(slow_received,
+                         ["slow {0}".format(i) for i in range(10)])
+        slow_stream.close()
+        stream.close()
+
+
+class TestJobEngine(TestCase):
+
+    def test_max_jobs(self):
+        engine = JobEngine(max_jobs=2, block_size=8, queue_size=2)
+        release = threading.Event()
+        started = []
+
+        def job(n):
+            started.append(n)
+            release.wait(5)
+
+        engine.submit("a", lambda: job(1))
+        engine.submit("b", lambda: job(2))
+        self.assertEqual(engine.running_jobs(), 2)
+
+        # The third job waits for a free slot
+        submitter = threading.Thread(
+            target=engine.submit, args=("c", lambda: job(3)))
+        submitter.start()
+        submitter.join(0.2)
+        self.assertTrue(submitter.is_alive())
+
+        release.set()
+        submitter.join(5)
+        engine.join(5)
+        self.assertEqual(sorted(started), [1, 2, 3])
+        self.assertEqual(engine.running_jobs(), 0)
+
+    def test_job_error(self):
+        engine = JobEngine(max_jobs=1, block_size=8, queue_size=2)
+
+        def job():
+            raise Exception("job failed")
+
+        engine.submit("a", job)
+        engine.join(5)
+        # The slot is released
+        done = []
+        engine.submit("b", lambda: done.append(True))
+        engine.join(5)
+        self.assertEqual(done, [True])
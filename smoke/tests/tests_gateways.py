@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke.services.gateways import GatewayRouter, GatewayState, \
+    probe_command, probe_gateway
+from smoke.tests.utils import RedisKeysMock
+
+
+class RedisNxKeysMock(RedisKeysMock):
+    """RedisKeysMock with the `set()` options used by the router"""
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+
+FAKE_SSH = """#!/bin/sh
+# Skips the options and the host, and runs the rest as a shell command
+while [ "$1" = "-o" ]; do shift 2; done
+shift
+exec sh -c "$*"
+"""
+
+
+GATEWAYS = {'edge1': ["ssh", "edge1"], 'edge2': ["ssh", "edge2"],
+            'edge3': ["ssh", "edge3"]}
+
+
+class TestGatewayState(TestCase):
+
+    def test_choose_least_loaded_then_fastest(self):
+        state = GatewayState()
+        state.record_probe('edge1', True, 0.3, now=0)
+        state.record_probe('edge2', True, 0.1, now=0)
+        state.record_probe('edge3', False, None, now=0)
+
+        self.assertEqual(state.choose(GATEWAYS), 'edge2')
+
+        state.running['a'] = {'gateway': 'edge2', 'start': 0}
+        self.assertEqual(state.choose(GATEWAYS), 'edge1')
+        self.assertEqual(state.choose(GATEWAYS, exclude=['edge1']), 'edge2')
+
+    def test_unknown_rtt_goes_last(self):
+        state = GatewayState()
+        state.record_probe('edge3', True, 0.5, now=0)
+
+        self.assertEqual(state.choose(GATEWAYS), 'edge3')
+
+    def test_all_dead(self):
+        state = GatewayState()
+        for gateway in GATEWAYS:
+            state.mark_failed(gateway, now=0)
+
+        # The probes may be stale: a gateway is used anyway
+        self.assertEqual(state.choose(GATEWAYS, exclude=['edge1']), 'edge2')
+        self.assertIsNone(state.choose(GATEWAYS, exclude=GATEWAYS))
+
+
+class TestGatewayRouter(TestCase):
+
+    def setUp(self):
+        self.router = GatewayRouter(RedisNxKeysMock(), GATEWAYS,
+                                    running_timeout=60)
+
+    def test_assign_and_finish(self):
+        self.router.record_probe('edge3', False, None)
+
+        self.assertEqual(self.router.assign("a"), 'edge1')
+        self.assertEqual(self.router.assign("b"), 'edge2')
+        self.assertEqual(self.router.assign("c"), 'edge1')
+        self.assertEqual(self.router.ssh_base_args("b"), ["ssh", "edge2"])
+
+        self.router.finish("a")
+        self.router.finish("c")
+        self.assertEqual(self.router.get_state().running_count('edge1'), 0)
+        self.assertIsNone(self.router.gateway_of("a"))
+
+    def test_fail_over(self):
+        self.assertEqual(self.router.assign("a"), 'edge1')
+
+        self.assertEqual(self.router.fail_over("a", ['edge1']), 'edge2')
+        self.assertEqual(self.router.ssh_base_args("a"), ["ssh", "edge2"])
+        state = self.router.get_state()
+        self.assertFalse(state.is_alive('edge1'))
+        self.assertEqual(state.running_count('edge2'), 1)
+
+        self.assertEqual(self.router.fail_over("a", ['edge1', 'edge2']),
+                         'edge3')
+        self.assertIsNone(self.router.fail_over("a", list(GATEWAYS)))
+        self.assertEqual(self.router.get_state().running, {})
+
+    def test_default_gateway(self):
+        with override_settings(SSH_BASE_ARGS=["ssh", "default"]):
+            self.assertEqual(self.router.ssh_base_args("x"),
+                             ["ssh", "default"])
+
+    def test_claim_probe(self):
+        self.assertTrue(self.router.claim_probe(30))
+        self.assertFalse(self.router.claim_probe(30))
+
+
+class TestProbeGateway(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ssh = os.path.join(self.tmp_dir, "ssh")
+        with open(self.ssh, 'w') as f:
+            f.write(FAKE_SSH)
+        os.chmod(self.ssh, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_command(self):
+        self.assertEqual(
+            probe_command(["ssh", "-p", "22", "edge1"], 5),
+            ["ssh", "-o", "ControlMaster=no", "-o", "ControlPath=none",
+             "-o", "ConnectTimeout=5", "-p", "22", "edge1", "echo", "pong"])
+
+    def test_alive(self):
+        alive, rtt = probe_gateway([self.ssh, "edge1"], 5)
+
+        self.assertTrue(alive)
+        self.assertTrue(0 <= rtt < 5)
+
+    def test_dead(self):
+        self.assertEqual(probe_gateway([self.ssh, "edge1", "exit 255;"], 5),
+                         (False, None))
+        self.assertEqual(probe_gateway(["/nonexistent/ssh", "edge1"], 5),
+                         (False, None))
+
+    def test_timeout(self):
+        start = time.time()
+
+        self.assertEqual(probe_gateway([self.ssh, "edge1", "sleep 30;"], 0.5),
+                         (False, None))
+        self.assertTrue(time.time() - start < 5)
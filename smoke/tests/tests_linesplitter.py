@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+
+from django.test import TestCase
+from smoke.services.linesplitter import ConsoleRedraw, LineSplitter, \
+    read_blocks, split_lines
+
+
+def feed_all(blocks):
+    """Returns the items of the blocks, as (is_redraw, text)"""
+    splitter = LineSplitter()
+    items = []
+    for block in blocks:
+        items.extend(splitter.feed(block))
+    items.extend(splitter.close())
+    return [(isinstance(item, ConsoleRedraw), item) for item in items]
+
+
+class TestLineSplitter(TestCase):
+
+    def test_lines(self):
+        self.assertEqual(feed_all([b"line 1\nli", b"ne 2  \n\n   \n",
+                                   b"  line 3\nlast"]),
+                         [(False, "line 1"), (False, "line 2"),
+                          (False, "  line 3"), (False, "last")])
+
+    def test_decoding(self):
+        self.assertEqual(feed_all(["línea\n".encode('utf-8'), b"\xff\n"]),
+                         [(False, "línea"), (False, "�")])
+
+    def test_crlf(self):
+        self.assertEqual(feed_all([b"line 1\r", b"\nline 2\r\n"]),
+                         [(False, "line 1"), (False, "line 2")])
+
+    def test_redraws(self):
+        splitter = LineSplitter()
+
+        # The redraws are returned before the end of the line
+        self.assertEqual(splitter.feed(b"\r[Stage 1:>   (0 + 2) / 4]"), [])
+        items = splitter.feed(b"\r[Stage 1:=>  (1 + 2) / 4]\r")
+        self.assertEqual(items, ["[Stage 1:>   (0 + 2) / 4]"])
+        self.assertTrue(isinstance(items[0], ConsoleRedraw))
+
+        items = splitter.feed(b"                    \rres0: Long = 4\n")
+        self.assertEqual([(isinstance(item, ConsoleRedraw), item)
+                          for item in items],
+                         [(True, "[Stage 1:=>  (1 + 2) / 4]"),
+                          (False, "res0: Long = 4")])
+        self.assertEqual(splitter.close(), [])
+
+
+class TestReadBlocks(TestCase):
+
+    def test_pipe(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b"line 1\nline 2\n")
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as stream:
+            self.assertEqual(list(split_lines(read_blocks(stream, 4))),
+                             [["line 1"], ["line 2"]])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+
+from django.test import TestCase
+from smoke.services.logsink import JobLogSink
+
+
+class TestJobLogSink(TestCase):
+
+    def test_in_memory(self):
+        sink = JobLogSink(memory_limit=1024)
+        sink.append("line 1")
+        sink.append("línea 2")
+
+        self.assertEqual(list(sink.iter_lines()), ["line 1", "línea 2"])
+        self.assertTrue(sink._spool is None)
+
+    def test_concurrent_appends(self):
+        sink = JobLogSink(memory_limit=200)
+
+        def append(name):
+            for i in range(2000):
+                sink.append("{0} {1}".format(name, i))
+
+        threads = [threading.Thread(target=append, args=(name,))
+                   for name in ("job", "watcher", "loop")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = ["{0} {1}".format(name, i)
+                    for name in ("job", "watcher", "loop")
+                    for i in range(2000)]
+        self.assertEqual(sorted(sink.iter_lines()), sorted(expected))
+        self.assertEqual(sink.line_count, 6000)
+        sink.close()
+
+    def test_spill_to_disk(self):
+        sink = JobLogSink(memory_limit=100)
+        lines = ["This is the line number {0}".format(i) for i in range(100)]
+        for line in lines:
+            sink.append(line)
+
+        self.assertTrue(sink._spool is not None)
+        self.assertTrue(sink._lines_size < 100)
+        self.assertEqual(list(sink.iter_lines()), lines)
+        self.assertEqual(sink.line_count, 100)
+
+        # can keep appending after reading
+        sink.append("last line")
+        self.assertEqual(list(sink.iter_lines()), lines + ["last line"])
+
+        sink.close()
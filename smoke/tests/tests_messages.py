@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke.services import wire
+from smoke.services.messages import BufferedRedisPublisher, MessageService
+from ws4redis.redis_store import RedisMessage
+
+
+class RedisConnectionMock(object):
+    """Mock of the Redis connection, records the executed pipelines"""
+
+    def __init__(self):
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        return RedisPipelineMock(self)
+
+
+class RedisPipelineMock(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+
+    def publish(self, channel, message):
+        self.commands.append(('publish', channel, message))
+
+    def setex(self, channel, expire, message):
+        self.commands.append(('setex', channel, message))
+
+    def rpush(self, key, message):
+        self.commands.append(('rpush', key, message))
+
+    def ltrim(self, key, start, end):
+        self.commands.append(('ltrim', key, start, end))
+
+    def expire(self, key, seconds):
+        self.commands.append(('expire', key, seconds))
+
+    def execute(self):
+        self.connection.executed.append(self.commands)
+
+
+class TestBufferedRedisPublisher(TestCase):
+
+    def _publisher(self, max_batch_size=3, max_delay=60):
+        publisher = BufferedRedisPublisher(max_batch_size=max_batch_size,
+                                           max_delay=max_delay,
+                                           facility='test', broadcast=True)
+        publisher._connection = RedisConnectionMock()
+        return publisher
+
+    def test_flush_by_size_keeps_order(self):
+        publisher = self._publisher(max_batch_size=3)
+
+        for i in range(7):
+            publisher.publish_message(RedisMessage("msg-{0}".format(i)))
+
+        executed = publisher._connection.executed
+        self.assertEqual(len(executed), 2)
+
+        publisher.flush()
+        published = [command[2]
+                     for pipeline in executed
+                     for command in pipeline]
+        self.assertEqual(published, ["msg-{0}".format(i) for i in range(7)])
+
+        stats = publisher.get_stats()
+        self.assertEqual(stats['messages'], 7)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['max_batch_size'], 3)
+
+    def test_flush_requested(self):
+        publisher = self._publisher()
+
+        publisher.publish_message(RedisMessage("msg-0"))
+        self.assertEqual(publisher._connection.executed, [])
+
+        publisher.publish_message(RedisMessage("msg-1"), flush=True)
+        self.assertEqual(len(publisher._connection.executed), 1)
+
+    def test_flush_by_time(self):
+        publisher = self._publisher(max_delay=0.05)
+
+        publisher.publish_message(RedisMessage("msg-0"))
+        timer = publisher._timer
+        self.assertEqual(publisher._connection.executed, [])
+        timer.join()
+
+        self.assertEqual(len(publisher._connection.executed), 1)
+
+    def test_pack_frames(self):
+        publisher = self._publisher()
+        publisher.pack_frames = True
+        publisher.backlog_key = 'backlog'
+        publisher.backlog_size = 10
+
+        publisher.publish_message(RedisMessage('[0,"a",0]'))
+        publisher.publish_message(RedisMessage('[1,"b",1]'), flush=True)
+
+        commands = publisher._connection.executed[0]
+        self.assertEqual([command[2] for command in commands
+                          if command[0] == 'publish'],
+                         ['[1,[0,"a",0],[1,"b",1]]'])
+        self.assertEqual([command[2] for command in commands
+                          if command[0] == 'rpush'],
+                         ['[0,"a",0]', '[1,"b",1]'])
+        self.assertEqual(publisher.get_stats()['messages'], 2)
+
+
+class TestMessageService(TestCase):
+
+    @override_settings(MESSAGES_WIRE_FORMAT='json')
+    def test_messages_of_job(self):
+        message_service = MessageService("c0ffee", first_seq=1)
+        connection = RedisConnectionMock()
+        message_service._redis_publisher._connection = connection
+
+        message_service.publish_message("line 1")
+        message_service.publish_message("", jobFinishedOk=True)
+
+        self.assertEqual(len(connection.executed), 1)
+        commands = connection.executed[0]
+        published = [command for command in commands
+                     if command[0] == 'publish']
+        self.assertEqual([json.loads(command[2])['seq']
+                          for command in published], [1, 2])
+        self.assertTrue(published[0][1].endswith("-c0ffee"))
+
+        backlog = [command for command in commands if command[0] == 'rpush']
+        self.assertEqual([command[2] for command in backlog],
+                         [command[2] for command in published])
+        self.assertEqual(commands[-2][0], 'ltrim')
+        self.assertEqual(commands[-1][0], 'expire')
+
+    @override_settings(MESSAGES_WIRE_FORMAT='compact')
+    def test_messages_of_job_compact(self):
+        message_service = MessageService("c0ffee", first_seq=1)
+        connection = RedisConnectionMock()
+        message_service._redis_publisher._connection = connection
+
+        message_service.publish_message("line 1", lineIsFromRemoteOutput=True)
+        message_service.publish_message("", jobFinishedOk=True)
+
+        commands = connection.executed[0]
+        published = [command for command in commands
+                     if command[0] == 'publish']
+        self.assertEqual(len(published), 1)
+        self.assertEqual(wire.decode_frame(published[0][2]), [
+            {'line': "line 1", 'seq': 1, 'lineIsFromRemoteOutput': True},
+            {'line': "", 'seq': 2, 'jobFinishedOk': True},
+        ])
+
+        backlog = [command[2] for command in commands
+                   if command[0] == 'rpush']
+        self.assertEqual([wire.message_seq(data) for data in backlog], [1, 2])
+
+    def test_recording(self):
+        message_service = MessageService("c0ffee")
+        message_service._redis_publisher._connection = RedisConnectionMock()
+
+        message_service.publish_message("before")
+        message_service.start_recording(max_size=100)
+        message_service.publish_message("line 1", errorLine=True)
+        message_service.publish_message("", jobFinishedOk=True)
+
+        self.assertEqual(message_service.stop_recording(), [
+            {'line': "line 1", 'errorLine': True},
+            {'line': "", 'jobFinishedOk': True},
+        ])
+
+        message_service.start_recording(max_size=10)
+        message_service.publish_message("a line longer than 10 bytes")
+        self.assertIsNone(message_service.stop_recording())
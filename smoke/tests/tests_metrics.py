@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import socket
+
+from django.test import TestCase
+from smoke.services.metrics import PHASE_BUCKETS, PHASE_HISTOGRAM, \
+    JobPhaseTimers, PhaseTimer, RedisMetrics, StatsdEmitter
+
+
+class RedisHashMock(object):
+    """Mock of the Redis connection, with the hash commands used by
+    RedisMetrics
+    """
+
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+    def hincrby(self, key, field, value):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + value
+
+    hincrbyfloat = hincrby
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPhaseTimer(TestCase):
+
+    def test_phases_and_marks(self):
+        clock = FakeClock()
+        timer = PhaseTimer(clock)
+
+        with timer.phase('mktemp'):
+            clock.now += 2
+        timer.add('ssh_connect', 0.5)
+        timer.add('ssh_connect', 0.25)
+        timer.mark('first_output')
+        clock.now += 1
+        timer.mark('first_output')
+        timer.count('lines_parsed', 10)
+        timer.count('lines_parsed', 5)
+
+        self.assertEqual(timer.timings, {'mktemp': 2.0, 'ssh_connect': 0.75,
+                                         'first_output': 2.0})
+        self.assertEqual(timer.counters, {'lines_parsed': 15})
+
+
+class TestJobPhaseTimers(TestCase):
+
+    def test_get(self):
+        timers = JobPhaseTimers()
+        timer = timers.create("c0ffee")
+
+        self.assertIs(timers.get("c0ffee"), timer)
+        self.assertIs(timers.pop("c0ffee"), timer)
+
+        # Like the commands run after the end of a cancelled job
+        with timers.get("c0ffee").phase('ssh_connect'):
+            pass
+        timers.get("c0ffee").mark('first_output')
+        self.assertIsNone(timers.pop("c0ffee"))
+
+
+class TestRedisMetrics(TestCase):
+
+    def test_render(self):
+        metrics = RedisMetrics(RedisHashMock())
+        metrics.record_job("spark-shell", "finished", {'run': 0.3},
+                           {'lines_parsed': 7})
+        metrics.record_job("spark-shell", "failed", {'run': 20},
+                           {'lines_parsed': 3})
+
+        lines = metrics.render().splitlines()
+
+        self.assertIn("# TYPE smoke_job_phase_seconds histogram", lines)
+        self.assertIn('smoke_job_phase_seconds_bucket{action="spark-shell",'
+                      'le="0.25",phase="run"} 0', lines)
+        self.assertIn('smoke_job_phase_seconds_bucket{action="spark-shell",'
+                      'le="0.5",phase="run"} 1', lines)
+        self.assertIn('smoke_job_phase_seconds_bucket{action="spark-shell",'
+                      'le="+Inf",phase="run"} 2', lines)
+        self.assertIn('smoke_job_phase_seconds_count{action="spark-shell",'
+                      'phase="run"} 2', lines)
+        self.assertIn("# TYPE smoke_lines_parsed_total counter", lines)
+        self.assertIn('smoke_lines_parsed_total{action="spark-shell"} 10',
+                      lines)
+        self.assertIn('smoke_jobs_total{action="spark-shell",'
+                      'status="failed"} 1', lines)
+        self.assertEqual(len([line for line in lines
+                              if line.startswith("# TYPE")]), 3)
+
+    def test_histogram_order(self):
+        metrics = RedisMetrics(RedisHashMock())
+        metrics.record_job("spark-shell", "finished",
+                           {'run': 0.3, 'mktemp': 0.1}, {})
+
+        names = [line.split(" ")[0] for line in metrics.render().splitlines()
+                 if line.startswith(PHASE_HISTOGRAM)]
+
+        expected = []
+        for phase in ("mktemp", "run"):
+            labels = 'action="spark-shell",phase="{0}"'.format(phase)
+            expected += ['{0}_bucket{{action="spark-shell",le="{1}",'
+                         'phase="{2}"}}'.format(PHASE_HISTOGRAM, bound, phase)
+                         for bound in PHASE_BUCKETS + ("+Inf",)]
+            expected += ["{0}_sum{{{1}}}".format(PHASE_HISTOGRAM, labels),
+                         "{0}_count{{{1}}}".format(PHASE_HISTOGRAM, labels)]
+        self.assertEqual(names, expected)
+
+
+class TestStatsdEmitter(TestCase):
+
+    def test_record_job(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        try:
+            emitter = StatsdEmitter(server.getsockname(), "smoke")
+            emitter.record_job("spark-shell", "finished", {'run': 1.5},
+                               {'lines_parsed': 7})
+
+            packets = server.recv(65536).decode('utf-8').splitlines()
+        finally:
+            server.close()
+
+        self.assertEqual(packets, ["smoke.jobs.spark_shell.finished:1|c",
+                                   "smoke.phase.spark_shell.run:1500|ms",
+                                   "smoke.spark_shell.lines_parsed:7|c"])
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+import zlib
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from smoke.models import Job
+
+
+@override_settings(JOB_LOG_CHUNK_LINES=10, JOB_LOG_LINES_PER_PAGE=15)
+class TestJobLog(TestCase):
+
+    def _create_job(self, line_count):
+        self.lines = ["Line {0} - ñ".format(i) for i in range(line_count)]
+        job = Job(script="// title\nprintln(1)", start=timezone.now(),
+                  end=timezone.now())
+        job.set_log_lines(iter(self.lines))
+        job.save()
+        return Job.objects.get(id=job.id)
+
+    def test_chunks(self):
+        job = self._create_job(25)
+
+        self.assertEqual(job.log_chunks.count(), 3)
+        self.assertEqual(job.get_log_line_count(), 25)
+        self.assertEqual(list(job.iter_log_lines()), self.lines)
+        self.assertEqual(job.get_log_lines(0, 25), self.lines)
+        self.assertEqual(job.get_log_lines(8, 12), self.lines[8:12])
+        self.assertEqual(job.get_log_lines(20, 40), self.lines[20:])
+
+    def test_deferred_log(self):
+        job = self._create_job(25)
+        legacy_job = Job.objects.create(
+            script="// legacy", log="line 1\nline 2", start=timezone.now(),
+            end=timezone.now())
+
+        job = Job.objects.defer('log').get(id=job.id)
+        # The chunks are read, `log` isn't loaded
+        with self.assertNumQueries(2):
+            self.assertEqual(job.get_log_lines(0, 2), self.lines[0:2])
+        self.assertNotIn('log', job.__dict__)
+
+        legacy_job = Job.objects.defer('log').get(id=legacy_job.id)
+        self.assertEqual(legacy_job.get_log_lines(1, 2), ["line 2"])
+        self.assertEqual(legacy_job.get_log_size(), 13)
+
+    def test_empty_log(self):
+        job = self._create_job(0)
+
+        self.assertEqual(job.get_log_line_count(), 0)
+        self.assertEqual(job.get_log_lines(0, 10), [])
+
+    def test_detail_view_pages(self):
+        job = self._create_job(25)
+        url = reverse('job_details', args=[job.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.context['log_text'],
+                         "\n".join(self.lines[0:15]))
+        self.assertEqual(response.context['log_next_page'], 16)
+
+        response = self.client.get(url, {'from_line': 16})
+        self.assertEqual(response.context['log_text'],
+                         "\n".join(self.lines[15:25]))
+        self.assertEqual(response.context['log_next_page'], None)
+        self.assertEqual(response.context['log_previous_page'], 1)
+
+
+class TestJobHistory(TestCase):
+
+    def _create_jobs(self, count):
+        start = timezone.now()
+        for i in range(count):
+            job = Job(script="// job {0}".format(i),
+                      start=start + datetime.timedelta(seconds=i // 2),
+                      end=start + datetime.timedelta(seconds=i + 3),
+                      exit_status=0)
+            job.set_log_lines(iter(["a", "b"]))
+            job.save()
+
+    def test_summary_fields(self):
+        self._create_jobs(1)
+        job = Job.objects.get()
+
+        self.assertEqual(job.duration, 3.0)
+        self.assertEqual(job.exit_status, 0)
+        self.assertEqual(job.line_count, 2)
+        self.assertEqual(job.error_count, 0)
+
+    def test_keyset_pagination(self):
+        # Jobs have the same start time by pairs, to test the tie-break
+        self._create_jobs(7)
+        ids = list(Job.objects.order_by("-id").values_list('id', flat=True))
+
+        first_page = list(
+            Job.objects.latests_in_reverse_chronological(count=3))
+        second_page = list(Job.objects.latests_in_reverse_chronological(
+            before=first_page[-1], count=3))
+        third_page = list(Job.objects.latests_in_reverse_chronological(
+            before=second_page[-1], count=3))
+
+        self.assertEqual([job.id for job in
+                          first_page + second_page + third_page], ids)
+
+    def test_list_view_links_older_jobs(self):
+        self._create_jobs(41)
+
+        response = self.client.get(reverse('job_list'))
+        older_jobs_before = response.context['older_jobs_before']
+        self.assertEqual(len(response.context['object_list']), 40)
+
+        response = self.client.get(reverse('job_list'),
+                                   {'before': older_jobs_before})
+        self.assertEqual(len(response.context['object_list']), 1)
+        self.assertEqual(response.context['older_jobs_before'], None)
+
+
+@override_settings(JOB_LOG_CHUNK_LINES=10)
+class TestJobLogDownload(TestCase):
+
+    def setUp(self):
+        self.lines = ["Line {0} - ñ".format(i) for i in range(25)]
+        self.data = "\n".join(self.lines).encode('utf-8')
+        job = Job(script="// title", start=timezone.now(), end=timezone.now())
+        job.set_log_lines(iter(self.lines))
+        job.save()
+        self.url = reverse('download_job_log', args=[job.id])
+
+    def _content(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_download(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._content(response), self.data)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(self._content(response),
+                                         16 + zlib.MAX_WBITS), self.data)
+
+    def test_ranges(self):
+        # Crosses the boundary between the first and the second chunk
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self._content(response), self.data[100:200])
+        self.assertEqual(response['Content-Range'],
+                         "bytes 100-199/{0}".format(len(self.data)))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-30')
+        self.assertEqual(self._content(response), self.data[-30:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=150-')
+        self.assertEqual(self._content(response), self.data[150:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=9999-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9',
+                                   HTTP_IF_RANGE='"another-etag"')
+        self.assertEqual(response.status_code, 200)
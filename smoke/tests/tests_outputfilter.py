@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import subprocess
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke.benchmarks.parsers import get_sample_sublines
+from smoke.services.outputfilter import filter_command, get_keep_substrings
+
+
+class TestFilterCommand(TestCase):
+
+    def _run(self, policy, sample_every=1):
+        """Runs the filtered command on the server (here) with the sample
+        lines as output
+
+        :returns: (lines of output, exit status)
+        """
+        sublines = get_sample_sublines()
+        with tempfile.NamedTemporaryFile() as output:
+            output.write("\n".join(sublines).encode('utf-8') + b"\n")
+            output.flush()
+            with override_settings(OUTPUT_FILTER_POLICY=policy,
+                                   OUTPUT_FILTER_SAMPLE_EVERY=sample_every):
+                command = filter_command(
+                    'sh -c "cat {0} ; exit 3"'.format(output.name))
+            self.assertNotIn("'", command)
+            process = subprocess.Popen(["sh", "-c", command],
+                                       stdout=subprocess.PIPE)
+            stdout = process.communicate()[0]
+        return stdout.decode('utf-8').splitlines(), process.returncode
+
+    def test_no_policy(self):
+        self.assertIsNone(filter_command("spark-shell"))
+
+    def test_drop(self):
+        sublines = get_sample_sublines()
+        lines, exit_status = self._run('drop')
+
+        self.assertEqual(exit_status, 3)
+        self.assertTrue(len(lines) < len(sublines) / 2)
+        self.assertEqual(lines[-1], "[smoke] {0} lines of the log filtered "
+                         "out".format(len(sublines) + 1 - len(lines)))
+
+        # The lines needed by the parsers, the output of the script and
+        # the warnings are kept
+        keep = get_keep_substrings()
+        for subline in sublines:
+            if any(substring in subline for substring in keep) or \
+                    " INFO " not in subline:
+                self.assertIn(subline, lines)
+        self.assertFalse([line for line in lines
+                          if "INFO storage.BlockManager" in line])
+
+    def test_sample(self):
+        all_lines, _ = self._run('sample', sample_every=1)
+        sampled_lines, exit_status = self._run('sample', sample_every=10)
+
+        self.assertEqual(exit_status, 3)
+        self.assertEqual(all_lines, get_sample_sublines())
+        self.assertTrue(len(sampled_lines) < len(all_lines))
+        self.assertIn("Finished TID", "\n".join(sampled_lines))
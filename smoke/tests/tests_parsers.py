@@ -6,7 +6,10 @@ import uuid
 
 from django.test import TestCase
 from smoke.services.parsers import ApplicationMasterLaunchedParser, \
-    TaskFinishedWithProgressParser, MessageFromShellParser
+    TaskFinishedWithProgressParser, MessageFromShellParser, ProgressThrottle, \
+    ParserDispatcher, PARSERS, ConsoleProgressParser
+from smoke.services.shellmessages import encode_json
+from smoke.services.taskmetrics import job_task_metrics
 from smoke.tests.utils import MessageServiceMock
 
 
@@ -57,6 +60,7 @@ class TestTaskFinishedWithProgressParser(TestCase):
     def test(self):
         cookie = uuid.uuid4().hex
         msg_service = MessageServiceMock()
+        job_task_metrics.create(cookie)
         parser = TaskFinishedWithProgressParser(msg_service, cookie)
 
         LINE = ("14/08/23 12:48:53 INFO "
@@ -77,6 +81,11 @@ class TestTaskFinishedWithProgressParser(TestCase):
 
         self.assertIn(True, progressUpdate)
 
+        task_metrics = job_task_metrics.pop(cookie).to_dict()
+        self.assertEqual(task_metrics['hosts'][0]['host'],
+                         "hadoop-hitachi80gb.hadoop.dev.docker.data-tsunami.com")
+        self.assertEqual(task_metrics['stages'][0]['max_ms'], 7443)
+
 
 class TestMessageFromShellParser(TestCase):
 
@@ -163,3 +172,128 @@ class TestMessageFromShellParser(TestCase):
                                   if isinstance(item, dict)]
 
         self.assertIn(output_filename, outputFilenameReported)
+
+    def test_json_message_with_typed_payloads(self):
+        cookie = uuid.uuid4().hex
+        msg_service = MessageServiceMock()
+        parser = MessageFromShellParser(msg_service, cookie)
+
+        LINE = encode_json(cookie, metrics={'rows': 1500},
+                           table={'columns': ["a"], 'rows': [["x"]]},
+                           progress={'done': 3, 'total': 10})
+
+        # -----
+
+        self.assertTrue(parser.parse(LINE))
+
+        published = {}
+        for item in msg_service.messages:
+            published.update(item[-1])
+        self.assertEqual(published['shellMetrics'], {'rows': 1500})
+        self.assertEqual(published['shellTable'], {
+            'columns': ["a"], 'rows': [["x"]], 'truncated': False})
+        self.assertEqual((published['progressStage'],
+                          published['progressDone'],
+                          published['progressTotal']), ("script", 3, 10))
+
+    def test_wrong_cookie_json(self):
+        cookie = uuid.uuid4().hex
+        msg_service = MessageServiceMock()
+        parser = MessageFromShellParser(msg_service, cookie)
+
+        # -----
+
+        self.assertFalse(parser.parse(encode_json(uuid.uuid4().hex,
+                                                  scriptFinished=True)))
+
+
+class TestConsoleProgressParser(TestCase):
+
+    def test(self):
+        msg_service = MessageServiceMock()
+        parser = ConsoleProgressParser(msg_service, uuid.uuid4().hex)
+
+        # -----
+
+        for invalid_line in GENERAL_INVALID_LINES:
+            self.assertFalse(parser.parse(invalid_line))
+
+        self.assertTrue(parser.parse(
+            "[Stage 3:====>          (120 + 8) / 400]"
+            "[Stage 4:>                (0 + 0) / 100]"))
+        # throttled
+        self.assertTrue(parser.parse(
+            "[Stage 3:=====>         (130 + 8) / 400]"))
+        parser.flush()
+
+        updates = [(kwargs['progressStage'], kwargs['progressDone'],
+                    kwargs['progressTotal'])
+                   for _, kwargs in msg_service.messages]
+        self.assertEqual(updates, [(3, 120, 400), (4, 0, 100),
+                                   (3, 130, 400)])
+
+
+class TestProgressThrottle(TestCase):
+
+    def test(self):
+        now = [0.0]
+        throttle = ProgressThrottle(2, clock=lambda: now[0])
+
+        self.assertTrue(throttle.offer(1, 1, 10))
+        self.assertFalse(throttle.offer(1, 2, 10))
+        self.assertFalse(throttle.offer(1, 3, 10))
+
+        # other stages aren't affected
+        self.assertTrue(throttle.offer(2, 1, 5))
+
+        # the last update is always accepted
+        self.assertTrue(throttle.offer(2, 5, 5))
+
+        self.assertEqual(throttle.pop_pending(only_due=True), [])
+
+        now[0] = 0.5
+        self.assertEqual(throttle.pop_pending(only_due=True), [(1, 3, 10)])
+        self.assertFalse(throttle.has_pending())
+
+        self.assertFalse(throttle.offer(1, 4, 10))
+        self.assertEqual(throttle.pop_pending(), [(1, 4, 10)])
+
+
+class TestParserDispatcher(TestCase):
+
+    def test_registered_parsers(self):
+        self.assertEqual(PARSERS[0:3], [ApplicationMasterLaunchedParser,
+                                        TaskFinishedWithProgressParser,
+                                        MessageFromShellParser])
+
+    def test_dispatch(self):
+        cookie = uuid.uuid4().hex
+        msg_service = MessageServiceMock()
+        dispatcher = ParserDispatcher(msg_service, cookie)
+
+        for invalid_line in GENERAL_INVALID_LINES:
+            self.assertFalse(dispatcher.dispatch(invalid_line))
+
+        self.assertTrue(dispatcher.dispatch(
+            "14/08/23 12:48:53 INFO scheduler.TaskSetManager: "
+            "Finished TID 0 in 7443 ms on localhost (progress: 4/10)"))
+
+    def test_prefilter(self):
+        parsed_lines = []
+
+        class Parser(object):
+            PREFILTER = ("foo", "bar")
+
+            def __init__(self, message_service, cookie):
+                pass
+
+            def parse(self, subline):
+                parsed_lines.append(subline)
+                return True
+
+        dispatcher = ParserDispatcher(MessageServiceMock(), "",
+                                      parser_classes=[Parser])
+
+        self.assertFalse(dispatcher.dispatch("xxxxxx"))
+        self.assertTrue(dispatcher.dispatch("xx bar xx"))
+        self.assertEqual(parsed_lines, ["xx bar xx"])
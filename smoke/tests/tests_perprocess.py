@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from smoke.services.perprocess import PerProcess
+
+
+class TestPerProcess(TestCase):
+
+    def test_get(self):
+        created = []
+        instance = PerProcess(lambda: created.append(object()) or created[-1])
+
+        self.assertIs(instance.get(), instance.get())
+        self.assertEqual(len(created), 1)
+
+        # As seen by a forked child
+        instance._pid = -1
+        self.assertIs(instance.get(), created[1])
+        self.assertEqual(len(created), 2)
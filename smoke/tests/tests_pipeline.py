@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+from django.test import TestCase
+from smoke.services.pipeline import MeteredQueue, StdoutReader, \
+    PublisherThread
+
+
+class PublisherMock(object):
+
+    def __init__(self):
+        self.published = []
+        self.flushes = 0
+
+    def publish_message(self, message, flush=False):
+        self.published.append(message)
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TestStdoutReader(TestCase):
+
+    def test(self):
+        stream = io.BytesIO(b"line 1\nline 2\n\nline 4")
+        reader = StdoutReader(stream, queue_size=2, block_size=8)
+        reader.start()
+
+        self.assertEqual(list(reader.iter_batches()),
+                         [["line 1"], ["line 2"], ["line 4"]])
+        reader.join()
+
+        stats = reader.queue.get_stats()
+        self.assertEqual(stats['items'], 3)
+        self.assertTrue(stats['max_depth'] <= 2)
+
+    def test_stop(self):
+        stream = io.BytesIO(b"line\n" * 100)
+        reader = StdoutReader(stream, queue_size=1, block_size=8)
+        reader.start()
+
+        # The consumer fails after the first batch: the reader is blocked
+        next(reader.iter_batches())
+        reader.stop()
+
+        reader.join(5)
+        self.assertFalse(reader.is_alive())
+
+
+class TestPublisherThread(TestCase):
+
+    def test_keeps_order(self):
+        publisher = PublisherMock()
+        thread = PublisherThread(publisher, queue_size=3)
+        thread.start()
+
+        for i in range(10):
+            thread.publish_message("msg-{0}".format(i))
+        thread.stop()
+
+        self.assertEqual(publisher.published,
+                         ["msg-{0}".format(i) for i in range(10)])
+        self.assertEqual(publisher.flushes, 1)
+
+
+class TestMeteredQueue(TestCase):
+
+    def test_stats(self):
+        queue = MeteredQueue(5)
+        for i in range(3):
+            queue.put_metered(i)
+        queue.get()
+
+        stats = queue.get_stats()
+        self.assertEqual(stats['items'], 3)
+        self.assertEqual(stats['max_depth'], 3)
+        self.assertEqual(stats['blocked_puts'], 0)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import signal
+import subprocess
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke.services.cancel import CancelWatcher
+from smoke.services.remote import BaseRemoteCommand, JobProcesses, \
+    KillRemoteProcesses, SshConnectionManager
+from smoke.tests.utils import MessageServiceMock
+
+
+class TestSshConnectionManager(TestCase):
+
+    def _manager(self, max_channels=2):
+        return SshConnectionManager(max_channels=max_channels,
+                                    control_dir=tempfile.gettempdir(),
+                                    control_persist=60,
+                                    check_interval=30)
+
+    def test_options_before_host(self):
+        manager = self._manager()
+        args = manager.ssh_args(["ssh", "user@host"])
+
+        self.assertEqual(args[0], "ssh")
+        self.assertEqual(args[-1], "user@host")
+        self.assertIn("ControlMaster=auto", args)
+        self.assertIn("ControlPath=" + manager.control_path(
+            ["ssh", "user@host"]), args)
+
+    def test_health_check_is_cached(self):
+        manager = self._manager()
+
+        # `true` accepts (and ignores) any argument, so the check succeeds
+        manager.ensure_connection(["true", "host"])
+        manager.ensure_connection(["true", "host"])
+
+        self.assertEqual(manager.stats['checks'], 1)
+        self.assertEqual(manager.stats['connects'], 0)
+
+    def test_reconnects_when_check_fails(self):
+        manager = self._manager()
+
+        manager.ensure_connection(["false", "host"])
+
+        self.assertEqual(manager.stats['failed_checks'], 1)
+        self.assertEqual(manager.stats['failed_connects'], 1)
+
+    def test_channels_are_capped(self):
+        manager = self._manager(max_channels=1)
+
+        manager.acquire_channel(["ssh", "host"])
+        self.assertRaises(Exception, manager.acquire_channel,
+                          ["ssh", "host"], timeout=0.01)
+
+        manager.release_channel(["ssh", "host"])
+        manager.acquire_channel(["ssh", "host"], timeout=0.01)
+
+
+class FailingParserCommand(BaseRemoteCommand):
+
+    def _process_incoming_line(self, cookie, subline):
+        raise ValueError("Parser error")
+
+
+@override_settings(SSH_GATEWAYS=None, JOB_ENGINE='prefork',
+                   OUTPUT_PIPELINE_ENABLED=True,
+                   OUTPUT_PIPELINE_BLOCKS_QUEUE_SIZE=1)
+class TestReadStdout(TestCase):
+
+    def test_process_is_killed_on_error(self):
+        process = subprocess.Popen(["yes"], stdout=subprocess.PIPE,
+                                   preexec_fn=os.setsid)
+        command = FailingParserCommand(MessageServiceMock(), "c0ffee")
+
+        self.assertRaises(ValueError, command._read_stdout, process)
+        self.assertEqual(process.wait(), -signal.SIGTERM)
+
+    @override_settings(JOB_ENGINE='eventloop')
+    def test_process_is_killed_on_error_eventloop(self):
+        self.test_process_is_killed_on_error()
+
+
+class TestJobProcesses(TestCase):
+
+    def _start(self):
+        return subprocess.Popen(["sleep", "30"], preexec_fn=os.setsid)
+
+    def test_cancel_kills_processes_of_job(self):
+        job_processes = JobProcesses()
+        process = self._start()
+        other_process = self._start()
+        job_processes.add("job1", process)
+        job_processes.add("job2", other_process)
+
+        self.assertEqual(job_processes.cancel("job1"), 1)
+        process.wait()
+
+        self.assertTrue(job_processes.is_cancelled("job1"))
+        self.assertIsNone(other_process.poll())
+        other_process.kill()
+        other_process.wait()
+
+    def test_process_started_after_cancel_is_killed(self):
+        job_processes = JobProcesses()
+        job_processes.cancel("job1")
+
+        process = self._start()
+        job_processes.add("job1", process)
+
+        self.assertEqual(process.wait(), -signal.SIGTERM)
+
+    def test_remote_of(self):
+        job_processes = JobProcesses()
+        self.assertEqual(job_processes.remote_of("job1"), ("job1", None))
+
+        job_processes.set_remote("job1", "job0", ["ssh", "gateway1"])
+        self.assertEqual(job_processes.remote_of("job1"),
+                         ("job0", ["ssh", "gateway1"]))
+
+        job_processes.forget("job1")
+        self.assertEqual(job_processes.remote_of("job1"), ("job1", None))
+
+
+@override_settings(SSH_GATEWAYS=None, SSH_MULTIPLEXING=False)
+class TestKillRemoteProcesses(TestCase):
+
+    def test_kills_with_remote_cookie(self):
+        command = KillRemoteProcesses(MessageServiceMock(), "job1", "job0",
+                                      ["ssh", "gateway1"])
+
+        args = command.get_command()
+        self.assertEqual(args[:2], ["ssh", "gateway1"])
+        self.assertIn("DATATSUNAMI_COOKIE=job0 ", args[-1])
+        self.assertNotIn("job1", args[-1])
+
+
+class TestCancelWatcher(TestCase):
+
+    def test_calls_on_cancel_once(self):
+        calls = []
+        watcher = CancelWatcher("job1", lambda: calls.append(1), 0.01,
+                                is_requested=lambda cookie: True)
+        watcher.start()
+        watcher.join(1)
+
+        self.assertFalse(watcher.is_alive())
+        self.assertEqual(calls, [1])
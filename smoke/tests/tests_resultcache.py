@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke.services.resultcache import ResultCache, result_cache_key
+from smoke.tests.utils import RedisKeysMock
+
+
+class RedisExpiringKeysMock(RedisKeysMock):
+    """RedisKeysMock with the commands used by the result cache"""
+
+    def __init__(self):
+        super(RedisExpiringKeysMock, self).__init__()
+        self.ttls = {}
+
+    def exists(self, key):
+        return key in self.data
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+
+class TestResultCacheKey(TestCase):
+
+    def test_normalized_script(self):
+        key = result_cache_key("val a = 1\nprintln(a)", "spark-shell")
+
+        self.assertEqual(
+            result_cache_key("\nval a = 1  \r\nprintln(a)\n\n", "spark-shell"),
+            key)
+        self.assertNotEqual(result_cache_key("val a = 1\nprintln(a)", "cat"),
+                            key)
+        self.assertNotEqual(result_cache_key("val a = 2\nprintln(a)",
+                                             "spark-shell"), key)
+
+    def test_settings_in_key(self):
+        with override_settings(REMOTE_SPARK_SHELL_PATH_OPTS="--a"):
+            key = result_cache_key("1", "spark-shell")
+        with override_settings(REMOTE_SPARK_SHELL_PATH_OPTS="--b"):
+            self.assertNotEqual(result_cache_key("1", "spark-shell"), key)
+
+
+class TestResultCache(TestCase):
+
+    def test_set_and_get(self):
+        connection = RedisExpiringKeysMock()
+        cache = ResultCache(connection, ttl=60, max_size=10000)
+        messages = [{'line': "line 1"}, {'line': "", 'jobFinishedOk': True}]
+
+        self.assertIsNone(cache.get("k1"))
+        cache.set("k1", messages, 0)
+
+        self.assertTrue(cache.has("k1"))
+        cached_result = cache.get("k1")
+        self.assertEqual(cached_result['messages'], messages)
+        self.assertEqual(cached_result['exit_status'], 0)
+        self.assertEqual(list(connection.ttls.values()), [60])
+
+    def test_size_eviction(self):
+        connection = RedisExpiringKeysMock()
+        messages = [{'line': "line {0}".format(i)} for i in range(20)]
+        cache = ResultCache(connection, ttl=60, max_size=10000)
+        cache.set("size", messages, 0)
+        entry_size = len(connection.data[cache._entry_key("size")])
+
+        # The sizes of the entries differ a few bytes (the time is saved)
+        cache = ResultCache(RedisExpiringKeysMock(), ttl=60,
+                            max_size=entry_size * 2 + 50)
+        for key in ("k1", "k2", "k3"):
+            cache.set(key, messages, 0)
+
+        self.assertFalse(cache.has("k1"))
+        self.assertTrue(cache.has("k2"))
+        self.assertTrue(cache.has("k3"))
+
+        cache = ResultCache(RedisExpiringKeysMock(), ttl=60,
+                            max_size=entry_size // 2)
+        cache.set("k1", messages, 0)
+        self.assertFalse(cache.has("k1"))
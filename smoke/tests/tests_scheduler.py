@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from smoke.services.scheduler import JobScheduler, SchedulerState
+from smoke.tests.utils import RedisKeysMock
+
+
+class TestSchedulerState(TestCase):
+
+    def test_caps_and_fairness(self):
+        state = SchedulerState()
+        for cookie in ("a1", "a2", "a3"):
+            state.enqueue(cookie, "alice")
+        state.enqueue("b1", "bob")
+
+        self.assertEqual(state.queue_order(), ["a1", "b1", "a2", "a3"])
+        self.assertEqual(state.dispatch(3, 2, now=0), ["a1", "b1", "a2"])
+
+        # Alice is capped: her next job waits even with a free slot
+        state.finish("b1", now=10)
+        self.assertEqual(state.dispatch(3, 2, now=10), [])
+        self.assertEqual(state.durations, [10])
+
+        state.finish("a1", now=20)
+        self.assertEqual(state.dispatch(3, 2, now=20), ["a3"])
+        self.assertEqual(state.queues, {})
+        self.assertEqual(state.users, [])
+
+    def test_estimate_wait(self):
+        state = SchedulerState({'durations': [60, 120]})
+        state.running = {"x": {'user': "u", 'start': 0}}
+
+        self.assertEqual(state.estimate_wait(0, 2, 30), 0)
+        self.assertEqual(state.estimate_wait(1, 2, 30), 90)
+        self.assertEqual(state.estimate_wait(3, 2, 30), 180)
+
+    def test_finish_queued_job(self):
+        state = SchedulerState()
+        state.enqueue("a1", "alice")
+
+        state.finish("a1", now=0)
+
+        self.assertEqual(state.queue_order(), [])
+        self.assertEqual(state.durations, [])
+
+
+class TestJobScheduler(TestCase):
+
+    def test_submit_and_finish(self):
+        scheduler = JobScheduler(RedisKeysMock(), "test", max_running=1,
+                                 max_running_per_user=1,
+                                 running_timeout=3600, default_duration=60)
+
+        launched = scheduler.submit("a1", "alice", {'script': "1"})
+        self.assertEqual(launched, [("a1", {'script': "1"})])
+
+        self.assertEqual(scheduler.submit("b1", "bob", {'script': "2"}), [])
+        self.assertEqual(scheduler.get_queue(), [("b1", 0, 60)])
+
+        launched = scheduler.finish("a1")
+        self.assertEqual(launched, [("b1", {'script': "2"})])
+        self.assertEqual(scheduler.get_queue(), [])
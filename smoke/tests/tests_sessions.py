@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import subprocess
+import sys
+
+from django.test import TestCase
+from smoke.services.sessions import SparkSessionPool, SparkShellSession
+
+
+FAKE_REPL = """
+import sys
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    line = line.strip()
+    if line == "exit":
+        break
+    if line.endswith("; () }"):
+        continue
+    if line.startswith("println(") and line.endswith(")"):
+        line = eval(line[len("println("):-1])
+    sys.stdout.write("scala> " + line + "\\n")
+    sys.stdout.flush()
+"""
+"""Echoes the lines (with the prompt), evaluates `println()` of string
+literals (Scala and Python string literals are alike). Blocks returning
+Unit print nothing
+"""
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSession(object):
+
+    def __init__(self, user, clock, ssh_gateway_args=None):
+        self.user = user
+        self.ssh_gateway_args = ssh_gateway_args
+        self.created = clock()
+        self.last_used = self.created
+        self.closed = False
+
+    def is_alive(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcess(object):
+
+    def __init__(self):
+        self.stdin = io.BytesIO()
+
+
+class TestSparkShellSession(TestCase):
+
+    def _session(self):
+        process = subprocess.Popen([sys.executable, "-c", FAKE_REPL],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   preexec_fn=os.setsid)
+        return SparkShellSession("user", process)
+
+    def test_output_until_marker(self):
+        session = self._session()
+
+        for cookie in ("cookie1", "cookie2"):
+            session.send_script("val a = 1\nval b = 2", cookie)
+            lines = list(session.iter_output(cookie))
+
+            self.assertEqual(lines, [b"val a = 1\n", b"val b = 2\n"])
+            self.assertTrue(session.last_script_finished)
+
+        self.assertEqual(session.scripts_run, 2)
+        session.close()
+        self.assertFalse(session.is_alive())
+
+    def test_session_ended_by_script(self):
+        session = self._session()
+
+        session.send_script("exit", "cookie1")
+        lines = list(session.iter_output("cookie1"))
+
+        self.assertEqual(lines, [])
+        self.assertFalse(session.last_script_finished)
+        session.close()
+
+    def test_sets_cookie_of_job(self):
+        process = FakeProcess()
+        session = SparkShellSession("user", process, cookie="cookie1")
+
+        session.send_script("val a = 1", "cookie2")
+
+        self.assertEqual(session.cookie, "cookie1")
+        self.assertTrue(process.stdin.getvalue().startswith(
+            b'{ System.setProperty("DATATSUNAMI_COOKIE", "cookie2") ; () }\n'
+            b'val a = 1\n'))
+
+
+class TestSparkSessionPool(TestCase):
+
+    def _pool(self, max_sessions=2):
+        self.clock = FakeClock()
+        return SparkSessionPool(max_sessions=max_sessions, idle_timeout=60,
+                                max_lifetime=3600, clock=self.clock)
+
+    def _start_session(self, user):
+        return FakeSession(user, self.clock)
+
+    def test_reuse_only_for_same_user(self):
+        pool = self._pool()
+
+        session, reused = pool.acquire("alice", self._start_session)
+        self.assertFalse(reused)
+        pool.release(session, reusable=True)
+
+        other_session, reused = pool.acquire("bob", self._start_session)
+        self.assertFalse(reused)
+        self.assertIsNot(other_session, session)
+
+        same_session, reused = pool.acquire("alice", self._start_session)
+        self.assertTrue(reused)
+        self.assertIs(same_session, session)
+
+    def test_reuse_only_on_same_gateway(self):
+        pool = self._pool()
+        start_session = lambda user: FakeSession(user, self.clock,
+                                                 ["ssh", "gateway1"])
+
+        session, _ = pool.acquire("alice", start_session, ["ssh", "gateway1"])
+        pool.release(session, reusable=True)
+
+        other_session, reused = pool.acquire("alice", self._start_session,
+                                             ["ssh", "gateway2"])
+        self.assertFalse(reused)
+        self.assertIsNot(other_session, session)
+
+        same_session, reused = pool.acquire("alice", self._start_session,
+                                            ["ssh", "gateway1"])
+        self.assertTrue(reused)
+        self.assertIs(same_session, session)
+
+    def test_idle_timeout_and_lifetime(self):
+        pool = self._pool()
+
+        session, _ = pool.acquire("alice", self._start_session)
+        pool.release(session, reusable=True)
+        self.clock.now += 61
+        pool.evict_expired()
+        self.assertTrue(session.closed)
+
+        session, _ = pool.acquire("alice", self._start_session)
+        self.clock.now += 3601
+        session.last_used = self.clock.now
+        pool.release(session, reusable=True)
+        self.assertTrue(session.closed)
+
+    def test_not_reusable_and_max_sessions(self):
+        pool = self._pool(max_sessions=1)
+
+        session, _ = pool.acquire("alice", self._start_session)
+        pool.release(session, reusable=False)
+        self.assertTrue(session.closed)
+
+        session, _ = pool.acquire("alice", self._start_session)
+        pool.release(session, reusable=True)
+        pool.acquire("bob", self._start_session)
+        self.assertTrue(session.closed)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from smoke.services.shellmessages import ShellMessageError, decode, \
+    encode_json, format_table
+
+
+COOKIE = "00b623f78474403490e352cd02e1c423"
+
+
+class TestDecodeXml(TestCase):
+
+    def test_output_filename(self):
+        message = decode('<msgFromShell cookie="{0}"><outputFileName> /out '
+                         '</outputFileName></msgFromShell>'.format(COOKIE))
+
+        self.assertEqual(message.cookie, COOKIE)
+        self.assertEqual(message.output_filename, "/out")
+        self.assertFalse(message.script_finished)
+
+    def test_typed_payloads(self):
+        message = decode(
+            '<msgFromShell cookie="{0}">'
+            '<errorLine>ERR 1</errorLine><errorLine>ERR &amp; 2</errorLine>'
+            '<metric name="rows">1500</metric>'
+            '<metric name="ratio">0.25</metric>'
+            '<table><columns><cell>word</cell><cell>count</cell></columns>'
+            '<row><cell>spark</cell><cell>10</cell></row>'
+            '<row><cell>smoke</cell><cell>7</cell></row></table>'
+            '<progress done="3" total="10" stage="load"/>'
+            '<scriptFinished/>'
+            '</msgFromShell>'.format(COOKIE))
+
+        self.assertEqual(message.error_lines, ["ERR 1", "ERR & 2"])
+        self.assertEqual(message.metrics, {'rows': 1500, 'ratio': 0.25})
+        self.assertEqual(message.table, {
+            'columns': ["word", "count"],
+            'rows': [["spark", "10"], ["smoke", "7"]]})
+        self.assertEqual(message.progress,
+                         {'done': 3, 'total': 10, 'stage': "load"})
+        self.assertTrue(message.script_finished)
+
+    def test_invalid(self):
+        INVALID = (
+            "",
+            "some text",
+            "<some_xml></some_xml>",
+            "<msgFromShell></msgFromShell>",
+            "<msgFromShell cookie='x'>",
+            "<msgFromShell cookie='x'><metric>1</metric></msgFromShell>",
+            "<msgFromShell cookie='x'><metric name='a'>b</metric>"
+            "</msgFromShell>",
+            "<msgFromShell cookie='x'><progress done='1'/></msgFromShell>",
+            "<msgFromShell cookie='x'><progress done='inf' total='1'/>"
+            "</msgFromShell>",
+            "<msgFromShell cookie='x'><metric name='a'>nan</metric>"
+            "</msgFromShell>",
+        )
+        for text in INVALID:
+            self.assertRaises(ShellMessageError, decode, text)
+
+    def test_entities_are_rejected(self):
+        BILLION_LAUGHS = (
+            '<?xml version="1.0"?>'
+            '<!DOCTYPE lolz [<!ENTITY lol "lol">'
+            '<!ENTITY lol2 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">]>'
+            '<msgFromShell cookie="x"><errorLine>&lol2;</errorLine>'
+            '</msgFromShell>')
+        EXTERNAL_ENTITY = (
+            '<!DOCTYPE m [<!ENTITY e SYSTEM "file:///etc/passwd">]>'
+            '<msgFromShell cookie="x"><errorLine>&e;</errorLine>'
+            '</msgFromShell>')
+
+        self.assertRaises(ShellMessageError, decode, BILLION_LAUGHS)
+        self.assertRaises(ShellMessageError, decode, EXTERNAL_ENTITY)
+
+
+class TestDecodeJson(TestCase):
+
+    def test_encode_and_decode(self):
+        line = encode_json(COOKIE, outputFileName="/out",
+                           metrics={'rows': 1500},
+                           table={'columns': ["a"], 'rows': [[1], [2]]},
+                           progress={'done': 1, 'total': 2})
+
+        self.assertTrue(line.startswith('@@{'))
+        self.assertNotIn(" ", line)
+        message = decode(line[2:-2])
+        self.assertEqual(message.cookie, COOKIE)
+        self.assertEqual(message.output_filename, "/out")
+        self.assertEqual(message.metrics, {'rows': 1500})
+        self.assertEqual(message.table,
+                         {'columns': ["a"], 'rows': [["1"], ["2"]]})
+        self.assertEqual(message.progress, {'done': 1, 'total': 2})
+
+    def test_invalid(self):
+        INVALID = (
+            '{',
+            '[]',
+            '{"cookie": "x", "scriptFinished": true}',
+            '{"v": 99, "cookie": "x", "scriptFinished": true}',
+            '{"v": 1, "scriptFinished": true}',
+            '{"v": 1, "cookie": "x", "metrics": [1]}',
+            '{"v": 1, "cookie": "x", "progress": {"done": 1}}',
+            '{"v": 1, "cookie": "x", "progress": {"done": 1e400, "total": 1}}',
+            '{"v": 1, "cookie": "x", "metrics": {"rows": NaN}}',
+        )
+        for text in INVALID:
+            self.assertRaises(ShellMessageError, decode, text)
+
+
+class TestFormatTable(TestCase):
+
+    def test(self):
+        table = {'columns': ["word", "n"],
+                 'rows': [["spark", "10"], ["a", "7"], ["b", "1"]]}
+
+        self.assertEqual(format_table(table, 2).splitlines(), [
+            "word  | n",
+            "------+---",
+            "spark | 10",
+            "a     | 7",
+            "(1 more rows)",
+        ])
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke import spark_job
+from smoke.models import Job
+from smoke.services import gateways
+from smoke.services.gateways import GatewayRouter
+from smoke.services.metrics import job_phase_timers
+from smoke.tests.utils import MessageServiceMock, RedisKeysMock
+
+
+class JobMessageServiceMock(MessageServiceMock):
+
+    error_count = 0
+
+    def stop_publisher_thread(self):
+        pass
+
+    def stop_recording(self):
+        return None
+
+    def get_publish_stats(self):
+        return {'messages': len(self.messages)}
+
+
+class UnsavableJob(Job):
+
+    class Meta:
+        proxy = True
+        app_label = 'smoke'
+
+    def save(self, *args, **kwargs):
+        raise Exception("database is down")
+
+
+@override_settings(SSH_BASE_ARGS=["false"], SSH_MULTIPLEXING=False,
+                   SSH_GATEWAYS=None, OUTPUT_PIPELINE_ENABLED=False,
+                   RESULT_CACHE_ENABLED=False, JOB_ENGINE='prefork',
+                   JOB_CANCEL_POLL_INTERVAL=60)
+class TestJobMetrics(TestCase):
+
+    def setUp(self):
+        self.recorded = []
+        self.originals = (spark_job.record_job_metrics,
+                          spark_job.is_cancel_requested, spark_job.Job)
+        spark_job.record_job_metrics = \
+            lambda *args: self.recorded.append(args)
+        spark_job.is_cancel_requested = lambda cookie: False
+
+    def tearDown(self):
+        (spark_job.record_job_metrics, spark_job.is_cancel_requested,
+         spark_job.Job) = self.originals
+
+    def _launch(self, cookie):
+        service = spark_job.SparkService(cookie=cookie)
+        service.message_service = JobMessageServiceMock()
+        service.launc_job("println(1)", "echo")
+
+    @override_settings(SSH_BASE_ARGS=["/nonexistent/ssh"])
+    def test_failed_job(self):
+        # Popen() fails: the job ends with an exception
+        self._launch("c0ffee")
+
+        [(action, status, timings, counters)] = self.recorded
+        self.assertEqual(status, Job.STATUS_FAILED)
+        self.assertIn('run', timings)
+        self.assertIsNone(job_phase_timers.pop("c0ffee"))
+
+    def test_failed_save(self):
+        spark_job.Job = UnsavableJob
+
+        with self.assertRaises(Exception):
+            self._launch("beef")
+
+        self.assertEqual(len(self.recorded), 1)
+        self.assertIsNone(job_phase_timers.pop("beef"))
+
+
+FAKE_SSH = """#!/bin/sh
+cat > /dev/null
+{0}
+"""
+
+
+@override_settings(SSH_BASE_ARGS=None, SSH_MULTIPLEXING=False,
+                   SSH_GATEWAY_PROBE_INTERVAL=0, SINGLE_ROUND_TRIP_UPLOAD=True,
+                   SPARK_SESSION_POOL_ENABLED=False,
+                   OUTPUT_PIPELINE_ENABLED=False, RESULT_CACHE_ENABLED=False,
+                   JOB_ENGINE='prefork', JOB_CANCEL_POLL_INTERVAL=60)
+class TestGatewayFailover(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # ssh can't connect to edge1 (exit status 255, no output)
+        self.gateways = {'edge1': [self._fake_ssh("edge1", "exit 255")],
+                         'edge2': [self._fake_ssh("edge2", "echo Spark")]}
+        self.router = GatewayRouter(RedisKeysMock(), self.gateways,
+                                    running_timeout=60)
+        self.router.record_probe('edge1', True, 0.1)
+        self.router.record_probe('edge2', True, 0.5)
+
+        self.recorded = []
+        self.originals = (spark_job.record_job_metrics,
+                          spark_job.is_cancel_requested,
+                          spark_job.get_gateway_router,
+                          gateways.get_gateway_router)
+        spark_job.record_job_metrics = \
+            lambda *args: self.recorded.append(args)
+        spark_job.is_cancel_requested = lambda cookie: False
+        spark_job.get_gateway_router = lambda: self.router
+        gateways.get_gateway_router = lambda: self.router
+
+    def tearDown(self):
+        (spark_job.record_job_metrics, spark_job.is_cancel_requested,
+         spark_job.get_gateway_router,
+         gateways.get_gateway_router) = self.originals
+        shutil.rmtree(self.tmp_dir)
+
+    def _fake_ssh(self, name, command):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(FAKE_SSH.format(command))
+        os.chmod(path, 0o755)
+        return path
+
+    def _launch(self):
+        with override_settings(SSH_GATEWAYS=self.gateways):
+            service = spark_job.SparkService(cookie="c0ffee")
+            service.message_service = JobMessageServiceMock()
+            service.launc_job("println(1)", "spark-shell")
+        [(action, status, timings, counters)] = self.recorded
+        return status
+
+    def test_fail_over(self):
+        self.assertEqual(self._launch(), Job.STATUS_FINISHED)
+
+        self.assertFalse(self.router.get_state().is_alive('edge1'))
+        self.assertEqual(self.router.get_state().running, {})
+
+    def test_started(self):
+        # Once spark-shell started, the job isn't run again
+        self.gateways['edge1'] = [self._fake_ssh("edge1",
+                                                 "echo Spark ; exit 255")]
+
+        self.assertEqual(self._launch(), Job.STATUS_FAILED)
+
+        self.assertTrue(self.router.get_state().is_alive('edge1'))
+
+    def test_all_failed(self):
+        self.gateways['edge2'] = self.gateways['edge1']
+
+        self.assertEqual(self._launch(), Job.STATUS_FAILED)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+from smoke.models import Job
+from smoke.services.parsers import TaskFinishedWithProgressParser
+from smoke.services.taskmetrics import DurationHistogram, \
+    TaskMetricsAggregator, job_task_metrics
+from smoke.tests.utils import MessageServiceMock
+
+
+class TestDurationHistogram(TestCase):
+
+    def test_quantiles(self):
+        histogram = DurationHistogram()
+        for ms in range(1, 1001):
+            histogram.add(ms)
+
+        self.assertIsNone(DurationHistogram().quantile(0.5))
+        for q, expected in ((0.5, 500), (0.9, 900), (0.99, 990)):
+            self.assertAlmostEqual(histogram.quantile(q), expected,
+                                   delta=expected * 0.1)
+        self.assertLess(len(histogram.counts), 50)
+
+
+class TestTaskMetricsAggregator(TestCase):
+
+    def _aggregator(self):
+        aggregator = TaskMetricsAggregator(straggler_factor=1.5,
+                                           straggler_min_tasks=10,
+                                           slowest_size=3)
+        for tid in range(20):
+            aggregator.add_task(1, tid, 1000, "host{0}".format(tid % 2))
+        aggregator.add_task(1, 20, 5000, "slow-host")
+        aggregator.add_task(1, 21, 4000, "slow-host")
+        for tid in range(22, 25):
+            aggregator.add_task(2, tid, 100000, "host0")
+        return aggregator
+
+    def test_stages(self):
+        stages = self._aggregator().to_dict()['stages']
+
+        self.assertEqual([stage['tasks'] for stage in stages], [22, 3])
+        self.assertEqual(stages[0]['min_ms'], 1000)
+        self.assertEqual(stages[0]['max_ms'], 5000)
+        self.assertEqual(stages[0]['p50_ms'], 1000)
+        self.assertEqual(stages[0]['straggler_count'], 2)
+        self.assertEqual(stages[0]['stragglers'], [
+            {'tid': 20, 'ms': 5000, 'host': "slow-host"},
+            {'tid': 21, 'ms': 4000, 'host': "slow-host"},
+        ])
+        # Too few tasks to look for stragglers
+        self.assertEqual(stages[1]['stragglers'], [])
+
+    def test_hosts(self):
+        hosts = self._aggregator().to_dict()['hosts']
+
+        self.assertEqual([host['host'] for host in hosts],
+                         ["host0", "slow-host", "host1"])
+        self.assertEqual(hosts[0]['tasks'], 13)
+        self.assertEqual(hosts[0]['total_ms'], 310000)
+        self.assertEqual(hosts[1]['avg_ms'], 4500)
+        self.assertEqual(hosts[1]['stragglers'], 2)
+
+    def test_saved_with_job(self):
+        job = Job(script="// title", start=timezone.now(), end=timezone.now())
+        self.assertIsNone(job.get_task_metrics())
+        job.set_task_metrics(self._aggregator().to_dict())
+        job.save()
+
+        response = self.client.get(reverse('job_details', args=[job.id]))
+
+        self.assertEqual(response.context['task_metrics']['hosts'][1]['host'],
+                         "slow-host")
+        self.assertContains(response, "TID 20: 5000 ms on slow-host")
+
+
+class TestJobTaskMetrics(TestCase):
+
+    LINE = ("14/08/23 12:48:53 INFO scheduler.TaskSetManager: Finished TID 0 "
+            "in 7443 ms on host0 (progress: 4/10)")
+
+    def test_created_by_the_job(self):
+        aggregator = job_task_metrics.create("c0ffee")
+        parser = TaskFinishedWithProgressParser(MessageServiceMock(), "c0ffee")
+
+        self.assertTrue(parser.parse(self.LINE))
+        self.assertIs(job_task_metrics.pop("c0ffee"), aggregator)
+        self.assertTrue(aggregator.has_tasks())
+
+    def test_job_ended(self):
+        # Like the commands run after the end of a cancelled job
+        parser = TaskFinishedWithProgressParser(MessageServiceMock(), "c0ffee")
+
+        self.assertTrue(parser.parse(self.LINE))
+        self.assertIsNone(job_task_metrics.get("c0ffee"))
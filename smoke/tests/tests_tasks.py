@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from smoke import tasks
+
+
+class ResultCacheMock(object):
+
+    def __init__(self, result=None):
+        self.result = result
+
+    def get(self, key):
+        return self.result
+
+
+class SchedulerMock(object):
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, cookie, user, job_args):
+        self.submitted.append((cookie, user, job_args))
+        return []
+
+    def finish(self, cookie):
+        return []
+
+    def get_queue(self):
+        return []
+
+
+class SparkServiceMock(object):
+
+    launched = []
+
+    def __init__(self, cookie=None, first_seq=0):
+        self.cookie = cookie
+
+    def launc_job(self, script, action, user, use_cache, submitted_at,
+                  queued_at, cached_result=None):
+        SparkServiceMock.launched.append((self.cookie, cached_result))
+
+
+@override_settings(RESULT_CACHE_ENABLED=True, SCHEDULER_ENABLED=True,
+                   JOB_ENGINE='prefork')
+class TestSparkJobWithCachedResult(TestCase):
+
+    def setUp(self):
+        self.scheduler = SchedulerMock()
+        self.originals = (tasks.get_result_cache, tasks.get_scheduler,
+                          tasks.SparkService)
+        tasks.get_scheduler = lambda: self.scheduler
+        tasks.SparkService = SparkServiceMock
+        SparkServiceMock.launched = []
+
+    def tearDown(self):
+        (tasks.get_result_cache, tasks.get_scheduler,
+         tasks.SparkService) = self.originals
+
+    def test_cached(self):
+        result = {'messages': [], 'exit_status': 0, 'created': 0}
+        tasks.get_result_cache = lambda: ResultCacheMock(result)
+
+        tasks.spark_job("println(1)", "spark-shell", "c0ffee", 3, "alice",
+                        scheduled=False)
+
+        self.assertEqual(SparkServiceMock.launched, [("c0ffee", result)])
+        self.assertEqual(self.scheduler.submitted, [])
+
+    def test_no_longer_cached(self):
+        tasks.get_result_cache = lambda: ResultCacheMock(None)
+
+        tasks.spark_job("println(1)", "spark-shell", "c0ffee", 3, "alice",
+                        scheduled=False)
+
+        # The job isn't run: it goes through the scheduler
+        self.assertEqual(SparkServiceMock.launched, [])
+        [(cookie, user, job_args)] = self.scheduler.submitted
+        self.assertEqual((cookie, user), ("c0ffee", "alice"))
+        self.assertEqual(job_args['first_seq'], 3)
+        self.assertEqual(job_args['script'], "println(1)")
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+
+class TestIndexView(TestCase):
+
+    def test_renders(self):
+        response = self.client.get("/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('job_backlog',
+                                              args=["0123456789abcdef"]))
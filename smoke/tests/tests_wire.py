@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+from django.test import TestCase
+from smoke.services import wire
+
+
+class TestWireFormat(TestCase):
+
+    MESSAGES = [
+        {'line': "14/09/13 12:28:47 INFO ...", 'seq': 7,
+         'lineIsFromRemoteOutput': True},
+        {'line': "", 'seq': 8, 'progressUpdate': True, 'progressStage': "3",
+         'progressDone': 10, 'progressTotal': 200},
+        {'line': "Error: ñandú", 'seq': 9, 'errorLine': True,
+         'lineIsFromRemoteOutput': True},
+        {'line': "", 'queuePosition': 2, 'estimatedStartSeconds': 30},
+        {'line': "x", 'seq': 10, 'unknownKey': [1, 2]},
+    ]
+
+    def test_round_trip(self):
+        for message in self.MESSAGES:
+            self.assertEqual(wire.decode_message(wire.encode_message(message)),
+                             message)
+
+    def test_compact(self):
+        self.assertEqual(json.loads(wire.encode_message(self.MESSAGES[0])),
+                         [7, "14/09/13 12:28:47 INFO ...", 1])
+        self.assertEqual(json.loads(wire.encode_message(self.MESSAGES[1])),
+                         [8, "", 4, {'s': "3", 'd': 10, 't': 200}])
+
+        # False flags aren't encoded
+        self.assertEqual(wire.encode_message({'line': "a", 'errorLine': False}),
+                         '[null,"a",0]')
+
+        for message in self.MESSAGES[:3]:
+            self.assertTrue(len(wire.encode_message(message)) <
+                            len(json.dumps(message)) * 0.7)
+
+    def test_frame(self):
+        encoded = [wire.encode_message(message) for message in self.MESSAGES]
+        frame = wire.pack_frame(encoded)
+
+        self.assertTrue(frame.startswith("[1,["))
+        self.assertEqual(wire.decode_frame(frame), self.MESSAGES)
+        self.assertEqual(wire.decode_frame(wire.pack_frame([])), [])
+        self.assertEqual([wire.message_seq(data) for data in encoded],
+                         [7, 8, 9, None, 10])
+
+    def test_original_format(self):
+        data = json.dumps(self.MESSAGES[0])
+
+        self.assertEqual(wire.decode_frame(data), [self.MESSAGES[0]])
+        self.assertEqual(wire.decode_frame("[" + data + "]"),
+                         [self.MESSAGES[0]])
+        self.assertEqual(wire.message_seq(data), 7)
+
+    def test_unsupported_version(self):
+        with self.assertRaises(ValueError):
+            wire.decode_frame('[99,[1,"a",0]]')
+
+    def test_schema(self):
+        schema = wire.get_schema()
+        self.assertEqual(schema['version'], wire.WIRE_VERSION)
+        self.assertEqual(schema['flags'][0], 'lineIsFromRemoteOutput')
+        self.assertEqual(schema['fields']['s'], 'progressStage')
@@ -2,6 +2,8 @@
 
 from __future__ import unicode_literals
 
+import threading
+
 
 class MessageServiceMock(object):
     """Mock of MessageService"""
@@ -18,5 +20,38 @@ class MessageServiceMock(object):
     def log_and_publish_error(self, message, *args, **kwargs):
         self.messages.append((message, args, kwargs))
 
+    def flush(self):
+        pass
+
+    def get_publish_stats(self):
+        return {}
+
     def get_log(self):
         pass
+
+    def iter_log_lines(self):
+        return iter([])
+
+    def close(self):
+        pass
+
+
+class RedisKeysMock(object):
+    """Mock of the Redis connection, with the commands used by the
+    scheduler (the tests of other services add theirs)
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def lock(self, name, timeout=None, sleep=0.1):
+        return threading.Lock()
@@ -8,7 +8,13 @@ admin.autodiscover()
 urlpatterns = patterns('',
     url(r'^$', views.index, name='index'),
     url(r'^post_job', views.post_job, name='post_job'),
+    url(r'^cancel_job', views.cancel_job, name='cancel_job'),
+    url(r'^job_backlog/(?P<cookie>[0-9a-f]+)$', views.job_backlog,
+        name='job_backlog'),
+    url(r'^metrics$', views.metrics, name='metrics'),
     url(r'^job_list', views.JobListView.as_view(), name='job_list'),
+    url(r'^job/(?P<pk>\d+)/log$', views.download_job_log,
+        name='download_job_log'),
     url(r'^job/(?P<pk>\d+)/', views.JobDetailView.as_view(),
         name='job_details'),
     url(r'^admin/', include(admin.site.urls)),
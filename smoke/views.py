@@ -2,13 +2,29 @@
 
 from __future__ import unicode_literals
 
-from django.http.response import HttpResponse
-from django.shortcuts import render
+import calendar
+import json
+import re
+
+from django.conf import settings
+from django.http.response import HttpResponse, HttpResponseNotModified, \
+    StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.shortcuts import render, get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers, \
+    add_never_cache_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, \
+    quote_etag
+from django.utils.text import compress_sequence
 from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_safe
 from django.views.generic import ListView
 from django.views.generic.detail import DetailView
 from smoke import tasks
 from smoke.models import Job
+from smoke.services import wire
+from smoke.services.messages import get_job_backlog, is_compact_wire_format
+from smoke.services.metrics import get_redis_metrics
 
 
 @ensure_csrf_cookie
@@ -17,27 +33,236 @@ def index(request):
     job_id = request.GET.get('restore_job_id', None)
     if job_id:
         context['script'] = Job.objects.get(id=job_id).script
+    context['result_cache_enabled'] = settings.RESULT_CACHE_ENABLED
+    context['wire_schema'] = json.dumps(wire.get_schema())
     return render(request, 'smoke/index.html', context)
 
 
+def _get_user(request):
+    """Returns the name of the user (the address of the client, if the
+    user isn't authenticated), used to share the cluster between users
+    """
+    if request.user.is_authenticated():
+        return request.user.get_username()
+    return request.META.get('REMOTE_ADDR') or 'anonymous'
+
+
 @ensure_csrf_cookie
 def post_job(request):
     if request.method == 'POST':
         script = request.POST['script']
         action = request.POST['action']
-        tasks.spark_job_async(script, action)
-        return HttpResponse('ok')
+        bypass_cache = request.POST.get('bypass_cache') in ('1', 'true')
+        cookie = tasks.spark_job_async(script, action, _get_user(request),
+                                       bypass_cache)
+        return HttpResponse(json.dumps({'status': 'ok', 'cookie': cookie}),
+                            content_type="application/json")
     return HttpResponse('ERROR: only post permited')
 
 
+@ensure_csrf_cookie
+def cancel_job(request):
+    if request.method == 'POST':
+        tasks.cancel_job(request.POST['cookie'])
+        return HttpResponse(json.dumps({'status': 'ok'}),
+                            content_type="application/json")
+    return HttpResponse('ERROR: only post permited')
+
+
+def job_backlog(request, cookie):
+    """Returns the latest messages of a job, with a `seq` greater than the
+    `after` parameter: a frame (see `wire.pack_frame()`) or, with the 'json'
+    MESSAGES_WIRE_FORMAT, a JSON list
+    """
+    try:
+        after_seq = int(request.GET['after'])
+    except (KeyError, ValueError):
+        after_seq = None
+    messages = get_job_backlog(cookie, after_seq)
+    if is_compact_wire_format():
+        content = wire.pack_frame(messages)
+    else:
+        content = "[" + ",".join(messages) + "]"
+    response = HttpResponse(content, content_type="application/json")
+    add_never_cache_headers(response)
+    return response
+
+
+@require_safe
+def metrics(request):
+    """Returns the metrics of the jobs, in the Prometheus text format"""
+    response = HttpResponse(get_redis_metrics().render(),
+                            content_type="text/plain; version=0.0.4")
+    add_never_cache_headers(response)
+    return response
+
+
 class JobListView(ListView):
+    """Shows the latests jobs. The `before` parameter (id of a job)
+    is used to show older jobs.
+    """
     template_name = "smoke/job_list.html"
     model = Job
+    jobs_per_page = 40
 
     def get_queryset(self):
-        return Job.objects.latests_in_reverse_chronological()
+        before = None
+        try:
+            before_id = int(self.request.GET.get('before', ''))
+        except ValueError:
+            before_id = None
+        if before_id is not None:
+            before = Job.objects.only('id', 'start').filter(
+                id=before_id).first()
+        return Job.objects.latests_in_reverse_chronological(
+            before=before, count=self.jobs_per_page)
+
+    def get_context_data(self, **kwargs):
+        context = super(JobListView, self).get_context_data(**kwargs)
+        jobs = list(context['object_list'])
+        context['object_list'] = jobs
+        context['older_jobs_before'] = jobs[-1].id \
+            if len(jobs) == self.jobs_per_page else None
+        return context
 
 
 class JobDetailView(DetailView):
+    """Shows a job, with a page of its log (the lines from the
+    `from_line` parameter)
+    """
     template_name = "smoke/job_details.html"
     model = Job
+
+    def get_queryset(self):
+        return Job.objects.defer('log')
+
+    def get_context_data(self, **kwargs):
+        context = super(JobDetailView, self).get_context_data(**kwargs)
+
+        lines_per_page = settings.JOB_LOG_LINES_PER_PAGE
+        line_count = self.object.get_log_line_count()
+        last_page_start = max(line_count - 1, 0) // lines_per_page * \
+            lines_per_page
+
+        try:
+            start = int(self.request.GET.get('from_line', 1)) - 1
+        except ValueError:
+            start = 0
+        start = min(max(start, 0), last_page_start)
+        end = min(start + lines_per_page, line_count)
+
+        context.update({
+            'log_text': "\n".join(self.object.get_log_lines(start, end)),
+            'log_line_count': line_count,
+            'log_first_line': start + 1,
+            'log_last_line': end,
+            'log_previous_page': max(start - lines_per_page, 0) + 1
+            if start > 0 else None,
+            'log_next_page': end + 1 if end < line_count else None,
+            'log_last_page': last_page_start + 1,
+            'task_metrics': self.object.get_task_metrics(),
+        })
+        return context
+
+
+BYTE_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _parse_byte_range(header, size):
+    """Parses the value of the `Range` header.
+
+    :returns: (start, end) of the range (end excluded), (size, size) if
+        the range can't be satisfied, or None if the header isn't valid
+        or has more than one range (the whole log is returned)
+    """
+    match = BYTE_RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last `last` bytes
+        suffix_length = int(last)
+        if suffix_length == 0:
+            return size, size
+        return max(size - suffix_length, 0), size
+
+    start = int(first)
+    if last:
+        if int(last) < start:
+            return None
+        end = min(int(last) + 1, size)
+    else:
+        end = size
+    if start >= size:
+        return size, size
+    return start, end
+
+
+@require_safe
+def download_job_log(request, pk):
+    """Streams the log of a finished job. Supports gzip (when the log
+    is returned complete), a single byte range, and conditional
+    requests (the log of a saved job never changes).
+    """
+    job = get_object_or_404(Job.objects.defer('script', 'log'), pk=pk)
+    size = job.get_log_size()
+    end_timestamp = calendar.timegm(job.end.utctimetuple())
+    last_modified = http_date(end_timestamp)
+    etag = "job-{0}-{1}-{2}".format(job.id, size, end_timestamp)
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or if_range in (quote_etag(etag), last_modified):
+            byte_range = _parse_byte_range(request.META['HTTP_RANGE'], size)
+
+    gzipped = byte_range is None and \
+        re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if gzipped:
+        # The gzipped log is a different representation
+        etag += "-gzip"
+    etag = quote_etag(etag)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        not_modified = '*' in etags or etag in map(quote_etag, etags)
+    else:
+        not_modified = if_modified_since is not None and \
+            if_modified_since >= end_timestamp
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    elif byte_range is not None and byte_range[0] >= size:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = "bytes */{0}".format(size)
+    elif byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(job.iter_log_data(start, end),
+                                         status=206)
+        response['Content-Range'] = "bytes {0}-{1}/{2}".format(
+            start, end - 1, size)
+        response['Content-Length'] = str(end - start)
+    elif gzipped:
+        response = StreamingHttpResponse(
+            compress_sequence(job.iter_log_data()))
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(job.iter_log_data())
+        response['Content-Length'] = str(size)
+
+    if response.status_code != 416:
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+    if response.status_code in (200, 206):
+        response['Content-Type'] = "text/plain; charset=utf-8"
+        response['Content-Disposition'] = \
+            "attachment; filename=job-{0}.log".format(job.id)
+    response['Accept-Ranges'] = "bytes"
+    patch_vary_headers(response, ('Accept-Encoding',))
+    patch_cache_control(response, public=True,
+                        max_age=settings.JOB_LOG_DOWNLOAD_MAX_AGE)
+    return response
@@ -38,6 +38,19 @@ ALLOWED_HOSTS = '*'
 # If in your server you have `$SPARK_PREFIX`, you don't need
 #  to set `REMOTE_SPARK_SHELL_PATH`
 #
+# With many servers (gateways), set `SSH_GATEWAYS` instead: the jobs are
+#  routed to the least loaded one, and fail over if one is down:
+#
+# SSH_GATEWAYS = {
+#     'edge1': ["ssh", "hadoop@10.6.10.244"],
+#     'edge2': ["ssh", "hadoop@10.6.10.245"],
+# }
+#
+# To try Smoke without a Spark cluster, use the fake remote (runs the
+#  commands locally, with a fake spark-shell):
+#
+# SSH_BASE_ARGS = ["/path/to/smoke/dev/fake_remote/ssh", "fake-host"]
+#
 
 SSH_BASE_ARGS = ["ssh", "-o", "StrictHostKeyChecking=no",
     "hadoop_user@hostname_or_ip_where_spark_is_installed"]